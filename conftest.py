@@ -20,7 +20,7 @@ sys.path.insert(0, ROOT)
 
 
 # import fake backend components
-from tests.fake_backend import FakeDB, fake_ask_model
+from tests.fake_backend import FakeDB, fake_ask_model, fake_stream_model
 import backend.fake_DAL as fake_DAL
 import backend.DAL as DAL
 
@@ -49,8 +49,14 @@ def mock_backend(monkeypatch, request):
     monkeypatch.setattr(chat_server, "chat_dal", fake_DAL.chat_dal)
     monkeypatch.setattr(messages_server, "messages_dal", fake_DAL.messages_dal)
 
+    # Start every test with an empty reply cache
+    import backend.reply_cache as reply_cache
+
+    reply_cache.reply_cache.clear()
+
     # Patch model client
     monkeypatch.setattr(chat_server, "ask_model", fake_ask_model)
+    monkeypatch.setattr(chat_server, "stream_model", fake_stream_model)
     monkeypatch.setattr(model_client, "ask_model", fake_ask_model)
 
     # Seed chat for specific tests
@@ -59,6 +65,17 @@ def mock_backend(monkeypatch, request):
         "test_update_chat",
         "test_delete_chat",
         "test_send_message",
+        "test_send_message_stream",
+        "test_send_message_version_conflict",
+        "test_send_message_trims_context",
+        "test_send_voice_message",
+        "test_send_voice_message_stream",
+        "test_send_voice_message_errors",
+        "test_send_voice_message_live",
+        "test_send_voice_message_upload",
+        "test_async_send_message",
+        "test_async_send_message_stream",
+        "test_async_send_voice_message",
     }:
         FAKE_DB.chats.insert_one({"_id": "123", "text": "hello"})
 
@@ -3,15 +3,20 @@
 import os
 from flask import Flask
 from flask_cors import CORS
+from backend.DAL import database_status, start_database_check
+from backend.jobs import start_job_recovery
+from backend.migrations import start_migrations
 from backend.routers.chat_server import chat_router
 from backend.routers.messages_server import messages_router
-from backend.routers.speech_server import speech_router
+from backend.routers.speech_server import SpooledRequest, speech_router
+from backend.uploads import upload_store
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+app.request_class = SpooledRequest
 CORS(app)
 
 # register all blueprints
@@ -20,6 +25,19 @@ app.register_blueprint(messages_router)
 app.register_blueprint(speech_router)
 
 
+def start_background_tasks():
+    """
+    start the threads every serving process runs for itself: the mongo
+    readiness check, indexes and data migrations, and failing the
+    transcription jobs a previous process did not finish. called by the
+    entry points (serve.py after each worker forks, asgi.py, the dev
+    server), never at import, so a preloading master starts no threads.
+    """
+    start_database_check()
+    start_migrations()
+    start_job_recovery(upload_store.delete)
+
+
 @app.route("/")
 def index():
     """server home page"""
@@ -32,6 +50,16 @@ def health_check():
     return {"status": "healthy"}
 
 
+@app.route("/ready")
+def ready_check():
+    """check the backend can reach the database"""
+    ready, error = database_status()
+    if not ready:
+        return {"status": "unavailable", "error": error}, 503
+    return {"status": "ready"}
+
+
 if __name__ == "__main__":
+    start_background_tasks()
     port = int(os.environ.get("PORT", 5050))
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,77 @@
+"""
+ASGI entry point for the machine learning client.
+
+Routes with an async variant (backend/routers/async_chat_server.py) run on
+Quart, so requests waiting on openai hold no thread. Every other request
+falls through to the regular Flask app from app.py, which stays available
+on its own for WSGI servers.
+
+    hypercorn asgi:app --bind 0.0.0.0:5050
+"""
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart
+from werkzeug.exceptions import HTTPException
+
+from app import app as flask_app
+from app import start_background_tasks
+from backend.routers.async_chat_server import async_chat_router
+from backend.routers.speech_server import AUDIO_SPOOL_MAX_BYTES
+
+# the largest audio upload plus room for the other form fields
+MAX_BODY_BYTES = AUDIO_SPOOL_MAX_BYTES + 1024 * 1024
+
+
+class AsyncFirst:  # pylint: disable=too-few-public-methods
+    """
+    dispatch http requests to the async app if it has a matching route and
+    to the wsgi app otherwise
+    """
+
+    def __init__(self, async_app, wsgi_app):
+        self.async_app = async_app
+        # the wsgi bridge reads whole bodies, allow the largest audio upload
+        self.wsgi_app = AsyncioWSGIMiddleware(wsgi_app, max_body_size=MAX_BODY_BYTES)
+
+    def handles(self, scope):
+        """
+        check if the async app has a route for this request
+        """
+        if scope["method"] == "OPTIONS":
+            # cors preflights are answered by flask-cors on the flask app
+            return False
+        adapter = self.async_app.url_map.bind("localhost")
+        try:
+            adapter.match(scope["path"], method=scope["method"])
+        except HTTPException:
+            return False
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.handles(scope):
+            await self.async_app(scope, receive, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+
+def create_async_app():
+    """
+    the quart app with the async routes
+    """
+    async_app = Quart(__name__)
+    # quart's default of 16 MB would refuse voice uploads the flask app takes
+    async_app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES
+    async_app.register_blueprint(async_chat_router)
+    # lifespan startup runs in every hypercorn worker
+    async_app.before_serving(start_background_tasks)
+    return async_app
+
+
+def create_app():
+    """
+    the combined ASGI app
+    """
+    return AsyncFirst(create_async_app(), flask_app)
+
+
+app = create_app()
@@ -2,7 +2,8 @@
 
 import os
 
-from typing import Any, Dict, List, Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 
 # see if we are in testing mode
 TESTING = os.environ.get("TESTING") == "1"
@@ -11,18 +12,46 @@ if TESTING:
     # use the fake DAL for testing
 
     from backend.fake_DAL import (  # pylint: disable=import-error
+        async_chat_dal,
+        async_messages_dal,
         chat_dal,
+        database_status,
         db,
+        jobs_dal,
         messages_dal,
+        start_database_check,
     )
 
-    __all__ = ["chat_dal", "db", "messages_dal"]
+    __all__ = [
+        "async_chat_dal",
+        "async_messages_dal",
+        "chat_dal",
+        "database_status",
+        "db",
+        "jobs_dal",
+        "messages_dal",
+        "start_database_check",
+    ]
 else:
 
     from dotenv import load_dotenv
-    from pymongo import MongoClient
     from pymongo.errors import PyMongoError
 
+    from backend.cache import EXPIRES_AT_INDEX  # pylint: disable=ungrouped-imports
+    from backend.chat_summary import summary_fields
+    from backend.chat_window import chat_window_projection, trim_window
+    from backend.mongo import MongoConnection, lazy_databases
+    from backend.queries import (
+        SUMMARY_PROJECTION,
+        SUMMARY_SORT,
+        append_update,
+        backfill_update,
+        chat_update,
+        chat_window_pipeline,
+        messages_since_pipeline,
+        summaries_filter,
+    )
+
     # Load environment variables from .env
     load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "../.env"))
 
@@ -34,9 +63,23 @@ else:
             "DATABASE_CONNECTION and DB_NAME must be set in the .env file"
         )
 
-    client = MongoClient(MONGODB_CONNECTION)
-    client.admin.command("ping")
-    db = client.get_database(DB_NAME)
+    # clients are created on first use and again in forked workers; the
+    # database is pinged in the background so import never waits on it
+    connection = MongoConnection(MONGODB_CONNECTION, DB_NAME)
+    db, async_db = lazy_databases(connection)
+
+    def start_database_check() -> None:
+        """
+        start pinging mongo in the background. called by every serving
+        process, not at import, so a preloading master does not connect.
+        """
+        connection.start_readiness_check()
+
+    def database_status() -> Tuple[bool, Optional[str]]:
+        """
+        whether mongo answered the last background ping, and the error if not
+        """
+        return connection.status()
 
     class chat_dal:
         """
@@ -48,6 +91,7 @@ else:
             """
             insert one chat document.
             """
+            chat_data = {**chat_data, **summary_fields(chat_data.get("messages", []))}
             try:
                 result = db.chats.insert_one(chat_data)
                 return str(result.inserted_id)
@@ -66,6 +110,50 @@ else:
                 print(f"Error finding chat: {e}")
                 return None
 
+        @staticmethod
+        def find_chat_window(
+            chat_id: str, limit: int, before: Optional[str] = None
+        ) -> Optional[Dict[str, Any]]:
+            """
+            find a chat with only the last `limit` messages, or the `limit`
+            messages right before the message with id `before`.
+            sets has_more when there are older messages left to load.
+            returns None if the chat or the before message does not exist.
+            """
+            try:
+                if before is None:
+                    chat = db.chats.find_one(
+                        {"_id": chat_id}, chat_window_projection(limit)
+                    )
+                else:
+                    pipeline = chat_window_pipeline(chat_id, limit, before)
+                    chat = next(db.chats.aggregate(pipeline), None)
+            except PyMongoError as e:
+                print(f"Error finding chat window: {e}")
+                return None
+            return trim_window(chat, limit)
+
+        @staticmethod
+        def find_messages_since(
+            chat_id: str,
+            since_id: Optional[str] = None,
+            since_timestamp: Optional[str] = None,
+        ) -> Optional[Dict[str, Any]]:
+            """
+            find only the messages of a chat that came after the message with
+            id since_id, or after since_timestamp.
+            returns None if the chat or the since_id message does not exist.
+            """
+            pipeline = messages_since_pipeline(chat_id, since_id, since_timestamp)
+            try:
+                chat = next(db.chats.aggregate(pipeline), None)
+            except PyMongoError as e:
+                print(f"Error finding new messages: {e}")
+                return None
+            if chat is None or chat.get("messages") is None:
+                return None
+            return chat
+
         @staticmethod
         def find_all_chats() -> List[Dict[str, Any]]:
             """
@@ -77,6 +165,27 @@ else:
                 print(f"Error finding chats: {e}")
                 return []
 
+        @staticmethod
+        def find_chat_summaries(
+            limit: int,
+            after: Optional[Tuple[Optional[str], str]] = None,
+            since: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+            """
+            find one page of chats, newest first, without their message history.
+            after is the (updated_at, _id) of the last chat on the previous page.
+            since keeps only chats updated after that timestamp.
+            """
+            try:
+                return list(
+                    db.chats.find(summaries_filter(after, since), SUMMARY_PROJECTION)
+                    .sort(SUMMARY_SORT)
+                    .limit(limit)
+                )
+            except PyMongoError as e:
+                print(f"Error finding chat summaries: {e}")
+                return []
+
         @staticmethod
         def update_one_chat(
             query_filter: Dict[str, Any], update_data: Dict[str, Any]
@@ -85,12 +194,47 @@ else:
             update one chat document matching the filter.
             """
             try:
-                result = db.chats.update_one(query_filter, {"$set": update_data})
+                result = db.chats.update_one(query_filter, chat_update(update_data))
                 return result.modified_count > 0
             except PyMongoError as e:
                 print(f"Error updating chat: {e}")
                 return False
 
+        @staticmethod
+        def backfill_summaries() -> int:
+            """
+            fill in summary fields on chats written before they existed.
+            runs server side and only touches chats whose fields are stale.
+            """
+            try:
+                result = db.chats.update_many(*backfill_update())
+                return result.modified_count
+            except PyMongoError as e:
+                print(f"Error backfilling chat summaries: {e}")
+                return 0
+
+        @staticmethod
+        def append_messages(
+            chat_id: str,
+            new_messages: List[Dict[str, Any]],
+            expected_version: Optional[int] = None,
+        ) -> bool:
+            """
+            atomically push messages onto the end of a chat.
+            when expected_version is given the push only happens if no other
+            append landed since the chat was read at that version.
+            """
+            if not new_messages:
+                return False
+            try:
+                result = db.chats.update_one(
+                    *append_update(chat_id, new_messages, expected_version)
+                )
+                return result.modified_count > 0
+            except PyMongoError as e:
+                print(f"Error appending messages: {e}")
+                return False
+
         @staticmethod
         def delete_one_chat(query_filter: Dict[str, Any]) -> bool:
             """
@@ -103,6 +247,175 @@ else:
                 print(f"Error deleting chat: {e}")
                 return False
 
+    class async_chat_dal:
+        """
+        chat_dal for async routes, on the async mongo client
+        """
+
+        @staticmethod
+        async def insert_one_chat(chat_data: Dict[str, Any]) -> str:
+            """
+            insert one chat document.
+            """
+            chat_data = {**chat_data, **summary_fields(chat_data.get("messages", []))}
+            try:
+                result = await async_db.chats.insert_one(chat_data)
+                return str(result.inserted_id)
+            except PyMongoError as e:
+                print(f"Error inserting chat: {e}")
+                return ""
+
+        @staticmethod
+        async def find_one_chat(
+            query_filter: Dict[str, Any],
+        ) -> Optional[Dict[str, Any]]:
+            """
+            find one chat document matching the filter.
+            """
+            try:
+                return await async_db.chats.find_one(query_filter)
+            except PyMongoError as e:
+                print(f"Error finding chat: {e}")
+                return None
+
+        @staticmethod
+        async def find_chat_window(
+            chat_id: str, limit: int, before: Optional[str] = None
+        ) -> Optional[Dict[str, Any]]:
+            """
+            find a chat with only one window of its messages, see
+            chat_dal.find_chat_window.
+            """
+            try:
+                if before is None:
+                    chat = await async_db.chats.find_one(
+                        {"_id": chat_id}, chat_window_projection(limit)
+                    )
+                else:
+                    pipeline = chat_window_pipeline(chat_id, limit, before)
+                    cursor = await async_db.chats.aggregate(pipeline)
+                    chat = next(iter(await cursor.to_list(1)), None)
+            except PyMongoError as e:
+                print(f"Error finding chat window: {e}")
+                return None
+            return trim_window(chat, limit)
+
+        @staticmethod
+        async def find_messages_since(
+            chat_id: str,
+            since_id: Optional[str] = None,
+            since_timestamp: Optional[str] = None,
+        ) -> Optional[Dict[str, Any]]:
+            """
+            find only the messages of a chat newer than a message id or
+            timestamp, see chat_dal.find_messages_since.
+            """
+            pipeline = messages_since_pipeline(chat_id, since_id, since_timestamp)
+            try:
+                cursor = await async_db.chats.aggregate(pipeline)
+                chat = next(iter(await cursor.to_list(1)), None)
+            except PyMongoError as e:
+                print(f"Error finding new messages: {e}")
+                return None
+            if chat is None or chat.get("messages") is None:
+                return None
+            return chat
+
+        @staticmethod
+        async def find_all_chats() -> List[Dict[str, Any]]:
+            """
+            find all chat documents.
+            """
+            try:
+                return await async_db.chats.find({}).to_list()
+            except PyMongoError as e:
+                print(f"Error finding chats: {e}")
+                return []
+
+        @staticmethod
+        async def find_chat_summaries(
+            limit: int,
+            after: Optional[Tuple[Optional[str], str]] = None,
+            since: Optional[str] = None,
+        ) -> List[Dict[str, Any]]:
+            """
+            find one page of chats, newest first, without their message
+            history, see chat_dal.find_chat_summaries.
+            """
+            try:
+                return (
+                    await async_db.chats.find(
+                        summaries_filter(after, since), SUMMARY_PROJECTION
+                    )
+                    .sort(SUMMARY_SORT)
+                    .limit(limit)
+                    .to_list()
+                )
+            except PyMongoError as e:
+                print(f"Error finding chat summaries: {e}")
+                return []
+
+        @staticmethod
+        async def update_one_chat(
+            query_filter: Dict[str, Any], update_data: Dict[str, Any]
+        ) -> bool:
+            """
+            update one chat document matching the filter.
+            """
+            try:
+                result = await async_db.chats.update_one(
+                    query_filter, chat_update(update_data)
+                )
+                return result.modified_count > 0
+            except PyMongoError as e:
+                print(f"Error updating chat: {e}")
+                return False
+
+        @staticmethod
+        async def backfill_summaries() -> int:
+            """
+            fill in summary fields on chats written before they existed.
+            """
+            try:
+                result = await async_db.chats.update_many(*backfill_update())
+                return result.modified_count
+            except PyMongoError as e:
+                print(f"Error backfilling chat summaries: {e}")
+                return 0
+
+        @staticmethod
+        async def append_messages(
+            chat_id: str,
+            new_messages: List[Dict[str, Any]],
+            expected_version: Optional[int] = None,
+        ) -> bool:
+            """
+            atomically push messages onto the end of a chat, optionally
+            checking its version.
+            """
+            if not new_messages:
+                return False
+            try:
+                result = await async_db.chats.update_one(
+                    *append_update(chat_id, new_messages, expected_version)
+                )
+                return result.modified_count > 0
+            except PyMongoError as e:
+                print(f"Error appending messages: {e}")
+                return False
+
+        @staticmethod
+        async def delete_one_chat(query_filter: Dict[str, Any]) -> bool:
+            """
+            delete one chat document matching the filter.
+            """
+            try:
+                result = await async_db.chats.delete_one(query_filter)
+                return result.deleted_count > 0
+            except PyMongoError as e:
+                print(f"Error deleting chat: {e}")
+                return False
+
     class messages_dal:
         """
         Messages DAL that correspond to chats
@@ -167,3 +480,176 @@ else:
             except PyMongoError as e:
                 print(f"Error deleting message: {e}")
                 return False
+
+    class async_messages_dal:
+        """
+        messages_dal for async routes, on the async mongo client
+        """
+
+        @staticmethod
+        async def insert_one_message(message_data: Dict[str, Any]) -> str:
+            """
+            insert one message document.
+            """
+            try:
+                result = await async_db.messages.insert_one(message_data)
+                return str(result.inserted_id)
+            except PyMongoError as e:
+                print(f"Error inserting message: {e}")
+                return ""
+
+        @staticmethod
+        async def find_one_message(
+            query_filter: Dict[str, Any],
+        ) -> Optional[Dict[str, Any]]:
+            """
+            find one message document matching the filter.
+            """
+            try:
+                return await async_db.messages.find_one(query_filter)
+            except PyMongoError as e:
+                print(f"Error finding message: {e}")
+                return None
+
+        @staticmethod
+        async def find_all_messages() -> List[Dict[str, Any]]:
+            """
+            find all message documents.
+            """
+            try:
+                return await async_db.messages.find({}).to_list()
+            except PyMongoError as e:
+                print(f"Error finding messages: {e}")
+                return []
+
+        @staticmethod
+        async def update_one_message(
+            query_filter: Dict[str, Any], update_data: Dict[str, Any]
+        ) -> bool:
+            """
+            update one message document matching the filter.
+            """
+            try:
+                result = await async_db.messages.update_one(
+                    query_filter, {"$set": update_data}
+                )
+                return result.modified_count > 0
+            except PyMongoError as e:
+                print(f"Error updating message: {e}")
+                return False
+
+        @staticmethod
+        async def delete_one_message(query_filter: Dict[str, Any]) -> bool:
+            """
+            delete one message document matching the filter.
+            """
+            try:
+                result = await async_db.messages.delete_one(query_filter)
+                return result.deleted_count > 0
+            except PyMongoError as e:
+                print(f"Error deleting message: {e}")
+                return False
+
+    class jobs_dal:
+        """
+        Background transcription jobs, kept in mongo so any replica can
+        answer a status query
+        """
+
+        @staticmethod
+        def insert_job(job_data: Dict[str, Any]) -> str:
+            """
+            insert one job document.
+            """
+            try:
+                result = db.jobs.insert_one(job_data)
+                return str(result.inserted_id)
+            except PyMongoError as e:
+                print(f"Error inserting job: {e}")
+                return ""
+
+        @staticmethod
+        def find_job(job_id: str) -> Optional[Dict[str, Any]]:
+            """
+            find one job by id.
+            """
+            try:
+                return db.jobs.find_one({"_id": job_id})
+            except PyMongoError as e:
+                print(f"Error finding job: {e}")
+                return None
+
+        @staticmethod
+        def update_job(
+            job_id: str, update_data: Dict[str, Any], status: Optional[str] = None
+        ) -> bool:
+            """
+            set fields of one job and bump its updated_at. with status, only
+            if the job still has that status.
+            """
+            update_data = {**update_data, "updated_at": datetime.now().isoformat()}
+            query_filter = {"_id": job_id}
+            if status is not None:
+                query_filter["status"] = status
+            try:
+                result = db.jobs.update_one(query_filter, {"$set": update_data})
+                return result.matched_count > 0
+            except PyMongoError as e:
+                print(f"Error updating job: {e}")
+                return False
+
+        @staticmethod
+        def create_expiry_index() -> bool:
+            """
+            create the TTL index that removes jobs once expires_at has passed.
+            """
+            try:
+                db.jobs.create_indexes([EXPIRES_AT_INDEX])
+                return True
+            except PyMongoError as e:
+                print(f"Error creating job expiry index: {e}")
+                return False
+
+        @staticmethod
+        def touch_jobs(owner: str, heartbeat_at: str) -> int:
+            """
+            set heartbeat_at of the queued and running jobs of one owner.
+            """
+            try:
+                result = db.jobs.update_many(
+                    {"owner": owner, "status": {"$in": ["queued", "running"]}},
+                    {"$set": {"heartbeat_at": heartbeat_at}},
+                )
+                return result.modified_count
+            except PyMongoError as e:
+                print(f"Error sending job heartbeat: {e}")
+                return 0
+
+        @staticmethod
+        def fail_stale_jobs(before: str, error: str) -> List[Dict[str, Any]]:
+            """
+            mark queued or running jobs without a heartbeat since before as
+            failed and return them. a job that moves on or gets a heartbeat
+            in the meantime is left alone.
+            """
+            stale = {
+                "status": {"$in": ["queued", "running"]},
+                # jobs from before heartbeats only have updated_at
+                "$or": [
+                    {"heartbeat_at": {"$lt": before}},
+                    {"heartbeat_at": None, "updated_at": {"$lt": before}},
+                ],
+            }
+            update = {"status": "failed", "error": error}
+            failed = []
+            try:
+                for job in db.jobs.find(stale, {"upload_id": 1}):
+                    update["updated_at"] = datetime.now().isoformat()
+                    result = db.jobs.update_one(
+                        {"_id": job["_id"], **stale}, {"$set": update}
+                    )
+                    if result.modified_count:
+                        failed.append(job)
+            except PyMongoError as e:
+                print(f"Error failing stale jobs: {e}")
+            return failed
@@ -0,0 +1,296 @@
+"""
+Audio preprocessing before transcription.
+
+Uploads are downmixed to mono, resampled to 16 kHz (what whisper works at
+anyway) and stripped of leading, trailing and long interior silence with a
+simple energy based voice activity detector. PCM wav is decoded here;
+compressed formats such as the browser's audio/webm recordings are decoded
+to PCM by ffmpeg (the binary bundled with imageio-ffmpeg, or FFMPEG_BINARY).
+Anything that cannot be decoded is passed through untouched.
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import wave
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import imageio_ffmpeg
+except ImportError:  # pragma: no cover - fall back to an ffmpeg on the PATH
+    imageio_ffmpeg = None
+
+TARGET_RATE = 16000
+FRAME_SECONDS = 0.03
+# a frame is speech if its rms is above both an absolute floor and a share
+# of the loudest frame, so quiet rooms and loud recordings both work
+VAD_MIN_RMS = float(os.getenv("VAD_MIN_RMS", "0.01"))
+VAD_RELATIVE_RMS = float(os.getenv("VAD_RELATIVE_RMS", "0.05"))
+# interior pauses longer than MAX_PAUSE are shortened to KEEP_PAUSE
+MAX_PAUSE_SECONDS = float(os.getenv("VAD_MAX_PAUSE_SECONDS", "0.6"))
+KEEP_PAUSE_SECONDS = 0.3
+EDGE_PAD_SECONDS = 0.1
+# long recordings are split into segments of at most this length so they
+# can be transcribed in parallel; neighbours share a little audio so words
+# on a cut are not lost
+SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "60"))
+SEGMENT_OVERLAP_SECONDS = 0.5
+# decoding a long recording takes a few seconds, a stuck ffmpeg must not
+# hold the request forever
+DECODE_TIMEOUT_SECONDS = float(os.getenv("AUDIO_DECODE_TIMEOUT_SECONDS", "120"))
+
+
+def is_wav(header: bytes) -> bool:
+    """
+    check the RIFF/WAVE magic bytes
+    """
+    return len(header) >= 12 and header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+
+
+def decode_wav(data: bytes) -> Optional[Tuple[np.ndarray, int]]:
+    """
+    decode PCM wav bytes into mono float samples in [-1, 1] and the sample
+    rate, or None if the data is not PCM wav we understand
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            channels = wav.getnchannels()
+            width = wav.getsampwidth()
+            rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2**31
+    else:
+        return None
+
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels]
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+@lru_cache(maxsize=1)
+def ffmpeg_binary() -> Optional[str]:
+    """
+    path of the ffmpeg used to decode compressed audio, or None if there is
+    none: FFMPEG_BINARY, then the one imageio-ffmpeg ships, then the PATH
+    """
+    if os.getenv("FFMPEG_BINARY"):
+        return os.getenv("FFMPEG_BINARY")
+    if imageio_ffmpeg is not None:
+        try:
+            return imageio_ffmpeg.get_ffmpeg_exe()
+        except RuntimeError:
+            pass
+    return shutil.which("ffmpeg")
+
+
+def decode_compressed(data: bytes) -> Optional[Tuple[np.ndarray, int]]:
+    """
+    decode webm, ogg, mp3 and the other formats ffmpeg reads into mono
+    float samples at TARGET_RATE, or None if ffmpeg is missing or fails
+    """
+    binary = ffmpeg_binary()
+    if binary is None:
+        return None
+    command = [binary, "-nostdin", "-loglevel", "error", "-i", "pipe:0"]
+    command += ["-f", "s16le", "-ac", "1", "-ar", str(TARGET_RATE), "pipe:1"]
+    try:
+        result = subprocess.run(
+            command,
+            input=data,
+            capture_output=True,
+            timeout=DECODE_TIMEOUT_SECONDS,
+            check=False,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Error decoding audio with ffmpeg: {e}")
+        return None
+    pcm = result.stdout[: len(result.stdout) // 2 * 2]
+    if result.returncode != 0 or not pcm:
+        return None
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768, TARGET_RATE
+
+
+def encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    """
+    encode mono float samples as 16 bit PCM wav
+    """
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        # pylint: disable=no-member
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def resample(samples: np.ndarray, rate: int, target: int = TARGET_RATE) -> np.ndarray:
+    """
+    linear resampling, with a box low-pass first when downsampling
+    """
+    if rate == target or len(samples) == 0:
+        return samples
+    ratio = rate / target
+    if ratio > 1:
+        width = int(np.ceil(ratio))
+        samples = np.convolve(samples, np.ones(width) / width, mode="same")
+    out_len = int(round(len(samples) / ratio))
+    positions = np.arange(out_len) * ratio
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def frame_rms(samples: np.ndarray, rate: int) -> np.ndarray:
+    """
+    rms energy of every FRAME_SECONDS frame
+    """
+    frame = max(1, int(rate * FRAME_SECONDS))
+    count = len(samples) // frame
+    frames = samples[: count * frame].reshape(count, frame)
+    return np.sqrt(np.mean(frames**2, axis=1))
+
+
+def voiced_frames(samples: np.ndarray, rate: int) -> np.ndarray:
+    """
+    one bool per FRAME_SECONDS frame, true where someone is speaking
+    """
+    rms = frame_rms(samples, rate)
+    if len(rms) == 0:
+        return np.zeros(0, dtype=bool)
+    return rms > max(VAD_MIN_RMS, VAD_RELATIVE_RMS * rms.max())
+
+
+def voiced_runs(voiced: np.ndarray):
+    """
+    (start, end) frame indexes of every run of voiced frames
+    """
+    edges = np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]]))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def trim_silence(samples: np.ndarray, rate: int) -> np.ndarray:
+    """
+    cut leading and trailing silence and shorten long interior pauses.
+    returns the samples unchanged if no speech was found.
+    """
+    runs = voiced_runs(voiced_frames(samples, rate))
+    if not runs:
+        return samples
+
+    frame = int(rate * FRAME_SECONDS)
+    pad = int(rate * EDGE_PAD_SECONDS)
+    max_pause = int(rate * MAX_PAUSE_SECONDS)
+    keep_pause = int(rate * KEEP_PAUSE_SECONDS)
+
+    pieces = []
+    previous_end = None
+    for start, end in runs:
+        start, end = start * frame, end * frame
+        if previous_end is None:
+            start = max(0, start - pad)
+        elif start - previous_end > max_pause:
+            # keep a short pause so words do not run together
+            pieces.append(np.zeros(keep_pause, dtype=samples.dtype))
+        else:
+            start = previous_end
+        pieces.append(samples[start:end])
+        previous_end = end
+    pieces.append(samples[previous_end : previous_end + pad])
+    return np.concatenate(pieces)
+
+
+def split_at_silence(
+    samples: np.ndarray,
+    rate: int,
+    max_seconds: float = SEGMENT_SECONDS,
+    overlap_seconds: float = SEGMENT_OVERLAP_SECONDS,
+) -> List[np.ndarray]:
+    """
+    split audio into segments of at most max_seconds (plus overlap), cutting
+    at the quietest frame in the second half of each window. every segment
+    after the first starts overlap_seconds before its cut.
+    """
+    if len(samples) <= rate * max_seconds:
+        return [samples]
+    max_len = int(rate * max_seconds)
+
+    frame = max(1, int(rate * FRAME_SECONDS))
+    rms = frame_rms(samples, rate)
+    cuts = [0]
+    while len(samples) - cuts[-1] > max_len:
+        low = (cuts[-1] + max_len // 2) // frame
+        high = max(low + 1, (cuts[-1] + max_len) // frame)
+        cuts.append((low + int(np.argmin(rms[low:high]))) * frame)
+    cuts.append(len(samples))
+
+    overlap = int(rate * overlap_seconds)
+    return [
+        samples[max(0, start - overlap if i else 0) : end]
+        for i, (start, end) in enumerate(zip(cuts, cuts[1:]))
+    ]
+
+
+def decode_trimmed(data: bytes) -> Optional[Tuple[np.ndarray, float]]:
+    """
+    mono 16 kHz samples of an upload with silence trimmed, and the length
+    of the original in seconds. None if the data cannot be decoded.
+    """
+    decoded = decode_wav(data) if is_wav(data[:12]) else decode_compressed(data)
+    if decoded is None:
+        return None
+    samples, rate = decoded
+    original_seconds = len(samples) / rate if rate else 0.0
+    return trim_silence(resample(samples, rate), TARGET_RATE), original_seconds
+
+
+def preprocess_audio(data: bytes) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    downmix, resample and trim an upload into wav. formats that cannot be
+    decoded come back unchanged. the stats say how many bytes and seconds
+    were saved; compressed uploads can come back larger, as wav.
+    """
+    segments, stats = preprocess_segments(data, max_seconds=float("inf"))
+    return segments[0], stats
+
+
+def preprocess_segments(
+    data: bytes, max_seconds: Optional[float] = None
+) -> Tuple[List[bytes], Dict[str, Any]]:
+    """
+    like preprocess_audio, but long recordings come back as several wav
+    segments split at silence (see split_at_silence)
+    """
+    stats: Dict[str, Any] = {
+        "processed": False,
+        "bytes_saved": 0,
+        "seconds_saved": 0.0,
+        "segments": 1,
+    }
+    trimmed = decode_trimmed(data)
+    if trimmed is None:
+        return [data], stats
+
+    samples, original_seconds = trimmed
+    pieces = split_at_silence(samples, TARGET_RATE, max_seconds or SEGMENT_SECONDS)
+    segments = [encode_wav(piece, TARGET_RATE) for piece in pieces]
+
+    stats.update(
+        processed=True,
+        bytes_saved=len(data) - sum(len(segment) for segment in segments),
+        seconds_saved=round(original_seconds - len(samples) / TARGET_RATE, 3),
+        segments=len(segments),
+    )
+    return segments, stats
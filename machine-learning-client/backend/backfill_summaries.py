@@ -0,0 +1,20 @@
+"""
+One-shot job that fills in the denormalized summary fields
+(message_count, last_message_preview, last_role, updated_at) on chats
+written before they were maintained.
+
+run from machine-learning-client/: python -m backend.backfill_summaries
+"""
+
+from backend.DAL import chat_dal
+
+
+def main():
+    """backfill chat summaries and report how many chats changed"""
+    modified = chat_dal.backfill_summaries()
+    print(f"backfilled summary fields on {modified} chat(s)")
+    return modified
+
+
+if __name__ == "__main__":
+    main()
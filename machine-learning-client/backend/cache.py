@@ -0,0 +1,163 @@
+"""
+Small two-tier cache: an in-process LRU with a TTL in front of an optional
+mongo collection shared by every worker and container.
+
+Shared entries look like {"_id": key, "value": ..., "expires_at": datetime};
+mongo drops them through a TTL index on expires_at, which the cache creates
+itself the first time it uses the collection.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+from pymongo import ASCENDING, IndexModel
+
+# mongo removes a document once its expires_at date has passed
+EXPIRES_AT_INDEX = IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+
+
+def cache_key(*parts: Any) -> str:
+    """
+    stable sha256 of json serializable parts
+    """
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class TieredCache:  # pylint: disable=too-many-instance-attributes
+    """
+    LRU + TTL cache with hit/miss counters and an optional shared mongo tier
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 512,
+        ttl_seconds: float = 3600,
+        collection: Any = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self.clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "sets": 0}
+        self._indexed = False
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        look a key up locally, then in the shared tier. None on a miss.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+
+        value = self._get_shared(key, now)
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["shared_hits"] += 1
+        self._set_local(key, value, now)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        store a value in both tiers
+        """
+        now = self.clock()
+        self._set_local(key, value, now)
+        with self._lock:
+            self._stats["sets"] += 1
+        self._set_shared(key, value, now)
+
+    def clear(self) -> None:
+        """
+        drop every local entry and reset the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            for k in self._stats:
+                self._stats[k] = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        hit/miss counters and current size
+        """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["shared_hits"]
+            lookups += self._stats["misses"]
+            hits = self._stats["hits"] + self._stats["shared_hits"]
+            return {
+                "name": self.name,
+                **self._stats,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "shared": self.collection is not None,
+            }
+
+    def _set_local(self, key: str, value: Any, now: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, now + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _ensure_index(self) -> None:
+        # on first use rather than at import, and also without the
+        # migration runner, so shared entries always expire
+        if self._indexed:
+            return
+        self.collection.create_indexes([EXPIRES_AT_INDEX])
+        self._indexed = True
+
+    def _get_shared(self, key: str, now: float) -> Optional[Any]:
+        if self.collection is None:
+            return None
+        try:
+            self._ensure_index()
+            doc = self.collection.find_one({"_id": key})
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Error reading {self.name} cache: {e}")
+            return None
+        if not doc:
+            return None
+        expires_at = doc["expires_at"]
+        if expires_at.tzinfo is None:
+            # pymongo hands back naive utc datetimes by default
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at.timestamp() <= now:
+            # the ttl monitor only sweeps once a minute
+            return None
+        return doc["value"]
+
+    def _set_shared(self, key: str, value: Any, now: float) -> None:
+        if self.collection is None:
+            return
+        expires_at = datetime.fromtimestamp(now + self.ttl_seconds, tz=timezone.utc)
+        try:
+            self._ensure_index()
+            self.collection.replace_one(
+                {"_id": key},
+                {"_id": key, "value": value, "expires_at": expires_at},
+                upsert=True,
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Error writing {self.name} cache: {e}")
@@ -0,0 +1,27 @@
+"""
+Denormalized summary fields kept on every chat document so the chat list
+never has to read the messages array.
+"""
+
+from typing import Any, Dict, List
+
+PREVIEW_LENGTH = 80
+
+
+def message_preview(message: Dict[str, Any]) -> str:
+    """
+    first PREVIEW_LENGTH characters of a message
+    """
+    return str(message.get("content") or "")[:PREVIEW_LENGTH]
+
+
+def summary_fields(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    summary fields for a chat holding exactly these messages
+    """
+    last = messages[-1] if messages else {}
+    return {
+        "message_count": len(messages),
+        "last_message_preview": message_preview(last),
+        "last_role": last.get("role"),
+    }
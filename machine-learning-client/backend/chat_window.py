@@ -0,0 +1,46 @@
+"""
+Paging through one chat's message history, newest messages first.
+
+The web-app answers the same reads from its own chat_reads module, which
+must keep the page sizes and response shape in step with this one.
+"""
+
+from typing import Any, Dict, Optional
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 200
+
+
+def history_limit(value: Optional[str]) -> Optional[int]:
+    """
+    the number of messages asked for, HISTORY_PAGE_SIZE if not given and
+    at most HISTORY_PAGE_MAX, or None if it is not a positive integer
+    """
+    try:
+        limit = min(
+            int(HISTORY_PAGE_SIZE if value is None else value), HISTORY_PAGE_MAX
+        )
+    except ValueError:
+        return None
+    return limit if limit >= 1 else None
+
+
+def chat_window_projection(limit: int) -> Dict[str, Any]:
+    """
+    projection keeping the last `limit` messages, plus one
+    """
+    # fetch one extra message to know if there are older ones
+    return {"messages": {"$slice": -(limit + 1)}}
+
+
+def trim_window(chat: Optional[Dict[str, Any]], limit: int) -> Optional[Dict[str, Any]]:
+    """
+    drop the extra message a window query fetched and set has_more. a
+    window before a message that is not in the chat is None.
+    """
+    if chat is None or ("messages" in chat and chat["messages"] is None):
+        return None
+    messages = chat.get("messages", [])
+    chat["has_more"] = len(messages) > limit
+    chat["messages"] = messages[-limit:]
+    return chat
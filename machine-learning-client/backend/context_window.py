@@ -0,0 +1,87 @@
+"""
+Builds the messages sent to the model for one turn: the system prompt plus
+the newest turns that fit a token budget, with only the fields the chat
+completions API accepts.
+"""
+
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# fields the chat completions API takes, everything else we store is dropped
+API_FIELDS = ("role", "content", "name")
+
+# estimator calibrated against the gpt-4o tokenizer on chat text: about four
+# ascii characters per token, while other scripts are closer to one per char
+ASCII_CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4  # role and framing overhead per message
+TOKENS_PER_REPLY = 3  # priming for the assistant reply
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("MODEL_CONTEXT_TOKENS", "3000"))
+
+
+@dataclass
+class ContextWindow:
+    """messages to send plus how much history did not fit"""
+
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    tokens: int = 0
+    dropped_messages: int = 0
+    dropped_tokens: int = 0
+
+
+def count_tokens(text: str) -> int:
+    """
+    estimate the number of tokens in a piece of text without a network call
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN) + len(text) - ascii_chars
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """
+    estimate the tokens one message costs in the prompt
+    """
+    return TOKENS_PER_MESSAGE + count_tokens(str(message.get("content") or ""))
+
+
+def to_api_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    keep only the fields the model api accepts
+    """
+    return {k: message[k] for k in API_FIELDS if k in message}
+
+
+def build_context(
+    messages: List[Dict[str, Any]], budget: Optional[int] = None
+) -> ContextWindow:
+    """
+    keep every system message and the newest turns that fit in the budget.
+    the newest turn is always kept so the model has something to answer.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    api_messages = [to_api_message(m) for m in messages if m.get("content")]
+
+    system = [m for m in api_messages if m.get("role") == "system"]
+    turns = [m for m in api_messages if m.get("role") != "system"]
+
+    used = TOKENS_PER_REPLY + sum(message_tokens(m) for m in system)
+    kept = []
+    for message in reversed(turns):
+        cost = message_tokens(message)
+        if kept and used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+
+    dropped = turns[: len(turns) - len(kept)]
+    return ContextWindow(
+        messages=system + kept,
+        tokens=used,
+        dropped_messages=len(dropped),
+        dropped_tokens=sum(message_tokens(m) for m in dropped),
+    )
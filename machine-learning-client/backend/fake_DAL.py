@@ -1,5 +1,9 @@
 """A fake Data Access Layer (DAL) to simulate MongoDB operations for testing purposes."""  # pylint: disable=invalid-name
 
+from datetime import datetime
+
+from backend.chat_summary import message_preview, summary_fields
+
 
 class fake_collection:  # pylint: disable=
     """
@@ -71,15 +75,40 @@ class fake_db:  # pylint: disable=too-few-public-methods
 
     def __init__(self):
         """
-        Initialize the fake database with chats and messages collections.
+        Initialize the fake database with chats, messages and jobs collections.
         """
         self.chats = fake_collection()
         self.messages = fake_collection()
+        self.jobs = fake_collection()
 
 
 db = fake_db()
 
 
+def start_database_check():
+    """
+    the in-memory database needs no check
+    """
+
+
+def database_status():
+    """
+    the in-memory database is always ready
+    """
+    return True, None
+
+
+SUMMARY_FIELDS = (
+    "_id",
+    "title",
+    "created_at",
+    "updated_at",
+    "message_count",
+    "last_message_preview",
+    "last_role",
+)
+
+
 class chat_dal:
     """
     The chats DAL
@@ -90,6 +119,7 @@ class chat_dal:
         """
         insert one chat document.
         """
+        data = {**data, **summary_fields(data.get("messages", []))}
         return db.chats.insert_one(data).inserted_id
 
     @staticmethod
@@ -99,6 +129,50 @@ class chat_dal:
         """
         return db.chats.find_one(filt)
 
+    @staticmethod
+    def find_chat_window(chat_id, limit, before=None):
+        """
+        find a chat with only one window of its messages.
+        """
+        chat = db.chats.find_one({"_id": chat_id})
+        if chat is None:
+            return None
+        messages = chat.get("messages", [])
+        end = len(messages)
+        if before is not None:
+            ids = [m.get("_id") for m in messages]
+            if before not in ids:
+                return None
+            end = ids.index(before)
+        start = max(0, end - limit)
+        return {**chat, "messages": messages[start:end], "has_more": start > 0}
+
+    @staticmethod
+    def find_messages_since(chat_id, since_id=None, since_timestamp=None):
+        """
+        find only the messages of a chat newer than a message id or timestamp.
+        """
+        chat = db.chats.find_one({"_id": chat_id})
+        if chat is None:
+            return None
+        messages = chat.get("messages", [])
+        if since_id is not None:
+            ids = [m.get("_id") for m in messages]
+            if since_id not in ids:
+                return None
+            newer = messages[ids.index(since_id) + 1 :]
+        else:
+            newer = [m for m in messages if m.get("timestamp", "") > since_timestamp]
+        return {
+            "_id": chat["_id"],
+            "messages": newer,
+            **{
+                k: chat[k]
+                for k in ("message_count", "version", "updated_at")
+                if k in chat
+            },
+        }
+
     @staticmethod
     def find_all_chats():
         """
@@ -106,13 +180,88 @@ class chat_dal:
         """
         return db.chats.find()
 
+    @staticmethod
+    def find_chat_summaries(limit, after=None, since=None):
+        """
+        find one page of chats, newest first, without their message history.
+        """
+
+        def sort_key(updated_at, chat_id):
+            # chats without updated_at sort last, like null does in mongo
+            return (updated_at is not None, updated_at or "", str(chat_id))
+
+        chats = sorted(
+            db.chats.find(),
+            key=lambda chat: sort_key(chat.get("updated_at"), chat["_id"]),
+            reverse=True,
+        )
+        if after is not None:
+            chats = [
+                chat
+                for chat in chats
+                if sort_key(chat.get("updated_at"), chat["_id"]) < sort_key(*after)
+            ]
+        if since is not None:
+            chats = [chat for chat in chats if (chat.get("updated_at") or "") > since]
+
+        summaries = []
+        for chat in chats[:limit]:
+            summaries.append({k: chat[k] for k in SUMMARY_FIELDS if k in chat})
+        return summaries
+
     @staticmethod
     def update_one_chat(filt, data):
         """
         update one chat document matching the filter.
         """
+        data = {k: v for k, v in data.items() if k != "version"}
+        if "messages" in data:
+            chat = db.chats.find_one(filt)
+            data = {
+                **data,
+                **summary_fields(data["messages"]),
+                "updated_at": datetime.now().isoformat(),
+                "version": (chat or {}).get("version", 0) + 1,
+            }
         return db.chats.update_one(filt, {"$set": data}).modified_count > 0
 
+    @staticmethod
+    def backfill_summaries():
+        """
+        fill in summary fields on chats written before they existed.
+        """
+        modified = 0
+        for chat in db.chats.find():
+            messages = chat.get("messages", [])
+            if chat.get("updated_at") is not None and chat.get("message_count") == len(
+                messages
+            ):
+                continue
+            chat.update(summary_fields(messages))
+            if chat.get("updated_at") is None:
+                last = messages[-1] if messages else {}
+                chat["updated_at"] = last.get("timestamp") or chat.get("created_at")
+            modified += 1
+        return modified
+
+    @staticmethod
+    def append_messages(chat_id, new_messages, expected_version=None):
+        """
+        push messages onto the end of a chat, optionally checking its version.
+        """
+        chat = db.chats.find_one({"_id": chat_id})
+        if chat is None or not new_messages:
+            return False
+        if expected_version is not None and chat.get("version", 0) != expected_version:
+            return False
+        chat.setdefault("messages", []).extend(new_messages)
+        chat["version"] = chat.get("version", 0) + 1
+        chat["message_count"] = chat.get("message_count", 0) + len(new_messages)
+        chat["last_message_preview"] = message_preview(new_messages[-1])
+        chat["last_role"] = new_messages[-1].get("role")
+        chat["updated_at"] = datetime.now().isoformat()
+        return True
+
     @staticmethod
     def delete_one_chat(filt):
         """
@@ -160,3 +309,185 @@ class messages_dal:
         delete one message document matching the filter.
         """
         return db.messages.delete_one(filt).deleted_count > 0
+
+
+class async_chat_dal:
+    """
+    async twin of chat_dal over the same in-memory data
+    """
+
+    @staticmethod
+    async def insert_one_chat(data):
+        """
+        insert one chat document.
+        """
+        return chat_dal.insert_one_chat(data)
+
+    @staticmethod
+    async def find_one_chat(filt):
+        """
+        find one chat document matching the filter.
+        """
+        return chat_dal.find_one_chat(filt)
+
+    @staticmethod
+    async def find_chat_window(chat_id, limit, before=None):
+        """
+        find a chat with only one window of its messages.
+        """
+        return chat_dal.find_chat_window(chat_id, limit, before)
+
+    @staticmethod
+    async def find_messages_since(chat_id, since_id=None, since_timestamp=None):
+        """
+        find only the messages of a chat newer than a message id or timestamp.
+        """
+        return chat_dal.find_messages_since(chat_id, since_id, since_timestamp)
+
+    @staticmethod
+    async def find_all_chats():
+        """
+        find all chat documents.
+        """
+        return chat_dal.find_all_chats()
+
+    @staticmethod
+    async def find_chat_summaries(limit, after=None, since=None):
+        """
+        find one page of chats, newest first, without their message history.
+        """
+        return chat_dal.find_chat_summaries(limit, after, since)
+
+    @staticmethod
+    async def update_one_chat(filt, data):
+        """
+        update one chat document matching the filter.
+        """
+        return chat_dal.update_one_chat(filt, data)
+
+    @staticmethod
+    async def backfill_summaries():
+        """
+        fill in summary fields on chats written before they existed.
+        """
+        return chat_dal.backfill_summaries()
+
+    @staticmethod
+    async def append_messages(chat_id, new_messages, expected_version=None):
+        """
+        push messages onto the end of a chat, optionally checking its version.
+        """
+        return chat_dal.append_messages(chat_id, new_messages, expected_version)
+
+    @staticmethod
+    async def delete_one_chat(filt):
+        """
+        delete one chat document matching the filter.
+        """
+        return chat_dal.delete_one_chat(filt)
+
+
+class async_messages_dal:
+    """
+    async twin of messages_dal over the same in-memory data
+    """
+
+    @staticmethod
+    async def insert_one_message(data):
+        """
+        insert one message document.
+        """
+        return messages_dal.insert_one_message(data)
+
+    @staticmethod
+    async def find_one_message(filt):
+        """
+        find one message document matching the filter.
+        """
+        return messages_dal.find_one_message(filt)
+
+    @staticmethod
+    async def find_all_messages():
+        """
+        find all message documents.
+        """
+        return messages_dal.find_all_messages()
+
+    @staticmethod
+    async def update_one_message(filt, data):
+        """
+        update one message document matching the filter.
+        """
+        return messages_dal.update_one_message(filt, data)
+
+    @staticmethod
+    async def delete_one_message(filt):
+        """
+        delete one message document matching the filter.
+        """
+        return messages_dal.delete_one_message(filt)
+
+
+class jobs_dal:
+    """
+    class jobs_dal
+    """
+
+    @staticmethod
+    def insert_job(data):
+        """
+        insert one job document.
+        """
+        return db.jobs.insert_one(data).inserted_id
+
+    @staticmethod
+    def find_job(job_id):
+        """
+        find one job by id.
+        """
+        return db.jobs.find_one({"_id": job_id})
+
+    @staticmethod
+    def update_job(job_id, data, status=None):
+        """
+        set fields of one job and bump its updated_at. with status, only
+        if the job still has that status.
+        """
+        data = {**data, "updated_at": datetime.now().isoformat()}
+        filt = {"_id": job_id} if status is None else {"_id": job_id, "status": status}
+        return db.jobs.update_one(filt, {"$set": data}).modified_count > 0
+
+    @staticmethod
+    def create_expiry_index():
+        """
+        nothing expires in memory.
+        """
+        return True
+
+    @staticmethod
+    def touch_jobs(owner, heartbeat_at):
+        """
+        set heartbeat_at of the queued and running jobs of one owner.
+        """
+        touched = 0
+        for job in db.jobs.find({"owner": owner}):
+            if job["status"] in ("queued", "running"):
+                job["heartbeat_at"] = heartbeat_at
+                touched += 1
+        return touched
+
+    @staticmethod
+    def fail_stale_jobs(before, error):
+        """
+        mark queued or running jobs without a heartbeat since before as
+        failed and return them.
+        """
+        failed = []
+        for job in db.jobs.find():
+            last_seen = job.get("heartbeat_at") or job["updated_at"]
+            if job["status"] in ("queued", "running") and last_seen < before:
+                job.update(
+                    status="failed", error=error, updated_at=datetime.now().isoformat()
+                )
+                failed.append(job)
+        return failed
@@ -0,0 +1,229 @@
+"""
+Offline FAQ fast path: curated answers to the questions seniors ask most,
+matched before we pay for a model call.
+
+Questions are turned into hashed tf-idf vectors (word unigrams and bigrams)
+and kept in one numpy matrix, so a lookup is a single matrix-vector product
+over every entry. Entries come from a json file or a mongo collection and
+can be added or removed one at a time without rebuilding the whole matrix.
+"""
+
+import json
+import os
+import re
+import time
+import zlib
+from collections import Counter
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+FAQ_ENABLED = os.getenv("FAQ_ENABLED", "1") == "1"
+FAQ_SOURCE = os.getenv("FAQ_SOURCE", "file")
+FAQ_PATH = os.getenv(
+    "FAQ_PATH", os.path.join(os.path.dirname(__file__), "data", "faq.json")
+)
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.75"))
+FAQ_REFRESH_SECONDS = float(os.getenv("FAQ_REFRESH_SECONDS", "60"))
+
+N_FEATURES = 2**12
+STOP_WORDS = {
+    "a",
+    "an",
+    "and",
+    "are",
+    "can",
+    "do",
+    "i",
+    "is",
+    "it",
+    "me",
+    "my",
+    "of",
+    "on",
+    "or",
+    "please",
+    "the",
+    "to",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    lowercase words without stop words, plus word bigrams
+    """
+    words = [
+        w for w in re.findall(r"[a-z0-9']+", str(text).lower()) if w not in STOP_WORDS
+    ]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def vectorize(text: str) -> np.ndarray:
+    """
+    hashed, log scaled term frequencies of a piece of text
+    """
+    row = np.zeros(N_FEATURES, dtype=np.float32)
+    # crc32 rather than hash() so buckets are the same in every process
+    counts = Counter(zlib.crc32(t.encode()) % N_FEATURES for t in tokenize(text))
+    for bucket, count in counts.items():
+        row[bucket] = 1 + np.log(count)
+    return row
+
+
+class FaqIndex:  # pylint: disable=too-many-instance-attributes
+    """
+    in-memory tf-idf index over FAQ questions
+    """
+
+    def __init__(self, threshold: float = FAQ_THRESHOLD):
+        self.threshold = threshold
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._row_keys: List[str] = []
+        self._tf = np.zeros((0, N_FEATURES), dtype=np.float32)
+        self._df = np.zeros(N_FEATURES, dtype=np.float32)
+        self._weighted: Optional[np.ndarray] = None
+        self._idf: Optional[np.ndarray] = None
+        self._lock = Lock()
+        self._source_version: Any = None
+        self._checked_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, key: str, entry: Dict[str, Any]) -> None:
+        """
+        add or replace one entry; only its rows are touched
+        """
+        questions = entry.get("questions") or [entry.get("question", "")]
+        rows = np.stack([vectorize(q) for q in questions])
+        with self._lock:
+            self._remove_rows(key)
+            self.entries[key] = entry
+            self._tf = np.vstack([self._tf, rows])
+            self._df += (rows > 0).sum(axis=0)
+            self._row_keys += [key] * len(rows)
+            self._weighted = None
+
+    def remove(self, key: str) -> None:
+        """
+        drop one entry
+        """
+        with self._lock:
+            self._remove_rows(key)
+            self.entries.pop(key, None)
+            self._weighted = None
+
+    def sync(self, entries: Dict[str, Dict[str, Any]]) -> int:
+        """
+        bring the index in line with entries, only touching what changed.
+        returns how many entries were added, changed or removed.
+        """
+        changed = 0
+        for key in set(self.entries) - set(entries):
+            self.remove(key)
+            changed += 1
+        for key, entry in entries.items():
+            if self.entries.get(key) != entry:
+                self.add(key, entry)
+                changed += 1
+        return changed
+
+    def match(self, question: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        best entry for a question and its cosine similarity, or None if no
+        entry clears the threshold
+        """
+        query = vectorize(question)
+        if not query.any():
+            return None
+        with self._lock:
+            if not self._row_keys:
+                return None
+            if self._weighted is None:
+                self._reweight()
+            query = query * self._idf
+            # cosine similarity against every question in one product
+            scores = self._weighted @ (query / np.linalg.norm(query))
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            entry = self.entries[self._row_keys[best]]
+        if score < self.threshold:
+            return None
+        return entry, score
+
+    def _remove_rows(self, key: str) -> None:
+        keep = np.array([k != key for k in self._row_keys], dtype=bool)
+        if keep.all():
+            return
+        self._df -= (self._tf[~keep] > 0).sum(axis=0)
+        self._tf = self._tf[keep]
+        self._row_keys = [k for k in self._row_keys if k != key]
+
+    def _reweight(self) -> None:
+        n = len(self._row_keys)
+        self._idf = np.log((1 + n) / (1 + self._df)) + 1
+        weighted = self._tf * self._idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        self._weighted = weighted / np.where(norms == 0, 1, norms)
+
+    def refresh_from_file(self, path: str) -> int:
+        """
+        reload entries from a json file if it changed since the last load
+        """
+        mtime = os.path.getmtime(path)
+        if mtime == self._source_version:
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        self._source_version = mtime
+        return self.sync({str(e.get("_id") or e.get("question")): e for e in entries})
+
+    def refresh_from_collection(self, collection: Any) -> int:
+        """
+        reload entries from a mongo collection, applying only the changes
+        """
+        entries = {str(doc["_id"]): doc for doc in collection.find({})}
+        return self.sync(entries)
+
+    def maybe_refresh(self, source: Any) -> int:
+        """
+        refresh from a file path or collection at most every
+        FAQ_REFRESH_SECONDS
+        """
+        now = time.monotonic()
+        if self._checked_at and now - self._checked_at < FAQ_REFRESH_SECONDS:
+            return 0
+        self._checked_at = now
+        try:
+            if isinstance(source, str):
+                return self.refresh_from_file(source)
+            return self.refresh_from_collection(source)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Error loading faq entries: {e}")
+            return 0
+
+
+def faq_source():
+    """
+    where FAQ entries are loaded from: a file path or the faq collection
+    """
+    if FAQ_SOURCE == "mongo":
+        from backend.DAL import db  # pylint: disable=import-outside-toplevel
+
+        return db.faq
+    return FAQ_PATH
+
+
+# filled on the first lookup, so importing never reads the file or mongo
+faq_index = FaqIndex()
+
+
+def faq_answer(question: str) -> Optional[Tuple[Dict[str, Any], float]]:
+    """
+    curated answer for a question, picking up FAQ edits as they happen
+    """
+    if not FAQ_ENABLED or not question:
+        return None
+    faq_index.maybe_refresh(faq_source())
+    return faq_index.match(question)
@@ -0,0 +1,203 @@
+"""
+Asynchronous transcription jobs.
+
+Instead of holding a Flask worker for the whole whisper call, the audio is
+stored as an upload (backend.uploads), a job document is written to mongo
+and a background pool does the transcription. Status lives in mongo, so a
+status query can be answered by any replica, not just the one running the
+job.
+
+The audio itself is on the local disk of the host that took the upload
+(UPLOAD_DIR) and the pool is in process memory, so jobs only run on a
+single ml client replica, or on several sharing one UPLOAD_DIR volume.
+Every job records the process that owns it, and that process bumps the
+heartbeat_at of its queued and running jobs every
+TRANSCRIBE_JOB_HEARTBEAT_SECONDS. Jobs whose heartbeat stopped for
+TRANSCRIBE_JOB_STALE_SECONDS, because their process crashed or was
+restarted, are failed by recover_stale_jobs in whichever process checks
+next; jobs still waiting in a live worker's pool are left alone.
+
+Status changes are conditional on the status a job is expected to have,
+so a job that was failed meanwhile is never started or marked done. The
+upload is removed once the job is done or failed. Mongo removes job
+documents TRANSCRIBE_JOB_TTL_SECONDS after they were created, through a
+TTL index the first job of every process makes sure exists.
+"""
+
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from uuid import uuid4
+
+from backend.DAL import database_status, jobs_dal
+
+JOB_WORKERS = int(os.getenv("TRANSCRIBE_JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("TRANSCRIBE_JOB_POLL_SECONDS", "1"))
+JOB_STREAM_TIMEOUT = 600
+JOB_HEARTBEAT_SECONDS = float(os.getenv("TRANSCRIBE_JOB_HEARTBEAT_SECONDS", "30"))
+# several missed heartbeats, so only jobs whose process is gone are stale
+JOB_STALE_SECONDS = float(os.getenv("TRANSCRIBE_JOB_STALE_SECONDS", "120"))
+JOB_RECOVERY_RETRY_SECONDS = 5
+JOB_TTL_SECONDS = int(os.getenv("TRANSCRIBE_JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+FINISHED = {"done", "failed"}
+
+executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="stt-job")
+expiry_indexed = threading.Event()
+_owner = {"pid": None, "id": None}
+
+Transcriber = Callable[[str], Tuple[str, Dict[str, Any]]]
+Cleanup = Callable[[str], None]
+
+
+def job_owner() -> str:
+    """
+    id of this process for the jobs it runs. a forked worker gets its own,
+    and the random part keeps a restarted container reusing a pid apart.
+    """
+    if _owner["pid"] != os.getpid():
+        _owner["pid"] = os.getpid()
+        _owner["id"] = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+    return _owner["id"]
+
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    the fields of a job a client sees
+    """
+    fields = ("status", "filename", "transcript", "error", "created_at", "updated_at")
+    return {"job_id": job["_id"], **{k: job[k] for k in fields if k in job}}
+
+
+def submit_job(
+    upload_id: str,
+    filename: str,
+    transcribe: Transcriber,
+    cleanup: Optional[Cleanup] = None,
+) -> Dict:
+    """
+    record a queued job for a stored upload and start it in the background.
+    transcribe turns an upload id into (transcript, info); cleanup removes
+    the upload once the job is done or failed.
+    """
+    if not expiry_indexed.is_set() and jobs_dal.create_expiry_index():
+        expiry_indexed.set()
+    now = datetime.now().isoformat()
+    job = {
+        "_id": uuid4().hex,
+        "status": "queued",
+        "upload_id": upload_id,
+        "filename": filename,
+        "created_at": now,
+        "updated_at": now,
+        "owner": job_owner(),
+        "heartbeat_at": now,
+        # a date, not a string, so the TTL index can remove the job
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=JOB_TTL_SECONDS),
+    }
+    job["_id"] = jobs_dal.insert_job(job)
+    if not job["_id"]:
+        raise RuntimeError("failed to store job")
+    executor.submit(run_job, job["_id"], upload_id, transcribe, cleanup)
+    return job
+
+
+def run_job(
+    job_id: str,
+    upload_id: str,
+    transcribe: Transcriber,
+    cleanup: Optional[Cleanup] = None,
+) -> None:
+    """
+    transcribe one job's upload and record the outcome. a job that is no
+    longer queued, because recovery failed it, is not run.
+    """
+    if not jobs_dal.update_job(job_id, {"status": "running"}, status="queued"):
+        print(f"Transcription job {job_id} is no longer queued, not running it")
+        return
+    try:
+        transcript, _ = transcribe(upload_id)
+        outcome = {"status": "done", "transcript": transcript}
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"Error running transcription job {job_id}: {e}")
+        outcome = {"status": "failed", "error": str(e)}
+    if not jobs_dal.update_job(job_id, outcome, status="running"):
+        print(f"Transcription job {job_id} was failed while running")
+    if cleanup:
+        cleanup(upload_id)
+
+
+def job_updates(
+    job_id: str, poll: Optional[float] = None, timeout: float = JOB_STREAM_TIMEOUT
+) -> Iterator[Dict[str, Any]]:
+    """
+    the job every time its status changes, until it finishes. reads mongo,
+    so it works whichever replica runs the job.
+    """
+    deadline = time.monotonic() + timeout
+    last_status = None
+    while time.monotonic() < deadline:
+        job = jobs_dal.find_job(job_id)
+        if job is None:
+            return
+        if job["status"] != last_status:
+            last_status = job["status"]
+            yield public_job(job)
+        if last_status in FINISHED:
+            return
+        time.sleep(JOB_POLL_SECONDS if poll is None else poll)
+
+
+def recover_stale_jobs(
+    cleanup: Optional[Cleanup] = None, stale_seconds: float = JOB_STALE_SECONDS
+) -> int:
+    """
+    fail the queued or running jobs whose owner stopped sending heartbeats,
+    and remove their uploads. returns how many there were.
+    """
+    before = (datetime.now() - timedelta(seconds=stale_seconds)).isoformat()
+    failed = jobs_dal.fail_stale_jobs(before, "interrupted by a server restart")
+    for job in failed:
+        if cleanup:
+            cleanup(job["upload_id"])
+    if failed:
+        print(f"Failed {len(failed)} interrupted transcription job(s)")
+    return len(failed)
+
+
+def send_heartbeat() -> int:
+    """
+    bump heartbeat_at of this process's queued and running jobs
+    """
+    return jobs_dal.touch_jobs(job_owner(), datetime.now().isoformat())
+
+
+def recover_when_reachable(
+    cleanup: Optional[Cleanup] = None, stop: Optional[threading.Event] = None
+) -> None:
+    """
+    once mongo answers, send heartbeats for this process's jobs and recover
+    the stale jobs of others every JOB_HEARTBEAT_SECONDS until stopped
+    """
+    stop = stop or threading.Event()
+    while not database_status()[0]:
+        if stop.wait(JOB_RECOVERY_RETRY_SECONDS):
+            return
+    while True:
+        send_heartbeat()
+        recover_stale_jobs(cleanup)
+        if stop.wait(JOB_HEARTBEAT_SECONDS):
+            return
+
+
+def start_job_recovery(cleanup: Optional[Cleanup] = None) -> None:
+    """
+    send heartbeats and recover stale jobs in a background thread so
+    startup does not wait on mongo
+    """
+    threading.Thread(
+        target=recover_when_reachable, args=(cleanup,), daemon=True
+    ).start()
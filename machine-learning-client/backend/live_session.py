@@ -0,0 +1,382 @@
+"""
+Live voice sessions: audio is sent in small chunks while the user is still
+speaking instead of one upload after they press stop.
+
+Clients post raw 16 bit mono PCM frames. The energy VAD from backend.audio
+finds utterances that ended in a pause; each one is transcribed on the
+transcription pool right away, so by the time the user stops only the last
+utterance is left to transcribe.
+
+A session is a set of files in LIVE_SESSION_DIR, like the resumable
+uploads, so every worker on the host can take its next frames, finish it
+or stream its partial transcripts:
+
+- `<id>.json` the sample rate and how many utterances were sent
+- `<id>.pcm` the audio received since the last utterance was cut
+- `<id>.<n>.txt` the transcript of utterance n once it is done (`.err` if
+  it failed), written by the worker that sent it
+- `<id>.closed` once a worker started finishing the session
+- `<id>.final` the whole transcript
+
+Frames of one session are appended under an flock on `<id>.lock`, so two
+workers never cut the same audio.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+from uuid import uuid4
+
+import numpy as np
+
+from backend.audio import (
+    FRAME_SECONDS,
+    encode_wav,
+    trim_silence,
+    voiced_frames,
+    voiced_runs,
+)
+from backend.transcription import executor
+from backend.uploads import UPLOAD_DIR, UPLOAD_ID
+
+LIVE_SESSION_DIR = os.getenv("LIVE_SESSION_DIR", os.path.join(UPLOAD_DIR, "live"))
+# a pause this long ends an utterance
+UTTERANCE_PAUSE_SECONDS = float(os.getenv("LIVE_UTTERANCE_PAUSE_SECONDS", "0.7"))
+# utterances are cut here even if the speaker never pauses
+MAX_UTTERANCE_SECONDS = float(os.getenv("LIVE_MAX_UTTERANCE_SECONDS", "30"))
+LIVE_SESSION_TTL = float(os.getenv("LIVE_SESSION_TTL", "300"))
+# how often finish and the event stream look for new utterance transcripts
+LIVE_POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", "0.1"))
+FINISH_TIMEOUT_SECONDS = 120
+
+Transcriber = Callable[[bytes], str]
+
+
+class LiveSession:
+    """
+    one live recording in the session directory
+    """
+
+    def __init__(self, directory: str, session_id: str, transcribe: Transcriber):
+        self.directory = directory
+        self.id = session_id
+        self.transcribe = transcribe
+
+    def start(self, rate: int) -> None:
+        """
+        write the files of a new session
+        """
+        self._write("json", json.dumps({"rate": rate, "utterances": 0}))
+        with open(self._path("pcm"), "wb"):
+            pass
+
+    def close(self) -> bool:
+        """
+        stop taking frames. true only for the one caller that closed it.
+        """
+        with self._locked():
+            try:
+                # exclusive create: only one worker wins the session
+                with open(self._path("closed"), "x", encoding="utf-8"):
+                    pass
+            except FileExistsError:
+                return False
+        return True
+
+    def exists(self, closed: bool = False) -> bool:
+        """
+        check the session was started, and unless closed=True that it still
+        takes frames
+        """
+        if not os.path.exists(self._path("json")):
+            return False
+        return closed or not os.path.exists(self._path("closed"))
+
+    def add_frames(self, pcm: bytes) -> int:
+        """
+        append PCM frames and send off every utterance that has ended.
+        returns how many utterances were sent. raises KeyError once the
+        session is finishing or gone.
+        """
+        pcm = pcm[: len(pcm) - len(pcm) % 2]
+        with self._locked():
+            meta = self._open_meta()
+            with open(self._path("pcm"), "ab") as f:
+                f.write(pcm)
+            with open(self._path("pcm"), "rb") as f:
+                buffer = np.frombuffer(f.read(), dtype="<i2") / 32768
+            cut = utterance_end(buffer, meta["rate"])
+            if cut is None and len(buffer) > meta["rate"] * MAX_UTTERANCE_SECONDS:
+                cut = len(buffer)
+            if cut is None:
+                os.utime(self._path("json"))
+                return 0
+            with open(self._path("pcm"), "wb") as f:
+                f.write((buffer[cut:] * 32768).astype("<i2").tobytes())
+            return self._submit(buffer[:cut], meta)
+
+    def partial(self) -> str:
+        """
+        transcript of the utterances done so far, stopping at the first one
+        still in flight so words never appear out of order
+        """
+        texts = []
+        for n in range(self._meta()["utterances"]):
+            text = self._result(n)
+            if text is None:
+                break
+            texts.append(text)
+        return join_utterances(texts)
+
+    def finish(self, timeout: float = FINISH_TIMEOUT_SECONDS) -> str:
+        """
+        send whatever audio is left and wait for the full transcript, which
+        may still be coming from utterances other workers sent
+        """
+        deadline = time.monotonic() + timeout
+        count = self._flush()
+        transcript = self._transcript(count, deadline)
+        while transcript is None:
+            time.sleep(LIVE_POLL_SECONDS)
+            transcript = self._transcript(count, deadline)
+        return transcript
+
+    async def finish_async(self, timeout: float = FINISH_TIMEOUT_SECONDS) -> str:
+        """
+        finish without holding a thread while the utterance transcripts,
+        which stay on the transcription pool, arrive
+        """
+        deadline = time.monotonic() + timeout
+        count = await asyncio.to_thread(self._flush)
+        transcript = self._transcript(count, deadline)
+        while transcript is None:
+            await asyncio.sleep(LIVE_POLL_SECONDS)
+            transcript = self._transcript(count, deadline)
+        return transcript
+
+    def stream_events(
+        self, timeout: float = LIVE_SESSION_TTL, poll: float = LIVE_POLL_SECONDS
+    ) -> Iterator[Dict]:
+        """
+        partial transcripts as they arrive, ending with the final one. stops
+        after timeout seconds without news.
+        """
+        last = ""
+        idle_since = time.monotonic()
+        while time.monotonic() - idle_since < timeout:
+            final = self._read("final")
+            if final is not None:
+                yield {"event": "final", "transcript": final}
+                return
+            text = self.partial()
+            if text != last:
+                last = text
+                idle_since = time.monotonic()
+                yield {"event": "partial", "transcript": text}
+            time.sleep(poll)
+
+    def _flush(self) -> int:
+        """
+        send the audio left and return how many utterances the session has
+        """
+        with self._locked():
+            meta = self._meta()
+            with open(self._path("pcm"), "rb") as f:
+                buffer = np.frombuffer(f.read(), dtype="<i2") / 32768
+            self._submit(buffer, meta)
+            os.remove(self._path("pcm"))
+        return meta["utterances"]
+
+    def _transcript(self, count: int, deadline: float) -> Optional[str]:
+        """
+        the whole transcript once all count utterances are done, saved for
+        the event stream; None while some are in flight. raises
+        RuntimeError if one failed and TimeoutError past the deadline.
+        """
+        texts: List[str] = []
+        for n in range(count):
+            text = self._read(f"{n}.txt")
+            if text is None:
+                if os.path.exists(self._path(f"{n}.err")):
+                    raise RuntimeError(self._read(f"{n}.err"))
+                if time.monotonic() > deadline:
+                    raise TimeoutError("live session transcripts did not arrive")
+                return None
+            texts.append(text)
+        transcript = join_utterances(texts)
+        self._write("final", transcript)
+        return transcript
+
+    def _submit(self, samples: np.ndarray, meta: Dict) -> int:
+        """
+        transcribe an utterance in the background unless it is all silence.
+        must be called under the session lock.
+        """
+        if not voiced_frames(samples, meta["rate"]).any():
+            return 0
+        wav = encode_wav(trim_silence(samples, meta["rate"]), meta["rate"])
+        n = meta["utterances"]
+        meta["utterances"] += 1
+        self._write("json", json.dumps(meta))
+        future = executor.submit(self.transcribe, wav)
+        future.add_done_callback(lambda f: self._on_transcribed(n, f))
+        return 1
+
+    def _on_transcribed(self, n: int, future) -> None:
+        if future.exception() is None:
+            self._write(f"{n}.txt", str(future.result()))
+        else:
+            print(
+                f"Error transcribing live utterance {self.id}/{n}: {future.exception()}"
+            )
+            self._write(f"{n}.err", str(future.exception()))
+
+    def _result(self, n: int) -> Optional[str]:
+        """
+        transcript of utterance n, "" if it failed, None while in flight
+        """
+        text = self._read(f"{n}.txt")
+        if text is None and os.path.exists(self._path(f"{n}.err")):
+            return ""
+        return text
+
+    def _open_meta(self) -> Dict:
+        if os.path.exists(self._path("closed")):
+            raise KeyError(self.id)
+        try:
+            return self._meta()
+        except FileNotFoundError as e:
+            raise KeyError(self.id) from e
+
+    def _meta(self) -> Dict:
+        return json.loads(self._read("json", missing_ok=False))
+
+    @contextmanager
+    def _locked(self):
+        with open(self._path("lock"), "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self, ext: str, missing_ok: bool = True) -> Optional[str]:
+        try:
+            with open(self._path(ext), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            if missing_ok:
+                return None
+            raise
+
+    def _write(self, ext: str, text: str) -> None:
+        # write and rename so readers in other workers never see half a file
+        tmp = self._path(f"{ext}.{uuid4().hex}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self._path(ext))
+
+    def _path(self, ext: str) -> str:
+        return os.path.join(self.directory, f"{self.id}.{ext}")
+
+
+def utterance_end(buffer: np.ndarray, rate: int) -> Optional[int]:
+    """
+    sample index after the last speech followed by a long enough pause
+    """
+    voiced = voiced_frames(buffer, rate)
+    frame = int(rate * FRAME_SECONDS)
+    pause = int(UTTERANCE_PAUSE_SECONDS / FRAME_SECONDS)
+    runs = voiced_runs(voiced)
+    ends = [end for _, end in runs]
+    starts = [start for start, _ in runs][1:] + [len(voiced)]
+    cut = None
+    for end, next_start in zip(ends, starts):
+        if next_start - end >= pause:
+            cut = end * frame
+    return cut
+
+
+def join_utterances(texts: List[str]) -> str:
+    """
+    join utterance transcripts into one
+    """
+    return " ".join(str(t).strip() for t in texts if str(t).strip())
+
+
+class LiveSessionStore:
+    """
+    live sessions kept as files in one directory; idle ones expire after
+    ttl seconds
+    """
+
+    def __init__(
+        self, directory: str = LIVE_SESSION_DIR, ttl: float = LIVE_SESSION_TTL
+    ):
+        self.directory = directory
+        self.ttl = ttl
+
+    def create(self, transcribe: Transcriber, rate: int) -> LiveSession:
+        """
+        open a new session, dropping idle ones
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.remove_expired()
+        session = LiveSession(self.directory, uuid4().hex, transcribe)
+        session.start(rate)
+        return session
+
+    def get(
+        self, session_id: str, transcribe: Transcriber, closed: bool = False
+    ) -> Optional[LiveSession]:
+        """
+        a session that is still taking frames, or None. with closed=True
+        also one that is finishing or finished.
+        """
+        if not UPLOAD_ID.match(session_id or ""):
+            return None
+        session = LiveSession(self.directory, session_id, transcribe)
+        return session if session.exists(closed) else None
+
+    def pop(self, session_id: str, transcribe: Transcriber) -> Optional[LiveSession]:
+        """
+        stop a session taking frames and return it, for the one caller that
+        finishes it. None if it is unknown or already being finished.
+        """
+        session = self.get(session_id, transcribe)
+        if session is None or not session.close():
+            return None
+        return session
+
+    def remove_expired(self) -> None:
+        """
+        drop sessions that got no frames for ttl seconds
+        """
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            session_id, _, ext = name.partition(".")
+            path = os.path.join(self.directory, name)
+            try:
+                expired = ext == "json" and os.path.getmtime(path) < cutoff
+            except FileNotFoundError:
+                continue
+            if expired:
+                self.delete(session_id)
+
+    def delete(self, session_id: str) -> None:
+        """
+        remove every file of a session
+        """
+        for name in os.listdir(self.directory):
+            if name.startswith(f"{session_id}."):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+live_sessions = LiveSessionStore()
@@ -0,0 +1,251 @@
+"""
+Indexes and one-off data migrations for the mongo collections.
+
+Indexes are declared here next to the queries they serve and applied with
+create_indexes, which leaves existing ones alone, so the runner is safe to
+start from every worker and container. Data migrations run once each and
+are recorded in the migrations collection. A process claims a step before
+running it and renews the claim while it runs; a claim that was not
+renewed for MIGRATE_LEASE_SECONDS, because its process died mid-step, is
+taken over and the step runs again, so steps must be safe to repeat.
+
+run from machine-learning-client/: python -m backend.migrations
+the app runs it in the background at startup unless MIGRATE_ON_STARTUP=0
+"""
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import ConnectionFailure
+
+from backend.cache import EXPIRES_AT_INDEX
+from backend.DAL import TESTING, db
+from backend.queries import backfill_update
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+MIGRATE_RETRY_SECONDS = float(os.getenv("MIGRATE_RETRY_SECONDS", "5"))
+MIGRATE_LEASE_SECONDS = float(os.getenv("MIGRATE_LEASE_SECONDS", "300"))
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    # chat list pages sort and page on (updated_at, _id), newest first
+    "chats": [IndexModel([("updated_at", DESCENDING), ("_id", DESCENDING)])],
+    # messages of one chat in time order, or in a time range
+    "messages": [IndexModel([("chat_id", ASCENDING), ("timestamp", ASCENDING)])],
+    # shared cache entries and jobs are removed by mongo once expires_at has
+    # passed; the caches and the jobs module also create these on first use
+    "response_cache": [EXPIRES_AT_INDEX],
+    "transcript_cache": [EXPIRES_AT_INDEX],
+    "jobs": [EXPIRES_AT_INDEX],
+}
+
+
+def backfill_chat_summaries(database: Any) -> int:
+    """
+    fill in the summary fields of chats written before they were kept.
+    unlike chat_dal.backfill_summaries errors are raised, so a failed run
+    is not recorded as applied.
+    """
+    return database.chats.update_many(*backfill_update()).modified_count
+
+
+Migration = Tuple[str, Callable[[Any], Any]]
+
+# (name, step) in the order they run; never rename or reorder applied ones.
+# each step gets the database and must raise if it did not complete.
+MIGRATIONS: List[Migration] = [
+    ("0001_backfill_chat_summaries", backfill_chat_summaries),
+]
+
+
+def ensure_indexes(database: Any = db) -> List[str]:
+    """
+    create every declared index that does not exist yet and return the
+    names of all of them. raises if one exists with different options,
+    rather than serving queries without it.
+    """
+    names = []
+    for collection, indexes in INDEXES.items():
+        names += database[collection].create_indexes(indexes)
+    return names
+
+
+def claim_migration(
+    database: Any, name: str, lease_seconds: float = MIGRATE_LEASE_SECONDS
+) -> bool:
+    """
+    claim a step for this process: true if nobody claimed it yet, or if
+    it never finished and its claim was not renewed within the lease
+    """
+    now = datetime.now()
+    # only the process whose upsert inserts the record runs the step
+    claim = database.migrations.update_one(
+        {"_id": name},
+        {
+            "$setOnInsert": {
+                "started_at": now.isoformat(),
+                "claimed_at": now.isoformat(),
+            }
+        },
+        upsert=True,
+    )
+    if claim.upserted_id is not None:
+        return True
+    cutoff = (now - timedelta(seconds=lease_seconds)).isoformat()
+    # the filter includes the old claim time, so only one process takes over
+    takeover = database.migrations.update_one(
+        {
+            "_id": name,
+            "applied_at": None,
+            "$or": [
+                {"claimed_at": {"$lt": cutoff}},
+                {"claimed_at": None, "started_at": {"$lt": cutoff}},
+            ],
+        },
+        {"$set": {"claimed_at": now.isoformat()}},
+    )
+    if takeover.modified_count:
+        print(f"Migration {name} was left unfinished, running it again")
+    return takeover.modified_count > 0
+
+
+def renew_claim(
+    database: Any, name: str, stop: threading.Event, lease_seconds: float
+) -> None:
+    """
+    keep bumping claimed_at until stop is set, so a long step is not taken
+    over while it still runs
+    """
+    while not stop.wait(max(lease_seconds / 3, 1)):
+        database.migrations.update_one(
+            {"_id": name, "applied_at": None},
+            {"$set": {"claimed_at": datetime.now().isoformat()}},
+        )
+
+
+def apply_migrations(
+    database: Any = db,
+    migrations: Optional[List[Migration]] = None,
+    lease_seconds: float = MIGRATE_LEASE_SECONDS,
+) -> List[str]:
+    """
+    run the migrations not recorded yet, in order, and return their names.
+    each one is claimed first so two processes never run the same step.
+    """
+    applied = []
+    for name, step in MIGRATIONS if migrations is None else migrations:
+        if not claim_migration(database, name, lease_seconds):
+            continue
+        stop = threading.Event()
+        threading.Thread(
+            target=renew_claim, args=(database, name, stop, lease_seconds), daemon=True
+        ).start()
+        try:
+            result = step(database)
+        except Exception:
+            database.migrations.delete_one({"_id": name})
+            raise
+        finally:
+            stop.set()
+        database.migrations.update_one(
+            {"_id": name},
+            {"$set": {"applied_at": datetime.now().isoformat(), "result": result}},
+        )
+        applied.append(name)
+    return applied
+
+
+def run_migrations(database: Any = db) -> Dict[str, List[str]]:
+    """
+    apply indexes, then data migrations
+    """
+    return {
+        "indexes": ensure_indexes(database),
+        "migrations": apply_migrations(database),
+    }
+
+
+def migrate_when_reachable() -> None:
+    """
+    run the migrations, waiting for mongo if it is not up yet. only
+    connection errors are retried; anything else, like an OperationFailure
+    from a conflicting index, is raised and reported with its traceback.
+    """
+    while True:
+        try:
+            result = run_migrations()
+        except ConnectionFailure as e:
+            # also AutoReconnect and ServerSelectionTimeoutError
+            print(f"Mongo not reachable for migrations, retrying: {e}")
+            time.sleep(MIGRATE_RETRY_SECONDS)
+            continue
+        print(f"migrations done: {result}")
+        return
+
+
+def start_migrations() -> None:
+    """
+    run the migrations in a background thread so startup does not wait on
+    mongo. the in-memory test database needs none.
+    """
+    if TESTING or not MIGRATE_ON_STARTUP:
+        return
+    threading.Thread(target=migrate_when_reachable, daemon=True).start()
+
+
+def plan_stages(explain: Any) -> List[str]:
+    """
+    every stage of the winning plans in an explain() result, for finds and
+    aggregations alike
+    """
+    stages: List[str] = []
+
+    def walk(node: Any, in_winning_plan: bool) -> None:
+        if isinstance(node, list):
+            for item in node:
+                walk(item, in_winning_plan)
+            return
+        if not isinstance(node, dict):
+            return
+        if in_winning_plan and "stage" in node:
+            stages.append(node["stage"])
+        for key, value in node.items():
+            if key != "rejectedPlans":
+                walk(value, in_winning_plan or key == "winningPlan")
+
+    walk(explain, False)
+    return stages
+
+
+def assert_no_collscan(explain: Any) -> None:
+    """
+    fail if the winning plan of an explain() result scans a whole collection
+    """
+    stages = plan_stages(explain)
+    if "COLLSCAN" in stages:
+        raise AssertionError(f"query scans the whole collection: {stages}")
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, List[str]]:
+    """apply indexes and migrations and report what changed"""
+    parser = argparse.ArgumentParser(description="apply indexes and migrations")
+    parser.add_argument(
+        "--indexes-only", action="store_true", help="skip the data migrations"
+    )
+    args = parser.parse_args(argv)
+
+    if args.indexes_only:
+        result = {"indexes": ensure_indexes(), "migrations": []}
+    else:
+        result = run_migrations()
+    print(f"indexes: {', '.join(result['indexes']) or 'none'}")
+    print(f"migrations applied: {', '.join(result['migrations']) or 'none'}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Lazily created, fork-safe MongoDB clients.
+
+Nothing here touches the network at import. The sync and async clients are
+built on first use and dropped in forked children (gunicorn workers), which
+build their own. Whether the database can be reached is checked by a
+background thread, so a slow or missing mongo never stalls startup.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+
+
+def optional_int(name: str) -> Optional[int]:
+    """
+    integer env variable, or None if it is not set
+    """
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def client_options() -> Dict[str, Any]:
+    """
+    pool, timeout, retry and compression settings from the environment
+    """
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": optional_int("MONGO_MAX_IDLE_TIME_MS"),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(
+            os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+        ),
+        "socketTimeoutMS": optional_int("MONGO_SOCKET_TIMEOUT_MS"),
+        "retryReads": os.getenv("MONGO_RETRY_READS", "1") == "1",
+        "retryWrites": os.getenv("MONGO_RETRY_WRITES", "1") == "1",
+        # zlib needs no extra package; add zstd or snappy if installed
+        "compressors": os.getenv("MONGO_COMPRESSORS", "zlib"),
+    }
+
+
+class MongoConnection:  # pylint: disable=too-many-instance-attributes
+    """
+    one sync and one async client per process, created on first use
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        db_name: str,
+        options: Optional[Dict[str, Any]] = None,
+        client_class: Callable[..., Any] = MongoClient,
+        async_client_class: Callable[..., Any] = AsyncMongoClient,
+    ):
+        self.uri = uri
+        self.db_name = db_name
+        self.options = client_options() if options is None else options
+        self.client_class = client_class
+        self.async_client_class = async_client_class
+        self.ready = False
+        self.error: Optional[str] = "not checked yet"
+        self.check_interval = float(os.getenv("MONGO_READY_INTERVAL", "10"))
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        # clients, locks and threads of the parent are unusable after a fork;
+        # ready is kept, the parent has already reached the database
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+        self._checker: Optional[threading.Thread] = None
+
+    def client(self) -> Any:
+        """
+        the sync client, created on first use
+        """
+        with self._lock:
+            if self._client is None:
+                # connect=False: no monitor threads until the first operation
+                self._client = self.client_class(
+                    self.uri, connect=False, **self.options
+                )
+            return self._client
+
+    def async_client(self) -> Any:
+        """
+        the async client, created on first use; it connects in the event
+        loop of the first request that awaits it
+        """
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = self.async_client_class(self.uri, **self.options)
+            return self._async_client
+
+    def database(self) -> Any:
+        """
+        the database on the sync client
+        """
+        return self.client().get_database(self.db_name)
+
+    def async_database(self) -> Any:
+        """
+        the database on the async client
+        """
+        return self.async_client().get_database(self.db_name)
+
+    def ping(self) -> bool:
+        """
+        check the database answers, recording the error if it does not
+        """
+        try:
+            self.client().admin.command("ping")
+        except PyMongoError as e:
+            if self.ready or self.error != str(e):
+                print(f"Error reaching mongo: {e}")
+            self.ready, self.error = False, str(e)
+            return False
+        self.ready, self.error = True, None
+        return True
+
+    def _check_forever(self) -> None:
+        while True:
+            self.ping()
+            time.sleep(self.check_interval)
+
+    def start_readiness_check(self) -> None:
+        """
+        ping the database in a background thread every check_interval
+        seconds, unless that thread is already running
+        """
+        with self._lock:
+            if self._checker is not None and self._checker.is_alive():
+                return
+            self._checker = threading.Thread(target=self._check_forever, daemon=True)
+            self._checker.start()
+
+    def status(self) -> Tuple[bool, Optional[str]]:
+        """
+        whether the database was reachable at the last check, and why not
+        """
+        self.start_readiness_check()
+        return self.ready, self.error
+
+
+class LazyCollection:  # pylint: disable=too-few-public-methods
+    """
+    a collection that is looked up on the current client for every call,
+    so it can be kept in a module global from import time
+    """
+
+    def __init__(self, get_database: Callable[[], Any], name: str):
+        self._get_database = get_database
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self._get_database()[self._name], attr)
+
+
+class LazyDatabase:  # pylint: disable=too-few-public-methods
+    """
+    stands in for a pymongo database: attributes of the database class are
+    read from the current database, anything else is a lazy collection
+    """
+
+    def __init__(self, get_database: Callable[[], Any], database_class: type):
+        self._get_database = get_database
+        self._database_class = database_class
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if hasattr(self._database_class, name):
+            return getattr(self._get_database(), name)
+        return LazyCollection(self._get_database, name)
+
+    def __getitem__(self, name: str) -> LazyCollection:
+        return LazyCollection(self._get_database, name)
+
+
+def lazy_databases(connection: MongoConnection) -> Tuple[LazyDatabase, LazyDatabase]:
+    """
+    lazy sync and async databases of a connection
+    """
+    return (
+        LazyDatabase(connection.database, Database),
+        LazyDatabase(connection.async_database, AsyncDatabase),
+    )
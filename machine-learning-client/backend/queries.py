@@ -0,0 +1,219 @@
+"""
+Pure builders for the filters, updates and pipelines the DAL sends to mongo.
+
+They take plain values and return plain documents, so the exact queries
+production runs can be unit tested without a database.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.chat_summary import PREVIEW_LENGTH, message_preview, summary_fields
+
+# fields the chat list needs, maintained on every write to the chat
+SUMMARY_PROJECTION = {
+    "title": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "message_count": 1,
+    "last_message_preview": 1,
+    "last_role": 1,
+}
+
+# newest first, with the id breaking ties so pages never overlap
+SUMMARY_SORT = [("updated_at", -1), ("_id", -1)]
+
+
+def summaries_filter(
+    after: Optional[Tuple[Optional[str], str]], since: Optional[str]
+) -> Dict[str, Any]:
+    """
+    filter for the chats after one page of summaries
+    """
+    query_filter: Dict[str, Any] = {}
+    if after is not None:
+        updated_at, chat_id = after
+        if updated_at is None:
+            query_filter = {"updated_at": None, "_id": {"$lt": chat_id}}
+        else:
+            # chats without updated_at sort last, after every timestamp
+            query_filter = {
+                "$or": [
+                    {"updated_at": {"$lt": updated_at}},
+                    {"updated_at": updated_at, "_id": {"$lt": chat_id}},
+                    {"updated_at": None},
+                ]
+            }
+    if since is not None:
+        query_filter = {"$and": [query_filter, {"updated_at": {"$gt": since}}]}
+    return query_filter
+
+
+def chat_window_pipeline(chat_id: str, limit: int, before: str) -> List[Dict[str, Any]]:
+    """
+    aggregation keeping the `limit` messages, plus one, right before the
+    message with id `before`; messages is null if before is not in the chat
+    """
+    # fetch one extra message to know if there are older ones
+    window = limit + 1
+    end = {"$indexOfArray": ["$messages._id", before]}
+    return [
+        {"$match": {"_id": chat_id}},
+        {"$set": {"_end": end}},
+        {
+            "$set": {
+                "messages": {
+                    "$cond": [
+                        {"$gt": ["$_end", 0]},
+                        {
+                            "$slice": [
+                                "$messages",
+                                {"$max": [0, {"$subtract": ["$_end", window]}]},
+                                {"$min": ["$_end", window]},
+                            ]
+                        },
+                        {"$cond": [{"$eq": ["$_end", 0]}, [], None]},
+                    ]
+                }
+            }
+        },
+        {"$unset": "_end"},
+    ]
+
+
+def messages_since_pipeline(
+    chat_id: str, since_id: Optional[str], since_timestamp: Optional[str]
+) -> List[Dict[str, Any]]:
+    """
+    aggregation keeping only the messages after since_id or
+    since_timestamp; messages is null if since_id is not in the chat
+    """
+    messages = {"$ifNull": ["$messages", []]}
+    if since_id is not None:
+        start = {"$indexOfArray": ["$messages._id", since_id]}
+        newer = {
+            "$cond": [
+                {"$gte": ["$_start", 0]},
+                {
+                    "$slice": [
+                        messages,
+                        {"$add": ["$_start", 1]},
+                        {"$max": [1, {"$size": messages}]},
+                    ]
+                },
+                None,
+            ]
+        }
+    else:
+        start = None
+        newer = {
+            "$filter": {
+                "input": messages,
+                "as": "m",
+                "cond": {"$gt": ["$$m.timestamp", since_timestamp]},
+            }
+        }
+    return [
+        {"$match": {"_id": chat_id}},
+        {"$set": {"_start": start}},
+        {
+            "$project": {
+                "messages": newer,
+                "message_count": 1,
+                "version": 1,
+                "updated_at": 1,
+            }
+        },
+    ]
+
+
+def chat_update(update_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    update setting update_data. replacing the messages also refreshes the
+    summary fields and bumps the version, so a client holding the old
+    version fails its next versioned append. version itself is only
+    ever changed here and by appends.
+    """
+    fields = {k: v for k, v in update_data.items() if k != "version"}
+    if "messages" not in fields:
+        return {"$set": fields}
+    return {
+        "$set": {
+            **fields,
+            **summary_fields(fields["messages"]),
+            "updated_at": datetime.now().isoformat(),
+        },
+        "$inc": {"version": 1},
+    }
+
+
+def backfill_update() -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    filter and update pipeline filling in stale chat summary fields
+    """
+    messages = {"$ifNull": ["$messages", []]}
+
+    def last_message(field):
+        return {
+            "$getField": {
+                "field": field,
+                "input": {"$arrayElemAt": [messages, -1]},
+            }
+        }
+
+    query_filter = {
+        "$or": [
+            {"updated_at": None},
+            {"$expr": {"$ne": ["$message_count", {"$size": messages}]}},
+        ]
+    }
+    pipeline = [
+        {
+            "$set": {
+                "message_count": {"$size": messages},
+                "last_message_preview": {
+                    "$substrCP": [
+                        {"$ifNull": [last_message("content"), ""]},
+                        0,
+                        PREVIEW_LENGTH,
+                    ]
+                },
+                "last_role": last_message("role"),
+                "updated_at": {
+                    "$ifNull": [
+                        "$updated_at",
+                        last_message("timestamp"),
+                        "$created_at",
+                    ]
+                },
+            }
+        }
+    ]
+    return query_filter, pipeline
+
+
+def append_update(
+    chat_id: str,
+    new_messages: List[Dict[str, Any]],
+    expected_version: Optional[int],
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    filter and update pushing messages onto a chat at a version.
+    new_messages must not be empty.
+    """
+    query_filter: Dict[str, Any] = {"_id": chat_id}
+    if expected_version == 0:
+        # chats never written to have no version field yet
+        query_filter["version"] = {"$in": [None, 0]}
+    elif expected_version is not None:
+        query_filter["version"] = expected_version
+    update = {
+        "$push": {"messages": {"$each": new_messages}},
+        "$inc": {"version": 1, "message_count": len(new_messages)},
+        "$set": {
+            "updated_at": datetime.now().isoformat(),
+            "last_message_preview": message_preview(new_messages[-1]),
+            "last_role": new_messages[-1].get("role"),
+        },
+    }
+    return query_filter, update
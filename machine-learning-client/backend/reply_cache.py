@@ -0,0 +1,59 @@
+"""
+Cache of model replies, keyed by the model settings, the system messages
+and the normalized tail of the conversation the model would see.
+"""
+
+import os
+
+from backend.cache import TieredCache, cache_key
+from backend.DAL import db
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_TAIL = int(os.getenv("RESPONSE_CACHE_TAIL", "4"))
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED") == "1"
+
+# requests with this header set to 1 skip the lookup (the reply is still stored)
+BYPASS_HEADER = "X-Cache-Bypass"
+
+reply_cache = TieredCache(
+    "replies",
+    max_entries=RESPONSE_CACHE_SIZE,
+    ttl_seconds=RESPONSE_CACHE_TTL,
+    collection=db.response_cache if RESPONSE_CACHE_SHARED else None,
+)
+
+
+def normalize(text):
+    """
+    lowercase and collapse whitespace so trivial differences still hit
+    """
+    return " ".join(str(text or "").lower().split())
+
+
+def reply_cache_key(messages):
+    """
+    hash the model settings, every system message (the system prompt and the
+    running chat summary) and the last RESPONSE_CACHE_TAIL other messages,
+    so chats with a different earlier context never share a reply
+    """
+    system = [
+        normalize(m.get("content")) for m in messages if m.get("role") == "system"
+    ]
+    turns = [m for m in messages if m.get("role") != "system"]
+    tail = [
+        (m.get("role"), normalize(m.get("content")))
+        for m in turns[-RESPONSE_CACHE_TAIL:]
+    ]
+    return cache_key(
+        os.getenv("MODEL_NAME"), os.getenv("MODEL_TEMPERATURE", "0.4"), system, tail
+    )
+
+
+def cache_bypassed(headers):
+    """
+    check if the request asked to skip the cache
+    """
+    if headers.get(BYPASS_HEADER) in {"1", "true"}:
+        return True
+    return "no-cache" in headers.get("Cache-Control", "")
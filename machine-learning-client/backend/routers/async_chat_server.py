@@ -0,0 +1,214 @@
+"""
+Async variants of the chat routes that spend their time waiting on openai,
+for the ASGI app in asgi.py. A request waiting on the model holds no
+thread, so one process can keep hundreds of slow model calls in flight.
+Everything that is not I/O is shared with chat_server.
+"""
+
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+from quart import Blueprint, Response, jsonify, make_response, request
+
+from backend.DAL import async_chat_dal
+from backend.reply_cache import reply_cache_key
+from backend.summarizer import needs_summary, schedule_summary
+from backend.routers.chat_server import (
+    is_stale,
+    model_context,
+    new_assistant_message,
+    partial_reply,
+    ready_answer,
+    remember_reply,
+    sse_event,
+    wants_stream,
+)
+from backend.routers.model_client import ask_model_async, stream_model_async
+from backend.routers.speech_server import (
+    finish_live_session_async,
+    finish_upload_async,
+    transcribe_upload_async,
+)
+
+async_chat_router = Blueprint("async_chats", __name__, url_prefix="/chats/api")
+
+
+async def find_chat(chat_id):
+    """
+    fetch a chat without blocking the event loop
+    """
+    return await async_chat_dal.find_one_chat({"_id": chat_id})
+
+
+async def save_turn(chat, messages, ai_message, expected_version):
+    """
+    async chat_server.save_turn
+    """
+    new_messages = [messages[-1]] + ([ai_message] if ai_message else [])
+    success = await async_chat_dal.append_messages(
+        chat["_id"], new_messages, expected_version
+    )
+    if success and needs_summary(chat, len(messages) + len(new_messages) - 1):
+        schedule_summary(chat["_id"])
+    return success
+
+
+async def stream_reply(chat, messages, context, ready_message, expected_version):
+    """
+    async chat_server.stream_reply, also saving the turn if the client
+    disconnects mid-stream
+    """
+    parts = []
+    success = None
+    try:
+        if ready_message:
+            ai_message = ready_message
+            yield sse_event({"delta": ai_message["content"]})
+        else:
+            async for delta in stream_model_async(context):
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+            ai_message = new_assistant_message("".join(parts).strip())
+            await asyncio.to_thread(
+                remember_reply, reply_cache_key(context), ai_message["content"]
+            )
+
+        success = await save_turn(chat, messages, ai_message, expected_version)
+    finally:
+        # closed early (GeneratorExit or cancelled) or the model stream raised
+        if success is None:
+            await save_turn(
+                chat, messages, partial_reply(ready_message, parts), expected_version
+            )
+
+    if success:
+        yield sse_event(ai_message, event="message")
+    else:
+        yield sse_event({"error": "Failed to send message"}, event="error")
+
+
+async def answer_turn(chat, usr_message, expected_version, voice=False):
+    """
+    async chat_server.answer_turn
+    """
+    usr_message["_id"] = str(uuid4())
+    usr_message["timestamp"] = datetime.now().isoformat()
+
+    messages = chat.get("messages", []) + [usr_message]
+    context = model_context(chat, messages)
+    # the reply cache may be shared in mongo through the sync driver
+    ready_message, headers = await asyncio.to_thread(
+        ready_answer, usr_message, context, request.headers
+    )
+
+    if wants_stream(request):
+
+        async def events():
+            if voice:
+                yield sse_event(usr_message, event="transcript")
+            async for event in stream_reply(
+                chat, messages, context, ready_message, expected_version
+            ):
+                yield event
+
+        return Response(
+            events(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+        )
+
+    ai_message = ready_message
+    if not ai_message:
+        ai_message = new_assistant_message(await ask_model_async(context))
+        await asyncio.to_thread(
+            remember_reply, reply_cache_key(context), ai_message["content"]
+        )
+
+    success = await save_turn(chat, messages, ai_message, expected_version)
+
+    if success:
+        if voice:
+            body = {"user_message": usr_message, "assistant_message": ai_message}
+            return jsonify(body), 200, headers
+        return jsonify(ai_message), 200, headers
+
+    if expected_version is not None:
+        return jsonify({"error": "chat was changed, reload and try again"}), 409
+
+    return jsonify({"error": "Failed to send message"}), 500
+
+
+@async_chat_router.post("/<chat_id>/message")
+async def send_message(chat_id):
+    """send message to ai"""
+    chat = await find_chat(chat_id)
+    if not chat:
+        return jsonify({"error": "chat not found"}), 404
+
+    usr_message = await request.get_json(silent=True)
+    if not isinstance(usr_message, dict):
+        return jsonify({"error": "message must be a json object"}), 400
+    expected_version = usr_message.pop("expected_version", None)
+    if is_stale(chat, expected_version):
+        return jsonify({"error": "chat was changed, reload and try again"}), 409
+
+    return await answer_turn(chat, usr_message, expected_version)
+
+
+async def voice_transcript(values, audio_file):
+    """
+    transcript of a voice turn from a live session, resumable upload or
+    audio file, with the same errors as the sync route
+    """
+    if values.get("session"):
+        return await finish_live_session_async(values["session"])
+    if values.get("upload"):
+        return await finish_upload_async(values["upload"])
+    return await transcribe_upload_async(audio_file)
+
+
+@async_chat_router.post("/<chat_id>/voice")
+async def send_voice_message(chat_id):  # pylint: disable=too-many-return-statements
+    """
+    async chat_server.send_voice_message. the chat is checked first, so a
+    live session or upload is only used up for a chat that exists.
+    """
+    chat = await find_chat(chat_id)
+    if not chat:
+        return jsonify({"error": "chat not found"}), 404
+
+    values = {**request.args, **(await request.form)}
+    audio_file = (await request.files).get("audio")
+    has_file = audio_file and audio_file.filename != ""
+    if not (values.get("session") or values.get("upload") or has_file):
+        return jsonify({"error": "no audio file given"}), 400
+
+    try:
+        expected_version = values.get("expected_version")
+        expected_version = None if expected_version is None else int(expected_version)
+    except ValueError:
+        return jsonify({"error": "invalid expected_version"}), 400
+    if is_stale(chat, expected_version):
+        return jsonify({"error": "chat was changed, reload and try again"}), 409
+
+    try:
+        transcript, info = await voice_transcript(values, audio_file)
+    except KeyError:
+        return jsonify({"error": "live session or upload not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return jsonify({"error": f"failed to transcribe audio: {str(e)}"}), 500
+
+    transcript = str(transcript).strip()
+    if not transcript:
+        return jsonify({"error": "no speech found in the recording"}), 400
+
+    usr_message = {"role": "user", "content": transcript, "source": "voice"}
+    response = await make_response(
+        await answer_turn(chat, usr_message, expected_version, True)
+    )
+    if "cache" in info:
+        response.headers["X-Transcript-Cache"] = info["cache"]
+    return response
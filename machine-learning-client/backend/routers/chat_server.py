@@ -2,16 +2,59 @@
 Router for chat server interactions.
 """
 
+import base64
+import binascii
+import json
 from datetime import datetime
+from itertools import chain
 from uuid import uuid4
-from flask import Blueprint, jsonify, request
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
 
 
+from backend.chat_window import history_limit
 from backend.DAL import chat_dal
-from backend.routers.model_client import ask_model
+from backend.context_window import build_context
+from backend.faq import faq_answer
+from backend.reply_cache import cache_bypassed, reply_cache, reply_cache_key
+from backend.summarizer import needs_summary, schedule_summary, with_summary
+from backend.routers.model_client import MODEL_ERROR_REPLY, ask_model, stream_model
+from backend.routers.speech_server import (
+    finish_live_session,
+    finish_upload,
+    transcribe_upload,
+)
 
 chat_router = Blueprint("chats", __name__, url_prefix="/chats/api")
 
+SUMMARY_PAGE_SIZE = 20
+SUMMARY_PAGE_MAX = 100
+
+
+def encode_cursor(chat):
+    """
+    turn the last chat of a page into an opaque cursor
+    """
+    raw = json.dumps([chat.get("updated_at"), chat["_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """
+    turn a cursor back into (updated_at, _id), raises ValueError if it is bad
+    """
+    try:
+        updated_at, chat_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, TypeError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+    return updated_at, chat_id
+
 
 @chat_router.post("")
 def create_chat():
@@ -20,6 +63,7 @@ def create_chat():
     """
     chat_data = request.json
     chat_data["_id"] = str(uuid4())
+    chat_data["updated_at"] = datetime.now().isoformat()
     inserted_id = chat_dal.insert_one_chat(chat_data)
     if inserted_id:
         return jsonify({"inserted_id": inserted_id}), 201
@@ -33,7 +77,19 @@ def get_chat(chat_id):
     """
     if not chat_id:
         return jsonify({"error": "chat_id query parameter is required"}), 400
-    chat = chat_dal.find_one_chat({"_id": chat_id})
+
+    if "limit" in request.args or "before" in request.args:
+        # only send one window of the history, newest first page by default
+        limit = history_limit(request.args.get("limit"))
+        if limit is None:
+            return jsonify({"error": "invalid limit"}), 400
+        before = request.args.get("before")
+        chat = chat_dal.find_chat_window(chat_id, limit, before)
+        if not chat and before is not None:
+            # an unknown cursor is not the same as no older messages
+            return jsonify({"error": "chat or before message not found"}), 404
+    else:
+        chat = chat_dal.find_one_chat({"_id": chat_id})
     if chat:
         return jsonify(chat), 200
     return jsonify({"error": "chat not found"}), 404
@@ -50,6 +106,45 @@ def get_all_chats():
     return jsonify({"error": "chats not found"}), 404
 
 
+@chat_router.get("/summaries")
+def get_chat_summaries():
+    """
+    Get one page of chats for the chat list, without message history.
+    With since only chats updated after that timestamp are returned.
+    """
+    try:
+        limit = min(int(request.args.get("limit", SUMMARY_PAGE_SIZE)), SUMMARY_PAGE_MAX)
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "invalid limit or cursor"}), 400
+    if limit < 1:
+        return jsonify({"error": "invalid limit or cursor"}), 400
+
+    # fetch one extra chat to know if there is another page
+    chats = chat_dal.find_chat_summaries(limit + 1, after, request.args.get("since"))
+    next_cursor = encode_cursor(chats[limit - 1]) if len(chats) > limit else None
+    return jsonify({"chats": chats[:limit], "next_cursor": next_cursor}), 200
+
+
+@chat_router.get("/<chat_id>/messages")
+def get_new_messages(chat_id):
+    """
+    Get only the messages after ?since=<message_id|timestamp>.
+    """
+    since = request.args.get("since")
+    if not since:
+        return jsonify({"error": "since query parameter is required"}), 400
+
+    if is_timestamp(since):
+        chat = chat_dal.find_messages_since(chat_id, since_timestamp=since)
+    else:
+        chat = chat_dal.find_messages_since(chat_id, since_id=since)
+    if chat:
+        return jsonify(chat), 200
+    return jsonify({"error": "chat or message not found"}), 404
+
+
 @chat_router.put("/<chat_id>")
 def update_chat(chat_id):
     """
@@ -73,6 +168,209 @@ def delete_chat(chat_id):
     return jsonify({"error": "Failed to delete chat"}), 500
 
 
+def is_timestamp(value):
+    """
+    check if a since value is an iso timestamp rather than a message id
+    """
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def wants_stream(req=request):
+    """
+    check if the client asked for a streamed (server-sent events) reply
+    """
+    if req.args.get("stream") in {"1", "true"}:
+        return True
+    return "text/event-stream" in req.headers.get("Accept", "")
+
+
+def sse_event(data, event=None):
+    """
+    format one server-sent event
+    """
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n{payload}"
+    return payload
+
+
+def new_assistant_message(content, source=None):
+    """
+    build an assistant message document, source marks non-model answers
+    """
+    message = {
+        "_id": str(uuid4()),
+        "role": "assistant",
+        "content": content,
+        "timestamp": datetime.now().isoformat(),
+    }
+    if source:
+        message["source"] = source
+    return message
+
+
+def model_context(chat, messages):
+    """
+    swap summarized history for the summary and trim the rest to the token
+    budget before it goes to the model
+    """
+    context = build_context(with_summary(chat, messages))
+    if context.dropped_messages:
+        print(
+            f"context window dropped {context.dropped_messages} messages "
+            f"({context.dropped_tokens} tokens), sending {context.tokens} tokens"
+        )
+    return context.messages
+
+
+def save_turn(chat, messages, ai_message, expected_version):
+    """
+    append the user message and reply, then fold old turns into the summary
+    in the background if the chat grew long enough. ai_message may be None
+    when a stream was cut off before any reply arrived.
+    """
+    new_messages = [messages[-1]] + ([ai_message] if ai_message else [])
+    success = chat_dal.append_messages(chat["_id"], new_messages, expected_version)
+    if success and needs_summary(chat, len(messages) + len(new_messages) - 1):
+        schedule_summary(chat["_id"])
+    return success
+
+
+def remember_reply(key, reply):
+    """
+    cache a fresh model reply unless the model call failed
+    """
+    if reply and reply != MODEL_ERROR_REPLY:
+        reply_cache.set(key, reply)
+
+
+def partial_reply(ready_message, parts):
+    """
+    the reply a stream got to before it was cut off, or None if it had not
+    started. partial model replies are not cached.
+    """
+    if ready_message:
+        return ready_message
+    content = "".join(parts).strip()
+    return new_assistant_message(content) if content else None
+
+
+def stream_reply(chat, messages, context, ready_message, expected_version):
+    """
+    yield the ai reply as server-sent events and save it once it is complete.
+    ready_message is a faq or cached answer that needs no model call. if the
+    client disconnects mid-stream the user message and the partial reply
+    are still saved.
+    """
+    parts = []
+    success = None
+    try:
+        if ready_message:
+            ai_message = ready_message
+            yield sse_event({"delta": ai_message["content"]})
+        else:
+            for delta in stream_model(context):
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+            ai_message = new_assistant_message("".join(parts).strip())
+            remember_reply(reply_cache_key(context), ai_message["content"])
+
+        success = save_turn(chat, messages, ai_message, expected_version)
+    finally:
+        # closed early (GeneratorExit) or the model stream raised
+        if success is None:
+            save_turn(
+                chat, messages, partial_reply(ready_message, parts), expected_version
+            )
+
+    if success:
+        yield sse_event(ai_message, event="message")
+    else:
+        yield sse_event({"error": "Failed to send message"}, event="error")
+
+
+@chat_router.get("/cache")
+def get_cache_stats():
+    """
+    Get hit/miss counters of the reply cache.
+    """
+    return jsonify(reply_cache.stats()), 200
+
+
+def is_stale(chat, expected_version):
+    """
+    check if the client saw an older version of the chat than the stored one
+    """
+    return expected_version is not None and chat.get("version", 0) != expected_version
+
+
+def ready_answer(usr_message, context, request_headers):
+    """
+    a faq or cached answer that needs no model call (or None), and the
+    headers saying where it came from
+    """
+    # curated faq answers and repeated questions skip the model call
+    faq = faq_answer(usr_message.get("content"))
+    if faq:
+        ready_message = new_assistant_message(faq[0]["answer"], source="faq")
+        return ready_message, {"X-Answer-Source": "faq"}
+
+    bypass = cache_bypassed(request_headers)
+    cached = None if bypass else reply_cache.get(reply_cache_key(context))
+    ready_message = new_assistant_message(cached) if cached else None
+    return ready_message, {
+        "X-Cache": "BYPASS" if bypass else "HIT" if cached else "MISS"
+    }
+
+
+def answer_turn(chat, usr_message, expected_version, voice=False):
+    """
+    answer a user message and save both messages. voice turns also send
+    back the user message, first as its own event when streaming.
+    """
+    usr_message["_id"] = str(uuid4())
+    usr_message["timestamp"] = datetime.now().isoformat()
+
+    messages = chat.get("messages", []) + [usr_message]
+    context = model_context(chat, messages)
+
+    ready_message, headers = ready_answer(usr_message, context, request.headers)
+
+    if wants_stream():
+        events = stream_reply(chat, messages, context, ready_message, expected_version)
+        if voice:
+            events = chain([sse_event(usr_message, event="transcript")], events)
+        return Response(
+            stream_with_context(events),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+        )
+
+    # get ai response
+    ai_message = ready_message
+    if not ai_message:
+        ai_message = new_assistant_message(ask_model(context))
+        remember_reply(reply_cache_key(context), ai_message["content"])
+
+    # push both messages in one atomic write instead of rewriting the chat
+    success = save_turn(chat, messages, ai_message, expected_version)
+
+    if success:
+        if voice:
+            body = {"user_message": usr_message, "assistant_message": ai_message}
+            return jsonify(body), 200, headers
+        return jsonify(ai_message), 200, headers
+
+    if expected_version is not None:
+        return jsonify({"error": "chat was changed, reload and try again"}), 409
+
+    return jsonify({"error": "Failed to send message"}), 500
+
+
 @chat_router.post("/<chat_id>/message")
 def send_message(chat_id):
     """send message to ai"""
@@ -81,26 +379,61 @@ def send_message(chat_id):
         return jsonify({"error": "chat not found"}), 404
 
     usr_message = request.json
-    usr_message["_id"] = str(uuid4())
-    usr_message["timestamp"] = datetime.now().isoformat()
+    # optional: only append if the chat is still at the version the client saw
+    expected_version = usr_message.pop("expected_version", None)
+    if is_stale(chat, expected_version):
+        return jsonify({"error": "chat was changed, reload and try again"}), 409
 
-    messages = chat.get("messages", [])
-    messages.append(usr_message)
+    return answer_turn(chat, usr_message, expected_version)
 
-    # get ai response
-    ai_reply = ask_model(messages)
-    ai_message = {
-        "_id": str(uuid4()),
-        "role": "assistant",
-        "content": ai_reply,
-        "timestamp": datetime.now().isoformat(),
-    }
-    messages.append(ai_message)
 
-    # update chat with new messages
-    success = chat_dal.update_one_chat({"_id": chat_id}, {"messages": messages})
+@chat_router.post("/<chat_id>/voice")
+def send_voice_message(chat_id):  # pylint: disable=too-many-return-statements
+    """
+    transcribe a recording and answer it in the same request, so a voice
+    turn is one round trip instead of transcribe + message. instead of an
+    audio file, ?session= finishes a live session from /speech/api/live and
+    ?upload= a resumable upload from /speech/api/uploads.
+    """
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    if not chat:
+        return jsonify({"error": "chat not found"}), 404
+
+    session_id = request.values.get("session")
+    upload_id = request.values.get("upload")
+    audio_file = request.files.get("audio")
+    has_file = audio_file and audio_file.filename != ""
+    if not (session_id or upload_id or has_file):
+        return jsonify({"error": "no audio file given"}), 400
 
-    if success:
-        return jsonify(ai_message), 200
+    expected_version = request.form.get("expected_version")
+    try:
+        expected_version = None if expected_version is None else int(expected_version)
+    except ValueError:
+        return jsonify({"error": "invalid expected_version"}), 400
+    if is_stale(chat, expected_version):
+        return jsonify({"error": "chat was changed, reload and try again"}), 409
 
-    return jsonify({"error": "Failed to send message"}), 500
+    try:
+        if session_id:
+            transcript, info = finish_live_session(session_id)
+        elif upload_id:
+            transcript, info = finish_upload(upload_id)
+        else:
+            transcript, info = transcribe_upload(audio_file)
+    except KeyError:
+        return jsonify({"error": "live session or upload not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return jsonify({"error": f"failed to transcribe audio: {str(e)}"}), 500
+
+    transcript = str(transcript).strip()
+    if not transcript:
+        return jsonify({"error": "no speech found in the recording"}), 400
+
+    usr_message = {"role": "user", "content": transcript, "source": "voice"}
+    response = make_response(answer_turn(chat, usr_message, expected_version, True))
+    if "cache" in info:
+        response.headers["X-Transcript-Cache"] = info["cache"]
+    return response
@@ -3,23 +3,41 @@ Router for model client interactions.
 """
 
 import os
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
 
 TESTING = os.environ.get("TESTING") == "1"
 
+# reply sent when the model could not be reached
+MODEL_ERROR_REPLY = "Sorry, ai is not working right now. Try later!"
+
 if TESTING:
     # Fake model for ALL tests
     def ask_model(messages):  # pylint: disable=unused-argument
         """fak model response"""
         return "FAKE_MODEL_RESPONSE"
 
+    def stream_model(messages):  # pylint: disable=unused-argument
+        """fake streamed model response"""
+        yield from ("FAKE_", "MODEL_", "RESPONSE")
+
+    async def ask_model_async(messages):  # pylint: disable=unused-argument
+        """fake async model response"""
+        return "FAKE_MODEL_RESPONSE"
+
+    async def stream_model_async(messages):  # pylint: disable=unused-argument
+        """fake async streamed model response"""
+        for delta in ("FAKE_", "MODEL_", "RESPONSE"):
+            yield delta
+
 else:
 
     # load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "../.env"))
     load_dotenv()
 
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    # used by the async routes in the ASGI app (asgi.py)
+    async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     MODEL_NAME = os.getenv("MODEL_NAME")
     MODEL_MAX_NEW_TOKENS = int(os.getenv("MODEL_MAX_NEW_TOKENS", "256"))
     MODEL_TEMPERATURE = float(os.getenv("MODEL_TEMPERATURE", "0.4"))
@@ -41,4 +59,71 @@ else:
             return response.choices[0].message.content.strip()
         except Exception as e:  # pylint: disable=broad-exception-caught
             print(f"There was an error getting ai response: {e}")
-            return "Sorry, ai is not working right now. Try later!"
+            return MODEL_ERROR_REPLY
+
+    def stream_model(messages):
+        """
+        send message to open ai and yield the models response as it arrives
+        """
+        received = False
+        try:
+            stream = client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                max_tokens=MODEL_MAX_NEW_TOKENS,
+                temperature=MODEL_TEMPERATURE,
+                stream=True,
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    received = True
+                    yield delta
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"There was an error streaming ai response: {e}")
+            if not received:
+                yield MODEL_ERROR_REPLY
+
+    async def ask_model_async(messages):
+        """
+        ask_model on the async openai client, so many slow calls can wait
+        in one event loop instead of a thread each
+        """
+        try:
+            response = await async_client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                max_tokens=MODEL_MAX_NEW_TOKENS,
+                temperature=MODEL_TEMPERATURE,
+            )
+            return response.choices[0].message.content.strip()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"There was an error getting ai response: {e}")
+            return MODEL_ERROR_REPLY
+
+    async def stream_model_async(messages):
+        """
+        stream_model on the async openai client
+        """
+        received = False
+        try:
+            stream = await async_client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                max_tokens=MODEL_MAX_NEW_TOKENS,
+                temperature=MODEL_TEMPERATURE,
+                stream=True,
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    received = True
+                    yield delta
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"There was an error streaming ai response: {e}")
+            if not received:
+                yield MODEL_ERROR_REPLY
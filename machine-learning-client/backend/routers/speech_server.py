@@ -2,17 +2,388 @@
 Speech server router for handling audio transcription requests.
 """
 
+import asyncio
+import hashlib
+import json
 import os
 import tempfile
 
-from flask import Blueprint, jsonify, request
-from openai import OpenAI
+from flask import Blueprint, Request, Response, jsonify, request, stream_with_context
+from openai import AsyncOpenAI, OpenAI
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
+from backend.audio import TARGET_RATE, preprocess_segments
+from backend.cache import TieredCache, cache_key
+from backend.DAL import db, jobs_dal
+from backend.jobs import job_updates, public_job, submit_job
+from backend.live_session import live_sessions
+from backend.transcription import transcribe_segments, transcribe_segments_async
+from backend.uploads import upload_store
+
 TESTING = os.environ.get("TESTING") == "1"
 
+WHISPER_MODEL = "whisper-1"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# uploads stay in memory up to this size (whisper takes at most 25 MB)
+AUDIO_SPOOL_MAX_BYTES = int(os.getenv("AUDIO_SPOOL_MAX_BYTES", str(25 * 1024 * 1024)))
+
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "256"))
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", "604800"))
+TRANSCRIPT_CACHE_SHARED = os.getenv("TRANSCRIPT_CACHE_SHARED") == "1"
+
+transcript_cache = TieredCache(
+    "transcripts",
+    max_entries=TRANSCRIPT_CACHE_SIZE,
+    ttl_seconds=TRANSCRIPT_CACHE_TTL,
+    collection=db.transcript_cache if TRANSCRIPT_CACHE_SHARED else None,
+)
+
 speech_router = Blueprint("speech", __name__, url_prefix="/speech/api")
 
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """
+    spooled file that hashes the upload as the request body is written to
+    it, so the transcript cache key needs no second pass over the audio
+    """
+
+    def __init__(self, max_size):
+        super().__init__(max_size=max_size)
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, s):
+        self.digest.update(s)
+        self.size += len(s)
+        return super().write(s)
+
+
+class SpooledRequest(Request):
+    """
+    request whose file uploads are kept in a per-request spooled file that
+    only spills to disk above AUDIO_SPOOL_MAX_BYTES
+    """
+
+    def _get_file_stream(  # pylint: disable=unused-argument
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return HashingSpooledFile(max_size=AUDIO_SPOOL_MAX_BYTES)
+
+
+def hash_upload(stream):
+    """
+    sha256 and size of an uploaded file. taken from the spooled file when it
+    was hashed on the way in, otherwise read in chunks and rewound
+    """
+    if isinstance(stream, HashingSpooledFile):
+        return stream.digest.hexdigest(), stream.size
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+
+def prepare_upload(stream, filename):
+    """
+    decode, trim and downsample uploads before they are sent off, splitting
+    long ones at silence. the webm the frontend records is decoded too, so
+    long voice notes are transcribed in parallel segments. formats that
+    cannot be decoded are handed over whole in one request. returns the
+    file tuples for openai and the preprocessing stats.
+    """
+    segments, stats = preprocess_segments(stream.read())
+    stream.seek(0)
+    if not stats["processed"]:
+        return [(filename, stream)], stats
+    print(
+        f"Trimmed audio upload: {stats['bytes_saved']} bytes, "
+        f"{stats['seconds_saved']}s saved, {stats['segments']} segment(s)"
+    )
+    # the segments are wav whatever came in, and whisper goes by the name
+    wav_name = f"{os.path.splitext(filename)[0] or 'recording'}.wav"
+    return [(wav_name, segment) for segment in segments], stats
+
+
+def audio_headers(stats):
+    """
+    response headers reporting what preprocessing saved
+    """
+    if not stats.get("processed"):
+        return {}
+    return {
+        "X-Audio-Bytes-Saved": str(stats["bytes_saved"]),
+        "X-Audio-Seconds-Saved": str(stats["seconds_saved"]),
+    }
+
+
+@speech_router.get("/cache")
+def get_cache_stats():
+    """
+    hit/miss counters of the transcript cache
+    """
+    return jsonify(transcript_cache.stats()), 200
+
+
+@speech_router.post("/live")
+def create_live_session():
+    """
+    open a live session; frames are raw 16 bit mono PCM at ?rate= (16 kHz
+    by default)
+    """
+    rate = request.args.get("rate", TARGET_RATE, type=int)
+    if not 8000 <= rate <= 48000:
+        return jsonify({"error": "rate must be between 8000 and 48000"}), 400
+    session = live_sessions.create(transcribe_wav, rate)
+    return jsonify({"session_id": session.id, "sample_rate": rate}), 201
+
+
+@speech_router.post("/live/<session_id>/frames")
+def add_live_frames(session_id):
+    """
+    append audio frames; finished utterances are transcribed right away
+    """
+    session = live_sessions.get(session_id, transcribe_wav)
+    if not session:
+        return jsonify({"error": "live session not found"}), 404
+    try:
+        sent = session.add_frames(request.get_data())
+    except KeyError:
+        # finished by another request since the lookup
+        return jsonify({"error": "live session not found"}), 404
+    return jsonify({"utterances_sent": sent, "partial": session.partial()}), 200
+
+
+@speech_router.get("/live/<session_id>/events")
+def live_events(session_id):
+    """
+    server-sent partial transcripts, then the final one
+    """
+    session = live_sessions.get(session_id, transcribe_wav, closed=True)
+    if not session:
+        return jsonify({"error": "live session not found"}), 404
+    events = (
+        f"event: {e['event']}\ndata: {json.dumps({'transcript': e['transcript']})}\n\n"
+        for e in session.stream_events()
+    )
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def finish_live_session(session_id):
+    """
+    close a live session and return its transcript and info like
+    transcribe_upload. raises KeyError for unknown sessions.
+    """
+    session = live_sessions.pop(session_id, transcribe_wav)
+    if not session:
+        raise KeyError(session_id)
+    return session.finish(), {}
+
+
+async def finish_live_session_async(session_id):
+    """
+    finish_live_session without holding a thread while it waits
+    """
+    session = live_sessions.pop(session_id, transcribe_wav)
+    if not session:
+        raise KeyError(session_id)
+    return await session.finish_async(), {}
+
+
+@speech_router.post("/live/<session_id>/finish")
+def finish_live(session_id):
+    """
+    transcribe what is left and return the whole transcript
+    """
+    try:
+        transcript, _ = finish_live_session(session_id)
+    except KeyError:
+        return jsonify({"error": "live session not found"}), 404
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return jsonify({"error": f"failed to transcribe audio: {str(e)}"}), 500
+    return jsonify({"transcript": transcript}), 200
+
+
+@speech_router.post("/uploads")
+def create_upload():
+    """
+    start a resumable upload, body {"filename": ..., "size": total bytes}
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        size = None if body.get("size") is None else int(body["size"])
+        status = upload_store.create(body.get("filename") or "recording.webm", size)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    location = f"{speech_router.url_prefix}/uploads/{status['upload_id']}"
+    return jsonify(status), 201, {"Location": location, "Upload-Offset": "0"}
+
+
+@speech_router.get("/uploads/<upload_id>")
+def get_upload(upload_id):
+    """
+    how many bytes of an upload arrived, so a client knows where to resume
+    """
+    status = upload_store.status(upload_id)
+    if status is None:
+        return jsonify({"error": "upload not found"}), 404
+    return jsonify(status), 200, {"Upload-Offset": str(status["offset"])}
+
+
+@speech_router.put("/uploads/<upload_id>")
+def put_upload_chunk(upload_id):
+    """
+    write the request body at the Upload-Offset header (or ?offset=)
+    """
+    offset = request.headers.get("Upload-Offset", request.args.get("offset"))
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Upload-Offset header is required"}), 400
+
+    try:
+        new_offset = upload_store.write(upload_id, offset, request.stream)
+    except KeyError:
+        return jsonify({"error": "upload not found"}), 404
+    except ValueError as e:
+        # the upload may have been finalized or expired since the write
+        status = upload_store.status(upload_id)
+        if status is None:
+            return jsonify({"error": "upload not found"}), 404
+        return jsonify({"error": str(e), "offset": status["offset"]}), 409
+    return jsonify({"offset": new_offset}), 200, {"Upload-Offset": str(new_offset)}
+
+
+def transcribe_stored_upload(upload_id):
+    """
+    transcribe a finished resumable upload like transcribe_upload, keeping
+    it. raises KeyError for unknown uploads and ValueError while bytes are
+    still missing.
+    """
+    status = upload_store.status(upload_id)
+    if status is None:
+        raise KeyError(upload_id)
+    if status["size"] is not None and not status["complete"]:
+        raise ValueError(f"upload is incomplete, {status['offset']} bytes received")
+    with upload_store.open(upload_id) as stream:
+        return transcribe_upload(FileStorage(stream, filename=status["filename"]))
+
+
+def finish_upload(upload_id):
+    """
+    transcribe_stored_upload, then delete the upload. failed transcriptions
+    keep it for a retry.
+    """
+    result = transcribe_stored_upload(upload_id)
+    upload_store.delete(upload_id)
+    return result
+
+
+async def finish_upload_async(upload_id):
+    """
+    finish_upload on the async openai client
+    """
+    status = upload_store.status(upload_id)
+    if status is None:
+        raise KeyError(upload_id)
+    if status["size"] is not None and not status["complete"]:
+        raise ValueError(f"upload is incomplete, {status['offset']} bytes received")
+    with upload_store.open(upload_id) as stream:
+        result = await transcribe_upload_async(
+            FileStorage(stream, filename=status["filename"])
+        )
+    upload_store.delete(upload_id)
+    return result
+
+
+@speech_router.post("/uploads/<upload_id>/finalize")
+def finalize_upload(upload_id):
+    """
+    transcribe a complete upload
+    """
+    try:
+        transcript, info = finish_upload(upload_id)
+    except KeyError:
+        return jsonify({"error": "upload not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return jsonify({"error": f"failed to transcribe audio: {str(e)}"}), 500
+    headers = {"X-Cache": info["cache"], **audio_headers(info)}
+    return jsonify({"transcript": transcript}), 200, headers
+
+
+@speech_router.post("/jobs")
+def create_job():
+    """
+    queue a transcription and return its job id right away. takes a
+    multipart audio file or {"upload_id": ...} of a resumable upload.
+    """
+    audio_file = request.files.get("audio")
+    if audio_file and audio_file.filename:
+        # the request stream is gone once we return, keep the audio on disk
+        status = upload_store.create(audio_file.filename)
+        try:
+            upload_store.write(status["upload_id"], 0, audio_file.stream)
+        except ValueError as e:
+            upload_store.delete(status["upload_id"])
+            return jsonify({"error": str(e)}), 400
+    else:
+        body = request.get_json(silent=True) or {}
+        status = upload_store.status(body.get("upload_id"))
+        if status is None:
+            return jsonify({"error": "no audio file or upload_id given"}), 400
+
+    try:
+        # the job deletes the upload once it is done or failed
+        job = submit_job(
+            status["upload_id"],
+            status["filename"],
+            transcribe_stored_upload,
+            upload_store.delete,
+        )
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 500
+    location = f"{speech_router.url_prefix}/jobs/{job['_id']}"
+    return jsonify(public_job(job)), 202, {"Location": location}
+
+
+@speech_router.get("/jobs/<job_id>")
+def get_job(job_id):
+    """
+    status of a transcription job, with the transcript once it is done
+    """
+    job = jobs_dal.find_job(job_id)
+    if not job:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(public_job(job)), 200
+
+
+@speech_router.get("/jobs/<job_id>/events")
+def job_events(job_id):
+    """
+    server-sent status changes of a job, ending when it is done or failed
+    """
+    if not jobs_dal.find_job(job_id):
+        return jsonify({"error": "job not found"}), 404
+    events = (
+        f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+        for job in job_updates(job_id)
+    )
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if TESTING:
     # Fake speech transcription during tests
     @speech_router.post("/transcribe")
@@ -26,6 +397,24 @@ if TESTING:
 
         return jsonify({"text": "FAKE_TRANSCRIPTION"}), 200
 
+    def transcribe_upload(audio_file):  # pylint: disable=unused-argument
+        """
+        fake transcript of an uploaded file for testing
+        """
+        return "FAKE_TRANSCRIPTION", {"cache": "MISS"}
+
+    async def transcribe_upload_async(audio_file):  # pylint: disable=unused-argument
+        """
+        fake async transcript of an uploaded file for testing
+        """
+        return "FAKE_TRANSCRIPTION", {"cache": "MISS"}
+
+    def transcribe_wav(wav):  # pylint: disable=unused-argument
+        """
+        fake transcript of one live utterance for testing
+        """
+        return "FAKE_TRANSCRIPTION"
+
 else:
     # open ai setup
     api_key = os.getenv("OPENAI_API_KEY")
@@ -34,8 +423,85 @@ else:
         raise ValueError("PLEASE SETUP OPEN AI KEY IN THE .env")
 
     client = OpenAI(api_key=api_key)
+    # used by the async routes in the ASGI app (asgi.py)
+    async_client = AsyncOpenAI(api_key=api_key)
 
-    speech_router = Blueprint("speech", __name__, url_prefix="/speech/api")
+    def transcribe_file(upload):
+        """
+        one whisper request for a (filename, file) tuple
+        """
+        return client.audio.transcriptions.create(
+            model=WHISPER_MODEL, file=upload, response_format="text"
+        )
+
+    def transcribe_wav(wav):
+        """
+        transcript of one live utterance
+        """
+        return transcribe_file(("utterance.wav", wav))
+
+    def upload_cache_key(audio_file):
+        """
+        transcript cache key of an uploaded file, raises ValueError if the
+        file is empty
+        """
+        digest, size = hash_upload(audio_file.stream)
+        if size == 0:
+            raise ValueError("Audio file is empty")
+        return cache_key(WHISPER_MODEL, digest)
+
+    def transcribe_upload(audio_file):
+        """
+        transcript of an uploaded file and info on how it was produced
+        (cache HIT/MISS plus the preprocessing stats). raises ValueError if
+        the file is empty.
+        """
+        # browsers retry the same recording on flaky connections
+        key = upload_cache_key(audio_file)
+        cached = transcript_cache.get(key)
+        if cached is not None:
+            return cached, {"cache": "HIT"}
+
+        # hand the upload to openai straight from memory, the filename
+        # only tells whisper which format it is
+        filename = secure_filename(audio_file.filename) or "recording.webm"
+        uploads, stats = prepare_upload(audio_file.stream, filename)
+        transcript_text = transcribe_segments(uploads, transcribe_file)
+
+        transcript_cache.set(key, transcript_text)
+        return transcript_text, {"cache": "MISS", **stats}
+
+    async def transcribe_file_async(upload):
+        """
+        transcribe_file on the async openai client
+        """
+        return await async_client.audio.transcriptions.create(
+            model=WHISPER_MODEL, file=upload, response_format="text"
+        )
+
+    async def transcribe_upload_async(audio_file):
+        """
+        transcribe_upload on the async openai client; segments of long
+        recordings are sent concurrently without a thread each
+        """
+        # hashing up to 25 MB and the shared cache's mongo lookups block,
+        # keep them off the event loop
+        key = await asyncio.to_thread(upload_cache_key, audio_file)
+        cached = await asyncio.to_thread(transcript_cache.get, key)
+        if cached is not None:
+            return cached, {"cache": "HIT"}
+
+        filename = secure_filename(audio_file.filename) or "recording.webm"
+        # decoding and trimming is numpy work, keep it off the event loop
+        uploads, stats = await asyncio.to_thread(
+            prepare_upload, audio_file.stream, filename
+        )
+        transcript_text = await transcribe_segments_async(
+            uploads, transcribe_file_async
+        )
+
+        await asyncio.to_thread(transcript_cache.set, key, transcript_text)
+        return transcript_text, {"cache": "MISS", **stats}
 
     @speech_router.post("/transcribe")
     def transcribe_audio():
@@ -48,34 +514,12 @@ else:
         if audio_file.filename == "":
             return jsonify({"error": "no audio file"}), 400
 
-        temp_path = None
-
         try:
-            # temp files to send to oai
-            temp_dir = tempfile.gettempdir()
-            filename = secure_filename(audio_file.filename)
-            temp_path = os.path.join(temp_dir, filename)
-            audio_file.save(temp_path)
-            # check if saved temp audio file
-            if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
-                return (
-                    jsonify({"error": "Audio file is empty or could not be saved"}),
-                    400,
-                )
-
-            # transcribe audio using openai
-            with open(temp_path, "rb") as f:
-                transcript_text = client.audio.transcriptions.create(
-                    model="whisper-1", file=f, response_format="text"
-                )
-
-            return jsonify({"transcript": transcript_text})
+            transcript_text, info = transcribe_upload(audio_file)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:  # pylint: disable=broad-exception-caught
             return jsonify({"error": f"failed to transcribe audio: {str(e)}"}), 500
-        finally:
-            # clean up temp file
-            if temp_path and os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"could not remove temp file {temp_path}: {e}")
+
+        headers = {"X-Cache": info["cache"], **audio_headers(info)}
+        return jsonify({"transcript": transcript_text}), 200, headers
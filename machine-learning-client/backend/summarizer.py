@@ -0,0 +1,112 @@
+"""
+Opt-in rolling summary of long chats.
+
+Once a chat has more than CHAT_SUMMARY_THRESHOLD messages that are not yet
+summarized, the older ones are folded into a `summary` field on the chat in a
+background thread. The model then gets the summary plus the recent turns
+instead of the whole history. `summarized_count` records how many of the
+first messages the summary covers.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from backend.DAL import chat_dal
+from backend.routers.model_client import MODEL_ERROR_REPLY, ask_model
+
+SUMMARY_ENABLED = os.getenv("CHAT_SUMMARY_ENABLED") == "1"
+SUMMARY_THRESHOLD = int(os.getenv("CHAT_SUMMARY_THRESHOLD", "20"))
+SUMMARY_KEEP_RECENT = int(os.getenv("CHAT_SUMMARY_KEEP_RECENT", "8"))
+
+SUMMARY_PROMPT = (
+    "You summarize a conversation between a senior and a tech support "
+    "assistant. Keep every detail that matters later: the devices, apps and "
+    "settings they use, what was already tried, and what is still unsolved. "
+    "Reply with the updated summary only."
+)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+_pending = set()
+_pending_lock = Lock()
+
+
+def with_summary(chat, messages):
+    """
+    replace the summarized part of the history with one system message
+    """
+    summary = chat.get("summary")
+    if not summary:
+        return messages
+    covered = chat.get("summarized_count", 0)
+    return [
+        {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+    ] + messages[covered:]
+
+
+def needs_summary(chat, message_count):
+    """
+    check if enough unsummarized messages piled up to fold them in
+    """
+    unsummarized = message_count - chat.get("summarized_count", 0)
+    return SUMMARY_ENABLED and unsummarized > SUMMARY_THRESHOLD
+
+
+def summarize_chat(chat_id):
+    """
+    fold everything but the recent turns into the chat summary
+    """
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    if not chat:
+        return False
+
+    messages = chat.get("messages", [])
+    covered = chat.get("summarized_count")
+    upto = len(messages) - SUMMARY_KEEP_RECENT
+    if upto <= (covered or 0):
+        return False
+
+    transcript = "\n".join(
+        f"{m.get('role', 'user')}: {m.get('content', '')}"
+        for m in messages[covered or 0 : upto]
+    )
+    previous = chat.get("summary") or "(none)"
+    summary = ask_model(
+        [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {
+                "role": "user",
+                "content": f"Summary so far:\n{previous}\n\nNew messages:\n{transcript}",
+            },
+        ]
+    )
+    if not summary or summary == MODEL_ERROR_REPLY:
+        return False
+
+    # only write if no other summary landed since we read the chat
+    return chat_dal.update_one_chat(
+        {"_id": chat_id, "summarized_count": covered},
+        {"summary": summary, "summarized_count": upto},
+    )
+
+
+def schedule_summary(chat_id):
+    """
+    summarize a chat in the background, at most once at a time per chat
+    """
+    with _pending_lock:
+        if chat_id in _pending:
+            return None
+        _pending.add(chat_id)
+
+    def run():
+        try:
+            return summarize_chat(chat_id)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"There was an error summarizing chat {chat_id}: {e}")
+            return False
+        finally:
+            with _pending_lock:
+                _pending.discard(chat_id)
+
+    return executor.submit(run)
@@ -0,0 +1,86 @@
+"""
+Parallel transcription of long recordings.
+
+Segments produced by backend.audio.split_at_silence are transcribed on a
+bounded, shared thread pool (or, on the async client, at most
+TRANSCRIBE_WORKERS at a time per recording) and stitched back together in
+order. Because
+neighbouring segments overlap a little, the words repeated across a cut
+are dropped when stitching.
+"""
+
+import asyncio
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Sequence, TypeVar
+
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "4"))
+# at most this many words are looked at when matching a cut's overlap
+MAX_OVERLAP_WORDS = 8
+
+Segment = TypeVar("Segment")
+
+# one pool for the whole process so concurrent uploads share the bound
+executor = ThreadPoolExecutor(
+    max_workers=TRANSCRIBE_WORKERS, thread_name_prefix="transcribe"
+)
+
+
+def normalize_word(word: str) -> str:
+    """
+    lowercase a word and strip punctuation for overlap matching
+    """
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def stitch_transcripts(texts: Sequence[str]) -> str:
+    """
+    join segment transcripts in order, dropping the words at the start of
+    each one that repeat the end of the previous one
+    """
+    if len(texts) == 1:
+        return texts[0]
+
+    words: List[str] = []
+    for text in texts:
+        new = str(text).split()
+        limit = min(MAX_OVERLAP_WORDS, len(words), len(new))
+        tail = [normalize_word(w) for w in words[-limit:]] if limit else []
+        for k in range(limit, 0, -1):
+            if tail[-k:] == [normalize_word(w) for w in new[:k]]:
+                new = new[k:]
+                break
+        words += new
+    return " ".join(words)
+
+
+def transcribe_segments(
+    segments: Sequence[Segment], transcribe: Callable[[Segment], str]
+) -> str:
+    """
+    transcribe every segment, in parallel when there is more than one, and
+    stitch the results in order
+    """
+    if len(segments) == 1:
+        return transcribe(segments[0])
+    return stitch_transcripts(list(executor.map(transcribe, segments)))
+
+
+async def transcribe_segments_async(
+    segments: Sequence[Segment],
+    transcribe: Callable[[Segment], Awaitable[str]],
+    limit: int = TRANSCRIBE_WORKERS,
+) -> str:
+    """
+    transcribe_segments for an async transcriber, with at most limit
+    segments in flight so a long recording cannot flood the api
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(segment: Segment) -> str:
+        async with semaphore:
+            return await transcribe(segment)
+
+    texts = await asyncio.gather(*(bounded(segment) for segment in segments))
+    return stitch_transcripts(texts)
@@ -0,0 +1,133 @@
+"""
+Resumable audio uploads for slow connections.
+
+An upload is a pair of files in UPLOAD_DIR: `<id>.part` with the bytes
+received so far and `<id>.json` with the filename and declared size. The
+offset of an upload is simply the size of its part file, so after a dropped
+connection the client asks for the offset and only sends what is missing.
+Keeping them on disk rather than in memory lets every worker on the host
+serve the same upload.
+"""
+
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Any, BinaryIO, Dict, Optional
+from uuid import uuid4
+
+UPLOAD_DIR = os.getenv(
+    "UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "wecare-uploads")
+)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_TTL = int(os.getenv("UPLOAD_TTL", "86400"))
+COPY_CHUNK_SIZE = 64 * 1024
+
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadStore:
+    """
+    upload sessions kept as files in one directory
+    """
+
+    def __init__(self, directory: str = UPLOAD_DIR, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def create(self, filename: str, size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        start an upload of size bytes (if known), dropping expired ones
+        """
+        if size is not None and not 0 < size <= self.max_bytes:
+            raise ValueError(f"size must be between 1 and {self.max_bytes} bytes")
+        os.makedirs(self.directory, exist_ok=True)
+        self.remove_expired()
+
+        upload_id = uuid4().hex
+        meta = {"filename": filename, "size": size, "created_at": time.time()}
+        with open(self._path(upload_id, "json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        with open(self._path(upload_id, "part"), "wb"):
+            pass
+        return self.status(upload_id)
+
+    def status(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """
+        filename, declared size and current offset of an upload, or None
+        """
+        if not UPLOAD_ID.match(upload_id or ""):
+            return None
+        try:
+            with open(self._path(upload_id, "json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            offset = os.path.getsize(self._path(upload_id, "part"))
+        except (OSError, ValueError):
+            return None
+        return {
+            "upload_id": upload_id,
+            "filename": meta["filename"],
+            "size": meta["size"],
+            "offset": offset,
+            "complete": meta["size"] is not None and offset >= meta["size"],
+        }
+
+    def write(self, upload_id: str, offset: int, stream: BinaryIO) -> int:
+        """
+        write a chunk at offset and return the new offset. a chunk may start
+        before the current offset (a retried chunk that did arrive) but not
+        after it. raises KeyError for unknown uploads and ValueError for a
+        bad offset or an upload growing too large.
+        """
+        status = self.status(upload_id)
+        if status is None:
+            raise KeyError(upload_id)
+        if not 0 <= offset <= status["offset"]:
+            raise ValueError(f"offset must be between 0 and {status['offset']}")
+        limit = status["size"] or self.max_bytes
+
+        with open(self._path(upload_id, "part"), "r+b") as f:
+            f.seek(offset)
+            f.truncate()
+            written = offset
+            for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b""):
+                written += len(chunk)
+                if written > limit:
+                    f.truncate(offset)
+                    raise ValueError(f"upload is larger than {limit} bytes")
+                f.write(chunk)
+        return written
+
+    def open(self, upload_id: str) -> BinaryIO:
+        """
+        the uploaded bytes, for reading
+        """
+        return open(self._path(upload_id, "part"), "rb")
+
+    def delete(self, upload_id: str) -> None:
+        """
+        remove an upload's files
+        """
+        for ext in ("part", "json"):
+            try:
+                os.remove(self._path(upload_id, ext))
+            except FileNotFoundError:
+                pass
+
+    def remove_expired(self) -> None:
+        """
+        drop uploads that got no bytes for UPLOAD_TTL seconds
+        """
+        cutoff = time.time() - UPLOAD_TTL
+        for name in os.listdir(self.directory):
+            upload_id, _, ext = name.partition(".")
+            path = os.path.join(self.directory, name)
+            if ext == "part" and os.path.getmtime(path) < cutoff:
+                self.delete(upload_id)
+
+    def _path(self, upload_id: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{upload_id}.{ext}")
+
+
+upload_store = UploadStore()
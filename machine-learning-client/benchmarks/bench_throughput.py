@@ -0,0 +1,91 @@
+"""
+Throughput benchmark for comparing the dev server with serve.py.
+
+Start the service one way, run the benchmark, then restart it the other
+way and run it again with the same arguments:
+
+    TESTING=1 python app.py           # werkzeug dev server
+    TESTING=1 python serve.py         # gunicorn
+
+    python -m benchmarks.bench_throughput --url http://localhost:5050/health \
+        --concurrency 32 --requests 2000
+
+TESTING=1 swaps openai and mongo for fakes, so the numbers measure the
+server rather than the model. Point --url at a POST route with --body to
+exercise more of the app.
+"""
+
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def timed_request(url, body=None):
+    """
+    seconds one request took, or None if it failed
+    """
+    data = None if body is None else json.dumps(body).encode()
+    req = urllib.request.Request(
+        url, data=data, headers={"Content-Type": "application/json"}
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+    except (urllib.error.URLError, OSError):
+        return None
+    return time.perf_counter() - start
+
+
+def percentile(values, share):
+    """
+    value below which share of the sorted values fall
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run(url, concurrency, requests, body=None):
+    """
+    send requests from concurrency threads and summarise the timings
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(lambda _: timed_request(url, body), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    ok = sorted(t for t in timings if t is not None)
+    return {
+        "requests": requests,
+        "errors": requests - len(ok),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(ok) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ok, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(ok, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(ok, 0.99) * 1000, 1),
+    }
+
+
+def main():
+    """
+    parse arguments and print the summary
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--url", default="http://localhost:5050/health")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--body", help="json body to POST instead of a GET")
+    args = parser.parse_args()
+
+    body = json.loads(args.body) if args.body else None
+    result = run(args.url, args.concurrency, args.requests, body)
+    for key, value in result.items():
+        print(f"{key:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark of the disk I/O saved by handing audio uploads to the
+transcription client from memory instead of through a temp file.
+
+run from machine-learning-client/:
+    python -m benchmarks.bench_upload_io --size-kb 500 --requests 200
+
+The old path hashed every upload in a separate pass, saved it to
+tempfile.gettempdir()/<filename>, reopened it for the api call and deleted
+it. The new path hashes the body as it is written to the per-request
+spooled file, then reads that file once for the api call.
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import time
+
+# the benchmark only needs the helpers, not a database or an api key
+os.environ.setdefault("TESTING", "1")
+
+from backend.routers.speech_server import (  # pylint: disable=wrong-import-position
+    HashingSpooledFile,
+    hash_upload,
+)
+
+
+def process_write_bytes():
+    """
+    bytes this process caused to be written to storage (linux only)
+    """
+    try:
+        with open("/proc/self/io", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def spool(upload, spooled):
+    """copy the body into the request's spooled file, as werkzeug does"""
+    for chunk in iter(lambda: upload.read(64 * 1024), b""):
+        spooled.write(chunk)
+    spooled.seek(0)
+
+
+def temp_file_path(upload):
+    """the old path: spool, hash, save, reopen, read, delete"""
+    max_size = len(upload.getvalue()) + 1
+    path = os.path.join(tempfile.gettempdir(), "recording.webm")
+    with tempfile.SpooledTemporaryFile(max_size=max_size) as spooled:
+        spool(upload, spooled)
+        hash_upload(spooled)
+        with open(path, "wb") as f:
+            f.write(spooled.read())
+    with open(path, "rb") as f:
+        f.read()
+    os.remove(path)
+
+
+def in_memory_path(upload):
+    """the new path: hash while spooling, read once for the api"""
+    with HashingSpooledFile(max_size=len(upload.getvalue()) + 1) as spooled:
+        spool(upload, spooled)
+        hash_upload(spooled)
+        spooled.read()
+
+
+def run(name, fn, payload, requests):
+    """
+    time one path and report the bytes it wrote. write counters are read
+    right around each upload call, so the benchmark's own output and any
+    logging between calls are not counted.
+    """
+    elapsed = 0.0
+    written = 0
+    for _ in range(requests):
+        upload = io.BytesIO(payload)
+        before = process_write_bytes()
+        start = time.perf_counter()
+        fn(upload)
+        elapsed += time.perf_counter() - start
+        after = process_write_bytes()
+        if before is None or written is None:
+            written = None
+        else:
+            written += after - before
+    written = "n/a" if written is None else f"{written / 1024:.0f} KB"
+    print(
+        f"{name:<10} {elapsed * 1000 / requests:8.3f} ms/request  "
+        f"written: {written}"
+    )
+
+
+def main():
+    """run both paths on the same payload"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-kb", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size_kb * 1024)
+    print(f"{args.requests} uploads of {args.size_kb} KB")
+    run("temp file", temp_file_path, payload, args.requests)
+    run("in memory", in_memory_path, payload, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Production entry point for the machine learning client: runs app.py under
+gunicorn instead of the single process werkzeug dev server.
+
+    python serve.py
+
+The app is imported once in the master (preload) so the openai clients and
+the rest of the module state are built once and shared copy-on-write with
+the workers. Nothing at import opens a mongo connection or starts a
+thread; each worker starts its own background tasks (readiness check,
+migrations, job recovery) right after it is forked. Send the master SIGHUP
+to restart workers gracefully; in-flight requests get
+SERVE_GRACEFUL_TIMEOUT seconds to finish.
+
+Live sessions, resumable uploads and jobs are kept on disk or in mongo, so
+any worker can serve any request. Each worker runs many threads, which
+spend nearly all their time waiting on openai.
+"""
+
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+# threads per cpu core; requests here are mostly waiting on the network
+THREADS_PER_CPU = 4
+
+
+def default_workers(cpus=None):
+    """
+    one worker per cpu, at least two so a restarting worker is not an outage
+    """
+    return max(2, cpus or multiprocessing.cpu_count())
+
+
+def default_threads(cpus=None):
+    """
+    threads per worker sized from the cpu count
+    """
+    return max(8, (cpus or multiprocessing.cpu_count()) * THREADS_PER_CPU)
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """
+    gunicorn hook: start the app's background threads in the new worker
+    """
+    from app import start_background_tasks  # pylint: disable=import-outside-toplevel
+
+    start_background_tasks()
+
+
+def server_options():
+    """
+    gunicorn settings, overridable from the environment
+    """
+    return {
+        "bind": f"0.0.0.0:{os.getenv('PORT', '5050')}",
+        "workers": int(os.getenv("SERVE_WORKERS", str(default_workers()))),
+        "threads": int(os.getenv("SERVE_THREADS", str(default_threads()))),
+        "worker_class": "gthread",
+        "preload_app": True,
+        "timeout": int(os.getenv("SERVE_TIMEOUT", "30")),
+        # long enough for a streamed model reply to finish on restart
+        "graceful_timeout": int(os.getenv("SERVE_GRACEFUL_TIMEOUT", "60")),
+        "keepalive": int(os.getenv("SERVE_KEEPALIVE", "5")),
+        "max_requests": int(os.getenv("SERVE_MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.getenv("SERVE_MAX_REQUESTS_JITTER", "0")),
+        "accesslog": os.getenv("SERVE_ACCESS_LOG", "-") or None,
+        "post_fork": post_fork,
+    }
+
+
+class Server(BaseApplication):  # pylint: disable=abstract-method
+    """
+    gunicorn application serving a wsgi app with the given settings
+    """
+
+    def __init__(self, application, options=None):
+        self.application = application
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None and key in self.cfg.settings:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+if __name__ == "__main__":
+    from app import app  # pylint: disable=import-outside-toplevel
+
+    Server(app, server_options()).run()
@@ -6,6 +6,12 @@ It simulates MongoDB operations using in-memory data structures.
 from unittest.mock import MagicMock
 
 
+class DuplicateKeyError(Exception):
+    """
+    raised like mongo's error when a document with the same _id exists
+    """
+
+
 def fake_ask_model(messages):  # pylint: disable=unused-argument
     """
     fake implementation of ask_model that return a string
@@ -13,6 +19,166 @@ def fake_ask_model(messages):  # pylint: disable=unused-argument
     return "assistant reply"
 
 
+def fake_stream_model(messages):  # pylint: disable=unused-argument
+    """
+    fake implementation of stream_model that yields the reply in pieces
+    """
+    yield from ("assistant", " reply")
+
+
+def field_matches(value, condition):
+    """
+    check one field value against an equality or operator condition.
+    like mongo, None matches a missing field and comparisons never do.
+    """
+    if not isinstance(condition, dict):
+        return value == condition
+    for op, operand in condition.items():
+        if op == "$in":
+            if value not in operand:
+                return False
+        elif value is None:
+            return False
+        elif op == "$lt" and not value < operand:
+            return False
+        elif op == "$gt" and not value > operand:
+            return False
+    return True
+
+
+def matches(doc, filt):
+    """
+    check a document against a mongo filter using $and, $or and the field
+    operators of field_matches
+    """
+    for key, condition in filt.items():
+        if key == "$and":
+            if not all(matches(doc, f) for f in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, f) for f in condition):
+                return False
+        elif not field_matches(doc.get(key), condition):
+            return False
+    return True
+
+
+def get_path(value, path):
+    """
+    value at a dotted path; paths through a list give a list, like mongo
+    """
+    for part in path.split(".") if path else []:
+        if isinstance(value, list):
+            value = [item.get(part) for item in value]
+        elif isinstance(value, dict):
+            value = value.get(part)
+        else:
+            return None
+    return value
+
+
+def sort_order(value):
+    """
+    mongo's order between types: null, then numbers, then strings
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, value)
+
+
+def slice_array(array, *args):
+    """
+    $slice with [n] or [position, n]
+    """
+    if len(args) == 1:
+        (n,) = args
+        return array[n:] if n < 0 else array[:n]
+    position, n = args
+    if None in (array, position, n):
+        return None
+    return array[position : position + n]
+
+
+EXPRESSIONS = {
+    # arithmetic on null is null, $max and $min skip nulls
+    "$add": lambda a, b: None if None in (a, b) else a + b,
+    "$subtract": lambda a, b: None if None in (a, b) else a - b,
+    "$max": lambda *args: max((a for a in args if a is not None), default=None),
+    "$min": lambda *args: min((a for a in args if a is not None), default=None),
+    "$eq": lambda a, b: sort_order(a) == sort_order(b),
+    "$gt": lambda a, b: sort_order(a) > sort_order(b),
+    "$gte": lambda a, b: sort_order(a) >= sort_order(b),
+    "$ifNull": lambda *args: next((a for a in args if a is not None), None),
+    "$size": len,
+    "$slice": slice_array,
+    # like mongo, a missing array has no index rather than -1
+    "$indexOfArray": lambda array, item: (
+        None if array is None else array.index(item) if item in array else -1
+    ),
+}
+
+
+def evaluate(expr, doc, variables=None):  # pylint: disable=too-many-return-statements
+    """
+    evaluate the aggregation expressions used by backend/queries.py
+    """
+    variables = variables or {}
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, path = expr[2:].partition(".")
+        return get_path(variables[name], path)
+    if isinstance(expr, str) and expr.startswith("$"):
+        return get_path(doc, expr[1:])
+    if isinstance(expr, list):
+        return [evaluate(e, doc, variables) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    ((op, args),) = expr.items()
+    if op == "$filter":
+        return [
+            item
+            for item in evaluate(args["input"], doc, variables)
+            if evaluate(args["cond"], doc, {**variables, args["as"]: item})
+        ]
+    if op == "$cond":
+        # like mongo, only the branch taken is evaluated
+        test, then, other = args
+        branch = then if evaluate(test, doc, variables) else other
+        return evaluate(branch, doc, variables)
+    args = args if isinstance(args, list) else [args]
+    return EXPRESSIONS[op](*[evaluate(a, doc, variables) for a in args])
+
+
+def run_pipeline(docs, pipeline):
+    """
+    run the $match, $set, $unset and $project stages of an aggregation
+    """
+    docs = [dict(d) for d in docs]
+    for stage in pipeline:
+        ((name, spec),) = stage.items()
+        if name == "$match":
+            docs = [d for d in docs if matches(d, spec)]
+        elif name == "$set":
+            docs = [{**d, **{k: evaluate(v, d) for k, v in spec.items()}} for d in docs]
+        elif name == "$unset":
+            fields = [spec] if isinstance(spec, str) else spec
+            docs = [{k: v for k, v in d.items() if k not in fields} for d in docs]
+        elif name == "$project":
+            docs = [
+                {
+                    "_id": d["_id"],
+                    **{
+                        k: d[k] if v == 1 else evaluate(v, d)
+                        for k, v in spec.items()
+                        if v != 1 or k in d
+                    },
+                }
+                for d in docs
+            ]
+    return docs
+
+
 class FakeCollection:
     """Fake collection class to simulate MongoDB collection operations."""
 
@@ -22,6 +188,7 @@ class FakeCollection:
         """
         self.data = []
         self.counter = 0
+        self.indexes = []
 
     def reset(self):
         """
@@ -39,6 +206,8 @@ class FakeCollection:
         if "_id" not in doc:
             self.counter += 1
             doc["_id"] = str(self.counter)
+        elif self.find_one({"_id": doc["_id"]}) is not None:
+            raise DuplicateKeyError(f"duplicate _id {doc['_id']}")
 
         self.data.append(doc)
         return MagicMock(inserted_id=doc["_id"])
@@ -61,16 +230,40 @@ class FakeCollection:
             return list(self.data)
         return [d for d in self.data if all(d.get(k) == v for k, v in filt.items())]
 
-    def update_one(self, filt, update_data):
+    def update_one(self, filt, update_data, upsert=False):
         """
-        update one document matching the filter.
+        update one document matching the filter, inserting it if upsert.
         """
         modified = 0
         for doc in self.data:
-            if all(doc.get(k) == v for k, v in filt.items()):
-                doc.update(update_data["$set"])
+            if matches(doc, filt):
+                doc.update(update_data.get("$set", {}))
                 modified = 1
-        return MagicMock(modified_count=modified)
+        if modified or not upsert:
+            return MagicMock(modified_count=modified, upserted_id=None)
+        doc = {**filt, **update_data.get("$setOnInsert", {})}
+        doc.update(update_data.get("$set", {}))
+        return MagicMock(modified_count=0, upserted_id=self.insert_one(doc).inserted_id)
+
+    def replace_one(self, filt, doc, upsert=False):
+        """
+        replace one document matching the filter, inserting it if upsert.
+        """
+        for i, existing in enumerate(self.data):
+            if all(existing.get(k) == v for k, v in filt.items()):
+                self.data[i] = dict(doc)
+                return MagicMock(modified_count=1, upserted_id=None)
+        if upsert:
+            self.insert_one(doc)
+            return MagicMock(modified_count=0, upserted_id=doc.get("_id"))
+        return MagicMock(modified_count=0, upserted_id=None)
+
+    def create_indexes(self, indexes):
+        """
+        indexes are not needed in memory, just record and name them.
+        """
+        self.indexes.extend(indexes)
+        return [index.document["name"] for index in indexes]
 
     def delete_one(self, filt):
         """
@@ -90,14 +283,16 @@ class FakeDB:  # pylint: disable= too-few-public-methods
 
     def __init__(self):
         """
-        Initialize the fake database with chats and messages collections.
+        Initialize the fake database with chats, messages and jobs collections.
         """
         self.chats = FakeCollection()
         self.messages = FakeCollection()
+        self.jobs = FakeCollection()
 
     def reset(self):
         """
-        reset both collections.
+        reset all collections.
         """
         self.chats.reset()
         self.messages.reset()
+        self.jobs.reset()
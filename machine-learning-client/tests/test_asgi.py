@@ -0,0 +1,238 @@
+"""
+Tests for the ASGI app and the async chat routes
+"""
+
+# pylint: disable=import-error
+
+import asyncio
+import io
+import json
+
+from werkzeug.datastructures import FileStorage
+
+from asgi import MAX_BODY_BYTES, create_app, create_async_app
+from backend.DAL import chat_dal
+from backend.routers import async_chat_server
+
+
+def asgi_request(app, method, path, body=b"", headers=()):
+    """
+    call an ASGI app directly and return (status, body)
+    """
+    messages = []
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost"), *headers],
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+
+    sent = []
+
+    async def receive():
+        if sent:
+            # nothing more to read, wait like a client that stays connected
+            await asyncio.Event().wait()
+        sent.append(True)
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    data = b"".join(
+        m.get("body", b"") for m in messages if m["type"] == "http.response.body"
+    )
+    return status, data
+
+
+def test_dispatch_async_and_wsgi_routes():
+    """
+    message posts go to the async app, everything else to flask
+    """
+    app = create_app()
+    assert app.handles({"method": "POST", "path": "/chats/api/123/message"})
+    assert app.handles({"method": "POST", "path": "/chats/api/123/voice"})
+    assert not app.handles({"method": "GET", "path": "/chats/api/123"})
+    assert not app.handles({"method": "OPTIONS", "path": "/chats/api/123/message"})
+
+    status, data = asgi_request(app, "GET", "/health")
+    assert status == 200
+    assert json.loads(data) == {"status": "healthy"}
+
+
+def test_async_send_message():
+    """
+    the async message route answers and saves both messages
+    """
+    app = create_app()
+    status, data = asgi_request(
+        app,
+        "POST",
+        "/chats/api/123/message",
+        json.dumps({"content": "hi"}).encode(),
+        [(b"content-type", b"application/json")],
+    )
+    assert status == 200
+    assert json.loads(data)["content"] == "FAKE_MODEL_RESPONSE"
+
+    chat = chat_dal.find_one_chat({"_id": "123"})
+    assert [m["content"] for m in chat["messages"]] == ["hi", "FAKE_MODEL_RESPONSE"]
+
+
+def test_async_send_message_stream():
+    """
+    the async message route streams deltas and then the saved message
+    """
+
+    async def run():
+        client = create_async_app().test_client()
+        response = await client.post(
+            "/chats/api/123/message?stream=1", json={"content": "hi"}
+        )
+        return response.status_code, await response.get_data(as_text=True)
+
+    status, body = asyncio.run(run())
+    assert status == 200
+    assert 'data: {"delta": "FAKE_"}' in body
+    assert "event: message" in body
+
+
+def test_async_stream_saves_turn_when_client_disconnects():
+    """
+    closing the async stream mid-reply still saves the question and partial reply
+    """
+    chat_id = chat_dal.insert_one_chat({})
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    messages = [{"_id": "u1", "role": "user", "content": "hi"}]
+
+    async def run():
+        events = async_chat_server.stream_reply(chat, messages, messages, None, None)
+        first = await events.__anext__()  # pylint: disable=unnecessary-dunder-call
+        await events.aclose()
+        return first
+
+    assert asyncio.run(run()) == 'data: {"delta": "FAKE_"}\n\n'
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    assert [m["content"] for m in chat["messages"]] == ["hi", "FAKE_"]
+
+
+def test_async_send_voice_message():
+    """
+    the async voice route transcribes and answers in one request
+    """
+
+    async def run():
+        client = create_async_app().test_client()
+        response = await client.post(
+            "/chats/api/123/voice",
+            files={"audio": FileStorage(io.BytesIO(b"FAKEAUDIO"), "recording.webm")},
+        )
+        return response.status_code, await response.get_json()
+
+    status, data = asyncio.run(run())
+    assert status == 200
+    assert data["user_message"]["content"] == "FAKE_TRANSCRIPTION"
+    assert data["assistant_message"]["content"] == "FAKE_MODEL_RESPONSE"
+
+
+def test_async_voice_unknown_chat_keeps_session():
+    """
+    a voice turn for a missing chat is 404 before the live session is used
+    """
+    from backend.live_session import (  # pylint: disable=import-outside-toplevel
+        live_sessions,
+    )
+
+    session = live_sessions.create(lambda wav: "", 16000)
+
+    async def run():
+        client = create_async_app().test_client()
+        response = await client.post(f"/chats/api/missing/voice?session={session.id}")
+        return response.status_code
+
+    assert asyncio.run(run()) == 404
+    assert live_sessions.pop(session.id, lambda wav: "").id == session.id
+
+
+def test_async_voice_empty_filename():
+    """
+    a file field without a filename is not audio, like on the sync route
+    """
+    chat_dal.insert_one_chat({"_id": "voice", "messages": []})
+
+    async def run():
+        client = create_async_app().test_client()
+        response = await client.post(
+            "/chats/api/voice/voice",
+            files={"audio": FileStorage(io.BytesIO(b""), "")},
+        )
+        return response.status_code
+
+    assert asyncio.run(run()) == 400
+
+
+def test_async_send_message_needs_json():
+    """
+    a message that is not a json object is a 400, not a server error
+    """
+    chat_dal.insert_one_chat({"_id": "json", "messages": []})
+
+    async def run():
+        client = create_async_app().test_client()
+        response = await client.post("/chats/api/json/message", data="hi")
+        return response.status_code
+
+    assert asyncio.run(run()) == 400
+
+
+def test_async_voice_takes_large_uploads():
+    """
+    the async app takes the same body sizes as the flask app behind it
+    """
+    chat_dal.insert_one_chat({"_id": "large", "messages": []})
+    audio = io.BytesIO(b"\0" * (17 * 1024 * 1024))
+
+    async def run():
+        client = create_async_app().test_client()
+        response = await client.post(
+            "/chats/api/large/voice",
+            files={"audio": FileStorage(audio, "recording.webm")},
+        )
+        return response.status_code
+
+    assert create_async_app().config["MAX_CONTENT_LENGTH"] == MAX_BODY_BYTES
+    assert asyncio.run(run()) == 200
+
+
+def test_async_voice_from_upload(monkeypatch, tmp_path):
+    """
+    a resumable upload is transcribed on the async client and then removed
+    """
+    from backend.routers import speech_server  # pylint: disable=import-outside-toplevel
+    from backend.uploads import UploadStore  # pylint: disable=import-outside-toplevel
+
+    store = UploadStore(str(tmp_path))
+    monkeypatch.setattr(speech_server, "upload_store", store)
+    upload_id = store.create("recording.webm")["upload_id"]
+    store.write(upload_id, 0, io.BytesIO(b"FAKEAUDIO"))
+    chat_dal.insert_one_chat({"_id": "upload", "messages": []})
+
+    async def run():
+        client = create_async_app().test_client()
+        response = await client.post(f"/chats/api/upload/voice?upload={upload_id}")
+        return response.status_code, await response.get_json()
+
+    status, data = asyncio.run(run())
+    assert status == 200
+    assert data["user_message"]["content"] == "FAKE_TRANSCRIPTION"
+    assert store.status(upload_id) is None
@@ -0,0 +1,177 @@
+"""
+Unit tests for audio preprocessing
+"""
+
+# pylint: disable=import-error
+
+import io
+import subprocess
+import wave
+
+import numpy as np
+
+from backend.audio import (
+    TARGET_RATE,
+    decode_compressed,
+    decode_wav,
+    encode_wav,
+    ffmpeg_binary,
+    frame_rms,
+    preprocess_audio,
+    preprocess_segments,
+    resample,
+    split_at_silence,
+    trim_silence,
+)
+
+
+def make_wav(seconds_pattern, rate=44100, channels=2):
+    """
+    16 bit wav alternating silence and a 440 Hz tone, e.g. [1, 0.5, 2] is
+    1s silence, 0.5s tone, 2s silence
+    """
+    pieces = []
+    for i, seconds in enumerate(seconds_pattern):
+        t = np.arange(int(rate * seconds)) / rate
+        tone = 0.5 * np.sin(2 * np.pi * 440 * t) if i % 2 else np.zeros_like(t)
+        pieces.append(tone)
+    mono = (np.concatenate(pieces) * 32767).astype("<i2")
+    frames = np.repeat(mono, channels)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        # pylint: disable=no-member
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(frames.tobytes())
+    return buf.getvalue()
+
+
+def make_webm(seconds_pattern):
+    """
+    the make_wav pattern as webm/opus, like the browser's MediaRecorder
+    """
+    command = [ffmpeg_binary(), "-loglevel", "error", "-i", "pipe:0"]
+    command += ["-c:a", "libopus", "-f", "webm", "pipe:1"]
+    result = subprocess.run(
+        command, input=make_wav(seconds_pattern), capture_output=True, check=True
+    )
+    return result.stdout
+
+
+def test_decode_downmixes_to_mono():
+    """
+    stereo input comes back as one channel at its own rate
+    """
+    samples, rate = decode_wav(make_wav([0.1, 0.2], rate=22050))
+    assert rate == 22050
+    assert len(samples) == int(22050 * 0.1) + int(22050 * 0.2)
+
+
+def test_resample_to_target_rate():
+    """
+    one second at 44.1 kHz becomes one second at 16 kHz
+    """
+    samples = np.zeros(44100, dtype=np.float32)
+    assert len(resample(samples, 44100)) == TARGET_RATE
+
+
+def test_trim_silence_cuts_edges_and_long_pauses():
+    """
+    leading/trailing silence goes and a long pause is shortened
+    """
+    samples, rate = decode_wav(make_wav([1, 0.5, 2, 0.5, 1], rate=TARGET_RATE))
+    trimmed = trim_silence(samples, rate)
+    # 0.1s pads at each end plus a 0.3s pause between the two tones
+    assert abs(len(trimmed) / rate - 1.5) < 0.1
+
+
+def test_trim_silence_keeps_all_silent_audio():
+    """
+    nothing is cut if no speech is found at all
+    """
+    samples = np.zeros(TARGET_RATE, dtype=np.float32)
+    assert len(trim_silence(samples, TARGET_RATE)) == TARGET_RATE
+
+
+def test_preprocess_reports_savings():
+    """
+    a padded stereo 44.1 kHz recording shrinks and the savings are reported
+    """
+    original = make_wav([1, 0.5, 2, 0.5, 1])
+    processed, stats = preprocess_audio(original)
+
+    assert stats["processed"]
+    assert stats["bytes_saved"] == len(original) - len(processed)
+    assert stats["seconds_saved"] > 3
+    samples, rate = decode_wav(processed)
+    assert rate == TARGET_RATE
+    assert len(samples) / rate < 2
+
+
+def test_decode_compressed_webm():
+    """
+    webm is decoded to mono samples at the target rate
+    """
+    samples, rate = decode_compressed(make_webm([0.5, 1]))
+    assert rate == TARGET_RATE
+    assert abs(len(samples) / rate - 1.5) < 0.1
+    assert decode_compressed(b"not audio at all") is None
+
+
+def test_preprocess_passes_other_formats_through():
+    """
+    audio that cannot be decoded is returned untouched
+    """
+    data = b"\x1aE\xdf\xa3 webm data"
+    processed, stats = preprocess_audio(data)
+    assert processed is data
+    assert not stats["processed"]
+
+
+def test_encode_round_trip():
+    """
+    encoded samples decode back to the same values
+    """
+    samples = np.linspace(-0.5, 0.5, 100, dtype=np.float32)
+    decoded, rate = decode_wav(encode_wav(samples, TARGET_RATE))
+    assert rate == TARGET_RATE
+    assert np.allclose(decoded, samples, atol=1e-4)
+
+
+def test_split_at_silence_cuts_in_pauses():
+    """
+    long audio is cut at quiet frames into segments no longer than the
+    maximum plus the overlap
+    """
+    samples, rate = decode_wav(
+        make_wav([0, 1.5, 0.4, 1.5, 0.4, 1.5, 0.4, 1.5], rate=TARGET_RATE)
+    )
+    segments = split_at_silence(samples, rate, max_seconds=2, overlap_seconds=0.1)
+
+    assert len(segments) > 1
+    assert all(len(s) <= rate * 2.1 for s in segments)
+    # apart from the overlap, every segment starts in a pause
+    for segment in segments[1:]:
+        assert frame_rms(segment[int(rate * 0.1) :], rate)[0] < 0.01
+
+
+def test_preprocess_segments_short_audio_is_one_segment():
+    """
+    audio under the segment length is not split
+    """
+    segments, stats = preprocess_segments(make_wav([0.5, 1, 0.5]), max_seconds=10)
+    assert len(segments) == 1
+    assert stats["segments"] == 1
+
+
+def test_preprocess_segments_splits_long_webm():
+    """
+    a long browser recording is decoded, trimmed and split like wav
+    """
+    webm = make_webm([0.5, 1.5, 0.4, 1.5, 0.4, 1.5, 0.5])
+    segments, stats = preprocess_segments(webm, max_seconds=2)
+    assert stats["processed"]
+    assert stats["segments"] == len(segments) > 1
+    for segment in segments:
+        assert decode_wav(segment)[1] == TARGET_RATE
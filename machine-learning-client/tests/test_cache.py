@@ -0,0 +1,89 @@
+"""
+Tests for cache.py
+"""
+
+from tests.fake_backend import FakeCollection
+from backend.cache import EXPIRES_AT_INDEX, TieredCache, cache_key
+
+
+class FakeClock:
+    """clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_key_is_stable():
+    """the same parts always hash the same"""
+    assert cache_key("m", 0.4, [("user", "hi")]) == cache_key(
+        "m", 0.4, [("user", "hi")]
+    )
+    assert cache_key("m", 0.4, [("user", "hi")]) != cache_key("m", 0.5, [])
+
+
+def test_get_and_set_counts_hits_and_misses():
+    """hits and misses are counted"""
+    cache = TieredCache("test")
+    assert cache.get("k") is None
+    cache.set("k", "v")
+    assert cache.get("k") == "v"
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_lru_eviction():
+    """the least recently used entry is dropped first"""
+    cache = TieredCache("test", max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_ttl_expiry():
+    """entries expire after the ttl"""
+    clock = FakeClock()
+    cache = TieredCache("test", ttl_seconds=10, clock=clock)
+    cache.set("k", "v")
+    clock.now += 9
+    assert cache.get("k") == "v"
+    clock.now += 2
+    assert cache.get("k") is None
+
+
+def test_shared_tier():
+    """a second worker finds entries in the shared collection"""
+    clock = FakeClock()
+    collection = FakeCollection()
+    TieredCache("test", ttl_seconds=10, collection=collection, clock=clock).set(
+        "k", "v"
+    )
+
+    other = TieredCache("test", ttl_seconds=10, collection=collection, clock=clock)
+    assert other.get("k") == "v"
+    assert other.stats()["shared_hits"] == 1
+
+    clock.now += 11
+    other.clear()
+    assert other.get("k") is None
+
+
+def test_shared_tier_creates_its_ttl_index_once():
+    """the expires_at ttl index is created on first use, not on every call"""
+    collection = FakeCollection()
+    cache = TieredCache("test", collection=collection)
+    assert not collection.indexes
+
+    cache.set("k", "v")
+    cache.clear()
+    assert cache.get("k") == "v"
+    assert collection.indexes == [EXPIRES_AT_INDEX]
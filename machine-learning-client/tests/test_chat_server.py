@@ -2,9 +2,16 @@
 Tests for chat_server.py
 """
 
+import io
+
 import pytest
 from flask import Flask
+from backend.routers import chat_server
 from backend.routers.chat_server import chat_router
+from backend.routers import speech_server
+from backend.routers.speech_server import speech_router
+from backend.uploads import UploadStore
+from tests.test_live_session import pcm
 
 
 # flask app fixture
@@ -74,3 +81,379 @@ def test_send_message(client):  # pylint: disable=redefined-outer-name
     assert data["role"] == "assistant"
     assert data["content"] == "assistant reply"
     assert "timestamp" in data
+
+
+def test_send_message_stream(client):  # pylint: disable=redefined-outer-name
+    """
+    stream a reply to a specific chat as server-sent events.
+    """
+    resp = client.post("/chats/api/123/message?stream=1", json={"content": "hi"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    body = resp.get_data(as_text=True)
+    assert 'data: {"delta": "assistant"}' in body
+    assert 'data: {"delta": " reply"}' in body
+    assert "event: message" in body
+    assert '"content": "assistant reply"' in body
+
+    chat = client.get("/chats/api/123").get_json()
+    assert [m["content"] for m in chat["messages"]] == ["hi", "assistant reply"]
+
+
+def test_stream_saves_turn_when_client_disconnects(client):
+    # pylint: disable=redefined-outer-name
+    """
+    closing the stream mid-reply still saves the question and partial reply.
+    """
+    chat_id = client.post("/chats/api", json={}).get_json()["inserted_id"]
+    chat = chat_server.chat_dal.find_one_chat({"_id": chat_id})
+    messages = [{"_id": "u1", "role": "user", "content": "hi"}]
+
+    events = chat_server.stream_reply(chat, messages, messages, None, None)
+    assert next(events) == 'data: {"delta": "assistant"}\n\n'
+    events.close()
+
+    chat = client.get(f"/chats/api/{chat_id}").get_json()
+    assert [m["content"] for m in chat["messages"]] == ["hi", "assistant"]
+
+
+def test_send_message_version_conflict(client):  # pylint: disable=redefined-outer-name
+    """
+    sending with a stale expected_version is rejected without calling the model.
+    """
+    resp = client.post(
+        "/chats/api/123/message", json={"content": "hi", "expected_version": 0}
+    )
+    assert resp.status_code == 200
+
+    resp = client.post(
+        "/chats/api/123/message", json={"content": "again", "expected_version": 0}
+    )
+    assert resp.status_code == 409
+
+    chat = client.get("/chats/api/123").get_json()
+    assert chat["version"] == 1
+    assert [m["content"] for m in chat["messages"]] == ["hi", "assistant reply"]
+
+
+def test_get_chat_summaries(client):  # pylint: disable=redefined-outer-name
+    """
+    page through chats newest first without their message history.
+    """
+    for i in range(5):
+        client.post("/chats/api", json={"title": f"chat {i}"})
+
+    resp = client.get("/chats/api/summaries?limit=2")
+    assert resp.status_code == 200
+    page = resp.get_json()
+    titles = [c["title"] for c in page["chats"]]
+    assert len(titles) == 2
+    assert page["next_cursor"]
+
+    seen = list(titles)
+    while page["next_cursor"]:
+        page = client.get(
+            f"/chats/api/summaries?limit=2&cursor={page['next_cursor']}"
+        ).get_json()
+        seen += [c["title"] for c in page["chats"]]
+    assert sorted(seen) == [f"chat {i}" for i in range(5)]
+
+
+def test_get_chat_summaries_preview_only(
+    client,
+):  # pylint: disable=redefined-outer-name
+    """
+    summaries carry the denormalized preview instead of the messages.
+    """
+    chat_id = client.post("/chats/api", json={"title": "t"}).get_json()["inserted_id"]
+    client.post(f"/chats/api/{chat_id}/message", json={"content": "hi"})
+
+    chat = client.get("/chats/api/summaries").get_json()["chats"][0]
+    assert chat["_id"] == chat_id
+    assert "messages" not in chat
+    assert chat["message_count"] == 2
+    assert chat["last_message_preview"] == "assistant reply"
+    assert chat["last_role"] == "assistant"
+
+
+def test_get_chat_summaries_bad_cursor(client):  # pylint: disable=redefined-outer-name
+    """
+    a cursor that was not issued by the server is rejected.
+    """
+    resp = client.get("/chats/api/summaries?cursor=not-a-cursor")
+    assert resp.status_code == 400
+
+
+def test_get_chat_window(client):  # pylint: disable=redefined-outer-name
+    """
+    load the newest messages first, then page back with before.
+    """
+    chat_id = client.post("/chats/api", json={"title": "t"}).get_json()["inserted_id"]
+    for i in range(3):
+        client.post(f"/chats/api/{chat_id}/message", json={"content": f"q{i}"})
+
+    page = client.get(f"/chats/api/{chat_id}?limit=4").get_json()
+    assert [m["content"] for m in page["messages"]] == [
+        "q1",
+        "assistant reply",
+        "q2",
+        "assistant reply",
+    ]
+    assert page["has_more"] is True
+
+    before = page["messages"][0]["_id"]
+    page = client.get(f"/chats/api/{chat_id}?limit=4&before={before}").get_json()
+    assert [m["content"] for m in page["messages"]] == ["q0", "assistant reply"]
+    assert page["has_more"] is False
+
+    resp = client.get(f"/chats/api/{chat_id}?limit=4&before=missing")
+    assert resp.status_code == 404
+
+
+def test_get_chat_window_bad_limit(client):  # pylint: disable=redefined-outer-name
+    """
+    a limit that is not a positive number is rejected.
+    """
+    assert client.get("/chats/api/123?limit=abc").status_code == 400
+    assert client.get("/chats/api/123?limit=0").status_code == 400
+
+
+def test_get_new_messages(client):  # pylint: disable=redefined-outer-name
+    """
+    only messages after the given message id or timestamp are returned.
+    """
+    chat_id = client.post("/chats/api", json={"title": "t"}).get_json()["inserted_id"]
+    first = client.post(f"/chats/api/{chat_id}/message", json={"content": "q0"})
+    first = first.get_json()
+    client.post(f"/chats/api/{chat_id}/message", json={"content": "q1"})
+
+    resp = client.get(f"/chats/api/{chat_id}/messages?since={first['_id']}")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert [m["content"] for m in data["messages"]] == ["q1", "assistant reply"]
+    assert data["message_count"] == 4
+
+    resp = client.get(f"/chats/api/{chat_id}/messages?since={first['timestamp']}")
+    assert [m["content"] for m in resp.get_json()["messages"]] == [
+        "q1",
+        "assistant reply",
+    ]
+
+    assert client.get(f"/chats/api/{chat_id}/messages?since=nope").status_code == 404
+    assert client.get(f"/chats/api/{chat_id}/messages").status_code == 400
+
+
+def test_get_chat_summaries_since(client):  # pylint: disable=redefined-outer-name
+    """
+    the chat list can return only chats changed since the last sync.
+    """
+    old_id = client.post("/chats/api", json={"title": "old"}).get_json()["inserted_id"]
+    client.post("/chats/api", json={"title": "new"})
+    chats = client.get("/chats/api/summaries").get_json()["chats"]
+    synced_at = max(c["updated_at"] for c in chats)
+
+    assert (
+        client.get(f"/chats/api/summaries?since={synced_at}").get_json()["chats"] == []
+    )
+
+    client.post(f"/chats/api/{old_id}/message", json={"content": "hi"})
+    chats = client.get(f"/chats/api/summaries?since={synced_at}").get_json()["chats"]
+    assert [c["_id"] for c in chats] == [old_id]
+
+
+def test_send_message_trims_context(
+    client, monkeypatch
+):  # pylint: disable=redefined-outer-name
+    """
+    the model only gets api fields of the turns that fit the budget.
+    """
+    sent = []
+
+    def recording_ask_model(messages):
+        sent.append(messages)
+        return "assistant reply"
+
+    monkeypatch.setattr(chat_server, "ask_model", recording_ask_model)
+
+    resp = client.post("/chats/api/123/message", json={"role": "user", "content": "hi"})
+    assert resp.status_code == 200
+    assert sent == [[{"role": "user", "content": "hi"}]]
+
+
+def test_send_message_uses_summary(
+    client, monkeypatch
+):  # pylint: disable=redefined-outer-name
+    """
+    summarized turns are sent as the summary instead of in full.
+    """
+    sent = []
+
+    def recording_ask_model(messages):
+        sent.append(messages)
+        return "assistant reply"
+
+    monkeypatch.setattr(chat_server, "ask_model", recording_ask_model)
+    chat_id = client.post(
+        "/chats/api",
+        json={
+            "messages": [{"role": "user", "content": "old"}],
+            "summary": "they use an ipad",
+            "summarized_count": 1,
+        },
+    ).get_json()["inserted_id"]
+
+    client.post(f"/chats/api/{chat_id}/message", json={"role": "user", "content": "hi"})
+    assert sent[0][0]["role"] == "system"
+    assert "they use an ipad" in sent[0][0]["content"]
+    assert sent[0][1:] == [{"role": "user", "content": "hi"}]
+
+
+def test_send_message_reply_cache(
+    client, monkeypatch
+):  # pylint: disable=redefined-outer-name
+    """
+    the same question is answered from the cache the second time.
+    """
+    calls = []
+
+    def counting_ask_model(messages):
+        calls.append(messages)
+        return "open the airline app"
+
+    monkeypatch.setattr(chat_server, "ask_model", counting_ask_model)
+    question = {"role": "user", "content": "How do I print my boarding pass?"}
+
+    first = client.post("/chats/api", json={}).get_json()["inserted_id"]
+    resp = client.post(f"/chats/api/{first}/message", json=question)
+    assert resp.headers["X-Cache"] == "MISS"
+
+    second = client.post("/chats/api", json={}).get_json()["inserted_id"]
+    resp = client.post(
+        f"/chats/api/{second}/message",
+        json={"role": "user", "content": "how do i  print my BOARDING pass?"},
+    )
+    assert resp.headers["X-Cache"] == "HIT"
+    assert resp.get_json()["content"] == "open the airline app"
+    assert len(calls) == 1
+
+    resp = client.post(
+        f"/chats/api/{first}/message?stream=1",
+        json=question,
+        headers={"X-Cache-Bypass": "1"},
+    )
+    assert resp.headers["X-Cache"] == "BYPASS"
+
+    stats = client.get("/chats/api/cache").get_json()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_send_message_faq(client, monkeypatch):  # pylint: disable=redefined-outer-name
+    """
+    curated faq questions are answered without calling the model.
+    """
+    monkeypatch.setattr(chat_server, "ask_model", None)
+    chat_id = client.post("/chats/api", json={}).get_json()["inserted_id"]
+
+    resp = client.post(
+        f"/chats/api/{chat_id}/message",
+        json={"role": "user", "content": "how do I turn up the volume"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["X-Answer-Source"] == "faq"
+    data = resp.get_json()
+    assert data["source"] == "faq"
+    assert "volume buttons" in data["content"]
+
+    chat = client.get(f"/chats/api/{chat_id}").get_json()
+    assert chat["messages"][-1]["source"] == "faq"
+
+
+def test_send_voice_message(client):  # pylint: disable=redefined-outer-name
+    """
+    a recording is transcribed and answered in one request
+    """
+    resp = client.post(
+        "/chats/api/123/voice",
+        content_type="multipart/form-data",
+        data={"audio": (io.BytesIO(b"FAKEAUDIO"), "recording.webm")},
+    )
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["user_message"]["content"] == "FAKE_TRANSCRIPTION"
+    assert data["user_message"]["source"] == "voice"
+    assert data["assistant_message"]["content"] == "assistant reply"
+
+    chat = client.get("/chats/api/123").get_json()
+    assert [m["content"] for m in chat["messages"]] == [
+        "FAKE_TRANSCRIPTION",
+        "assistant reply",
+    ]
+
+
+def test_send_voice_message_stream(client):  # pylint: disable=redefined-outer-name
+    """
+    the transcript is streamed back before the reply
+    """
+    resp = client.post(
+        "/chats/api/123/voice?stream=1",
+        content_type="multipart/form-data",
+        data={"audio": (io.BytesIO(b"FAKEAUDIO"), "recording.webm")},
+    )
+    assert resp.status_code == 200
+    body = resp.get_data(as_text=True)
+    assert body.startswith("event: transcript\n")
+    assert body.index("FAKE_TRANSCRIPTION") < body.index('"delta"')
+    assert "event: message" in body
+
+
+def test_send_voice_message_live(client):  # pylint: disable=redefined-outer-name
+    """
+    a live session is finished and answered in one request
+    """
+    app = Flask(__name__)
+    app.register_blueprint(chat_router)
+    app.register_blueprint(speech_router)
+    client = app.test_client()
+
+    session_id = client.post("/speech/api/live").get_json()["session_id"]
+    client.post(f"/speech/api/live/{session_id}/frames", data=pcm([0.2, 1.0, 0.5]))
+
+    resp = client.post(f"/chats/api/123/voice?session={session_id}")
+    assert resp.status_code == 200
+    assert resp.get_json()["user_message"]["content"] == "FAKE_TRANSCRIPTION"
+
+    resp = client.post(f"/chats/api/123/voice?session={session_id}")
+    assert resp.status_code == 404
+
+
+def test_send_voice_message_upload(
+    client, monkeypatch, tmp_path
+):  # pylint: disable=redefined-outer-name
+    """
+    a finished resumable upload is transcribed and answered in one request
+    """
+    store = UploadStore(str(tmp_path))
+    monkeypatch.setattr(speech_server, "upload_store", store)
+    upload_id = store.create("recording.webm")["upload_id"]
+    store.write(upload_id, 0, io.BytesIO(b"FAKEAUDIO"))
+
+    resp = client.post(f"/chats/api/123/voice?upload={upload_id}")
+    assert resp.status_code == 200
+    assert resp.get_json()["user_message"]["content"] == "FAKE_TRANSCRIPTION"
+    assert store.status(upload_id) is None
+
+
+def test_send_voice_message_errors(client):  # pylint: disable=redefined-outer-name
+    """
+    unknown chats, missing audio and stale versions are rejected
+    """
+    audio = {"audio": (io.BytesIO(b"FAKEAUDIO"), "recording.webm")}
+    assert client.post("/chats/api/nope/voice", data=audio).status_code == 404
+    assert client.post("/chats/api/123/voice", data={}).status_code == 400
+
+    audio = {
+        "audio": (io.BytesIO(b"FAKEAUDIO"), "recording.webm"),
+        "expected_version": "3",
+    }
+    assert client.post("/chats/api/123/voice", data=audio).status_code == 409
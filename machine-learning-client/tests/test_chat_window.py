@@ -0,0 +1,50 @@
+"""
+Unit tests for the history paging shared with the web-app
+"""
+
+from backend.chat_window import (
+    HISTORY_PAGE_MAX,
+    HISTORY_PAGE_SIZE,
+    chat_window_projection,
+    history_limit,
+    trim_window,
+)
+
+
+def test_history_limit():
+    """
+    the default page, a capped page, and invalid limits
+    """
+    assert history_limit(None) == HISTORY_PAGE_SIZE
+    assert history_limit("10") == 10
+    assert history_limit(str(HISTORY_PAGE_MAX + 1)) == HISTORY_PAGE_MAX
+    assert history_limit("0") is None
+    assert history_limit("-3") is None
+    assert history_limit("x") is None
+
+
+def test_chat_window_projection_fetches_one_extra():
+    """
+    the last page fetches one message more than it returns
+    """
+    assert chat_window_projection(3) == {"messages": {"$slice": -4}}
+    chat = {"_id": "1", "messages": [{"_id": f"m{i}"} for i in range(2, 6)]}
+    chat = trim_window(chat, 3)
+    assert [m["_id"] for m in chat["messages"]] == ["m3", "m4", "m5"]
+    assert chat["has_more"] is True
+
+
+def test_trim_window_short_or_missing_chat():
+    """
+    a chat with fewer messages has no more, a missing chat or before
+    message stays missing
+    """
+    chat = trim_window({"_id": "1", "messages": [{"_id": "m0"}]}, 3)
+    assert chat["has_more"] is False
+    assert trim_window({"_id": "1"}, 3) == {
+        "_id": "1",
+        "messages": [],
+        "has_more": False,
+    }
+    assert trim_window(None, 2) is None
+    assert trim_window({"_id": "1", "messages": None}, 2) is None
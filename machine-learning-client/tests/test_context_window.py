@@ -0,0 +1,43 @@
+"""
+Tests for context_window.py
+"""
+
+from backend.context_window import build_context, count_tokens, message_tokens
+
+
+def test_count_tokens_estimate():
+    """ascii text is about four characters per token"""
+    assert count_tokens("") == 0
+    assert count_tokens("abcd") == 1
+    assert count_tokens("abcde") == 2
+    assert count_tokens("日本語") == 3
+
+
+def test_build_context_strips_fields():
+    """only api fields are sent to the model"""
+    context = build_context(
+        [{"_id": "1", "role": "user", "content": "hi", "timestamp": "now"}]
+    )
+    assert context.messages == [{"role": "user", "content": "hi"}]
+    assert context.dropped_tokens == 0
+
+
+def test_build_context_keeps_system_and_newest_turns():
+    """oldest turns are dropped first and the system prompt is kept"""
+    system = {"role": "system", "content": "be kind"}
+    turns = [{"role": "user", "content": "x" * 40} for _ in range(5)]
+    budget = 3 + message_tokens(system) + 2 * message_tokens(turns[0])
+
+    context = build_context([system] + turns, budget=budget)
+
+    assert context.messages == [system] + turns[-2:]
+    assert context.tokens == budget
+    assert context.dropped_messages == 3
+    assert context.dropped_tokens == 3 * message_tokens(turns[0])
+
+
+def test_build_context_keeps_newest_turn_over_budget():
+    """the newest turn is sent even when it alone is over the budget"""
+    context = build_context([{"role": "user", "content": "x" * 400}], budget=10)
+    assert len(context.messages) == 1
+    assert context.dropped_messages == 0
@@ -2,7 +2,15 @@
 Unit tests for Data Access Layer (DAL) functions.
 """
 
-from backend.DAL import chat_dal, messages_dal
+import asyncio
+import importlib.util
+import os
+
+import pytest
+from pymongo import MongoClient
+
+from backend.DAL import async_chat_dal, async_messages_dal, chat_dal, messages_dal
+from backend.backfill_summaries import main as backfill_main
 
 
 # testcases for DAL
@@ -48,6 +56,72 @@ def test_chat_delete_one():
     assert chat_dal.delete_one_chat({"id": 9}) is True
 
 
+def test_chat_append_messages():
+    """
+    Appending messages to a chat
+    """
+    chat_id = chat_dal.insert_one_chat({"messages": [{"content": "a"}]})
+    assert chat_dal.append_messages(chat_id, [{"content": "b"}, {"content": "c"}])
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    assert [m["content"] for m in chat["messages"]] == ["a", "b", "c"]
+    assert chat["version"] == 1
+
+
+def test_chat_append_messages_version_check():
+    """
+    Appending with a stale version is rejected
+    """
+    chat_id = chat_dal.insert_one_chat({})
+    assert chat_dal.append_messages(chat_id, [{"content": "a"}], expected_version=0)
+    assert not chat_dal.append_messages(chat_id, [{"content": "b"}], expected_version=0)
+    assert chat_dal.append_messages(chat_id, [{"content": "b"}], expected_version=1)
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    assert [m["content"] for m in chat["messages"]] == ["a", "b"]
+
+
+def test_chat_append_maintains_summary():
+    """
+    Appending keeps the summary fields in step with the messages
+    """
+    chat_id = chat_dal.insert_one_chat({"messages": []})
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    assert chat["message_count"] == 0
+    assert chat["last_role"] is None
+
+    chat_dal.append_messages(
+        chat_id,
+        [
+            {"role": "user", "content": "hi"},
+            {"role": "assistant", "content": "x" * 200},
+        ],
+    )
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    assert chat["message_count"] == 2
+    assert chat["last_role"] == "assistant"
+    assert chat["last_message_preview"] == "x" * 80
+    assert chat["updated_at"]
+
+
+def test_chat_backfill_summaries(mock_backend):
+    """
+    Backfilling fills in summary fields on old chats only once
+    """
+    mock_backend.chats.insert_one(
+        {
+            "created_at": "2025-01-01T00:00:00",
+            "messages": [{"role": "user", "content": "old", "timestamp": "t1"}],
+        }
+    )
+    chat_dal.insert_one_chat({"messages": [], "updated_at": "t0"})
+
+    assert backfill_main() == 1
+    old = chat_dal.find_one_chat({"last_message_preview": "old"})
+    assert old["message_count"] == 1
+    assert old["last_role"] == "user"
+    assert old["updated_at"] == "t1"
+    assert chat_dal.backfill_summaries() == 0
+
+
 # Messages DAL
 def test_msg_insert_one():
     """
@@ -89,3 +163,147 @@ def test_msg_delete_one():
     """
     messages_dal.insert_one_message({"id": 5})
     assert messages_dal.delete_one_message({"id": 5}) is True
+
+
+def test_chat_append_no_messages():
+    """
+    Appending an empty list changes nothing
+    """
+    chat_id = chat_dal.insert_one_chat({"messages": [{"content": "a"}]})
+    assert not chat_dal.append_messages(chat_id, [])
+    assert "version" not in chat_dal.find_one_chat({"_id": chat_id})
+
+
+def test_chat_rewrite_bumps_version():
+    """
+    Replacing the messages invalidates versions read before the rewrite
+    """
+    chat_id = chat_dal.insert_one_chat({"messages": []})
+    assert chat_dal.append_messages(chat_id, [{"content": "a"}], expected_version=0)
+    assert chat_dal.update_one_chat(
+        {"_id": chat_id}, {"messages": [{"content": "b"}], "version": 7}
+    )
+    assert chat_dal.find_one_chat({"_id": chat_id})["version"] == 2
+    assert not chat_dal.append_messages(chat_id, [{"content": "c"}], 1)
+    assert chat_dal.append_messages(chat_id, [{"content": "c"}], 2)
+
+
+def test_async_chat_dal_shares_data_with_chat_dal():
+    """
+    the async twin reads and writes the same chats as chat_dal
+    """
+
+    async def run():
+        chat_id = await async_chat_dal.insert_one_chat({"messages": []})
+        assert await async_chat_dal.append_messages(chat_id, [{"content": "hi"}], 0)
+        assert not await async_chat_dal.append_messages(chat_id, [{"content": "x"}], 0)
+        return chat_id
+
+    chat_id = asyncio.run(run())
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    assert [m["content"] for m in chat["messages"]] == ["hi"]
+    assert chat["version"] == 1
+
+
+def test_async_dal_calls_run_concurrently():
+    """
+    async lookups can be gathered with other awaitables
+    """
+    chat_id = chat_dal.insert_one_chat({"title": "a"})
+    message_id = messages_dal.insert_one_message({"content": "b"})
+
+    async def run():
+        return await asyncio.gather(
+            async_chat_dal.find_one_chat({"_id": chat_id}),
+            async_messages_dal.find_one_message({"_id": message_id}),
+            async_chat_dal.find_chat_summaries(10),
+        )
+
+    chat, message, summaries = asyncio.run(run())
+    assert chat["title"] == "a"
+    assert message["content"] == "b"
+    assert [s["_id"] for s in summaries] == [chat_id]
+
+
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI")
+
+
+def load_real_dal(monkeypatch, db_name):
+    """
+    a fresh copy of backend.DAL on the real mongo clients, which the rest
+    of the tests replace with the fake DAL
+    """
+    monkeypatch.setenv("TESTING", "0")
+    monkeypatch.setenv("MONGO_URI", MONGO_TEST_URI)
+    monkeypatch.setenv("MONGO_DB", db_name)
+    path = os.path.join(os.path.dirname(__file__), "..", "backend", "DAL.py")
+    spec = importlib.util.spec_from_file_location("real_DAL", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.skipif(not MONGO_TEST_URI, reason="needs MONGO_TEST_URI")
+def test_async_chat_dal_against_mongo(monkeypatch):
+    """
+    against a real mongo, the async dal writes, pages and appends chats
+    """
+    real_dal = load_real_dal(monkeypatch, "async_dal_test")
+    chats = real_dal.async_chat_dal
+    messages = [
+        {
+            "_id": f"m{i}",
+            "role": "user",
+            "content": f"hi {i}",
+            "timestamp": f"2024-01-0{i}",
+        }
+        for i in range(1, 6)
+    ]
+
+    async def run():
+        chat_id = await chats.insert_one_chat({"_id": "c1", "title": "t"})
+        assert chat_id == "c1"
+        assert await chats.append_messages("c1", messages[:3], 0)
+        assert not await chats.append_messages("c1", messages[3:], 0)
+        assert await chats.append_messages("c1", messages[3:], 1)
+
+        chat = await chats.find_one_chat({"_id": "c1"})
+        assert chat["version"] == 2
+        assert chat["message_count"] == 5
+        assert chat["last_message_preview"] == "hi 5"
+
+        window = await chats.find_chat_window("c1", 2)
+        assert [m["_id"] for m in window["messages"]] == ["m4", "m5"]
+        assert window["has_more"] is True
+        older = await chats.find_chat_window("c1", 2, "m2")
+        assert [m["_id"] for m in older["messages"]] == ["m1"]
+        assert older["has_more"] is False
+        assert await chats.find_chat_window("c1", 2, "missing") is None
+
+        newer = await chats.find_messages_since("c1", since_id="m3")
+        assert [m["_id"] for m in newer["messages"]] == ["m4", "m5"]
+        newer = await chats.find_messages_since("c1", since_timestamp="2024-01-04")
+        assert [m["_id"] for m in newer["messages"]] == ["m5"]
+        assert await chats.find_messages_since("c1", since_id="missing") is None
+
+        await chats.insert_one_chat({"_id": "c2", "updated_at": "2000-01-01"})
+        summaries = await chats.find_chat_summaries(10)
+        assert [c["_id"] for c in summaries] == ["c1", "c2"]
+        assert "messages" not in summaries[0]
+
+        assert await chats.update_one_chat({"_id": "c1"}, {"title": "new"})
+        assert await chats.delete_one_chat({"_id": "c2"})
+        assert [c["_id"] for c in await chats.find_all_chats()] == ["c1"]
+
+        message_id = await real_dal.async_messages_dal.insert_one_message(
+            {"chat_id": "c1", "content": "hello"}
+        )
+        found = await real_dal.async_messages_dal.find_one_message({"chat_id": "c1"})
+        assert str(found["_id"]) == message_id
+
+    client = MongoClient(MONGO_TEST_URI)
+    try:
+        asyncio.run(run())
+    finally:
+        client.drop_database("async_dal_test")
+        client.close()
@@ -0,0 +1,96 @@
+"""
+Tests for faq.py
+"""
+
+import importlib
+import json
+
+from tests.fake_backend import FakeCollection
+from backend import DAL, faq
+from backend.faq import FaqIndex, faq_answer, tokenize
+
+VOLUME = {"questions": ["How do I turn up the volume?"], "answer": "buttons"}
+WIFI = {"questions": ["How do I connect to wifi?"], "answer": "settings"}
+
+
+def test_tokenize_drops_stop_words_and_adds_bigrams():
+    """stop words are dropped and word pairs are kept"""
+    assert tokenize("How do I turn up the Volume?") == [
+        "how",
+        "turn",
+        "up",
+        "volume",
+        "how turn",
+        "turn up",
+        "up volume",
+    ]
+
+
+def test_match_above_threshold():
+    """a close question matches and an unrelated one does not"""
+    index = FaqIndex(threshold=0.6)
+    index.add("volume", VOLUME)
+    index.add("wifi", WIFI)
+
+    entry, score = index.match("turn up the volume")
+    assert entry is VOLUME
+    assert score > 0.6
+    assert index.match("what should I cook tonight") is None
+    assert index.match("") is None
+
+
+def test_add_and_remove_entries():
+    """entries can be added and removed one at a time"""
+    index = FaqIndex(threshold=0.6)
+    index.add("volume", VOLUME)
+    index.add("wifi", WIFI)
+    index.remove("volume")
+
+    assert len(index) == 1
+    assert index.match("How do I turn up the volume?") is None
+    assert index.match("How do I connect to wifi?")[0] is WIFI
+
+
+def test_refresh_from_file_only_applies_changes(tmp_path):
+    """editing the faq file updates only the changed entries"""
+    path = tmp_path / "faq.json"
+    path.write_text(json.dumps([{"_id": "volume", **VOLUME}]))
+    index = FaqIndex(threshold=0.6)
+    assert index.refresh_from_file(str(path)) == 1
+    assert index.refresh_from_file(str(path)) == 0
+
+    path.write_text(json.dumps([{"_id": "volume", **VOLUME}, {"_id": "wifi", **WIFI}]))
+    index._source_version = None  # pylint: disable=protected-access
+    assert index.refresh_from_file(str(path)) == 1
+    assert index.match("connect to the wifi")[0]["answer"] == "settings"
+
+
+def test_refresh_from_collection():
+    """entries can come from a mongo collection"""
+    collection = FakeCollection()
+    collection.insert_one({"_id": "wifi", **WIFI})
+    index = FaqIndex(threshold=0.6)
+    assert index.refresh_from_collection(collection) == 1
+    assert index.match("How do I connect to wifi?")[0]["answer"] == "settings"
+
+
+def test_bundled_faq():
+    """the bundled faq answers common questions"""
+    entry, _ = faq_answer("How do I join a video call?")
+    assert entry["_id"] == "video-call"
+    assert faq_answer("hi") is None
+
+
+def test_mongo_faq_loads_on_first_lookup(monkeypatch):
+    """importing the module does not query mongo, the first lookup does"""
+    collection = FakeCollection()
+    collection.insert_one({"_id": "wifi", **WIFI})
+    monkeypatch.setattr(DAL.db, "faq", collection, raising=False)
+    monkeypatch.setenv("FAQ_SOURCE", "mongo")
+    try:
+        importlib.reload(faq)
+        assert len(faq.faq_index) == 0
+        assert faq.faq_answer("How do I connect to wifi?")[0]["answer"] == "settings"
+    finally:
+        monkeypatch.setenv("FAQ_SOURCE", "file")
+        importlib.reload(faq)
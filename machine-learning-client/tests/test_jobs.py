@@ -0,0 +1,163 @@
+"""
+Unit tests for asynchronous transcription jobs
+"""
+
+# pylint: disable=import-error
+
+from datetime import datetime, timezone
+
+from backend.DAL import jobs_dal
+from backend.jobs import (
+    expiry_indexed,
+    job_owner,
+    job_updates,
+    public_job,
+    recover_stale_jobs,
+    run_job,
+    send_heartbeat,
+    submit_job,
+)
+
+
+def test_job_runs_in_background():
+    """
+    a job goes from queued to done and keeps its transcript in the db
+    """
+    job = submit_job("upload1", "recording.webm", lambda upload_id: ("hi", {}))
+    updates = list(job_updates(job["_id"], poll=0.01, timeout=5))
+
+    assert updates[-1]["status"] == "done"
+    assert updates[-1]["transcript"] == "hi"
+    assert jobs_dal.find_job(job["_id"])["status"] == "done"
+
+
+def test_job_expires():
+    """
+    a job carries a utc expiry date for the ttl index on the jobs collection
+    """
+    job = submit_job("upload0", "recording.webm", lambda upload_id: ("hi", {}))
+    assert expiry_indexed.is_set()
+    assert job["expires_at"].tzinfo is timezone.utc
+    assert job["expires_at"] > datetime.now(timezone.utc)
+    assert "expires_at" not in public_job(job)
+
+
+def test_failed_job_records_error():
+    """
+    an exception in the transcriber marks the job failed with its message
+    """
+
+    def broken(upload_id):
+        raise ValueError(f"cannot read {upload_id}")
+
+    job = submit_job("upload2", "recording.webm", broken)
+    updates = list(job_updates(job["_id"], poll=0.01, timeout=5))
+
+    assert updates[-1]["status"] == "failed"
+    assert updates[-1]["error"] == "cannot read upload2"
+
+
+def test_finished_jobs_remove_upload():
+    """
+    the upload is cleaned up once the job is failed or done
+    """
+    removed = []
+
+    def broken(upload_id):
+        raise ValueError(upload_id)
+
+    failed = submit_job("upload3", "recording.webm", broken, removed.append)
+    done = submit_job("upload4", "recording.webm", lambda _: ("hi", {}), removed.append)
+    list(job_updates(failed["_id"], poll=0.01, timeout=5))
+    list(job_updates(done["_id"], poll=0.01, timeout=5))
+
+    assert sorted(removed) == ["upload3", "upload4"]
+
+
+def test_job_failed_by_recovery_is_not_run():
+    """
+    a job recovery failed while it was queued is never started
+    """
+    jobs_dal.insert_job({"_id": "gone", "status": "failed", "upload_id": "u"})
+    calls, removed = [], []
+
+    run_job("gone", "u", calls.append, removed.append)
+
+    assert not calls and not removed
+    assert jobs_dal.find_job("gone")["status"] == "failed"
+
+
+def test_job_failed_while_running_is_not_marked_done():
+    """
+    a job failed while its transcription ran keeps its failed status
+    """
+    jobs_dal.insert_job({"_id": "slow", "status": "queued", "upload_id": "u"})
+
+    def transcribe(upload_id):  # pylint: disable=unused-argument
+        jobs_dal.update_job("slow", {"status": "failed", "error": "gone"}, "running")
+        return "hi", {}
+
+    run_job("slow", "u", transcribe)
+
+    assert jobs_dal.find_job("slow")["status"] == "failed"
+    assert "transcript" not in jobs_dal.find_job("slow")
+
+
+def test_recover_stale_jobs():
+    """
+    jobs left queued or running too long are failed and their uploads
+    removed; recent and finished jobs are left alone
+    """
+    for job_id, status, updated_at in (
+        ("stale-queued", "queued", "2000-01-01T00:00:00"),
+        ("stale-running", "running", "2000-01-01T00:00:00"),
+        ("old-done", "done", "2000-01-01T00:00:00"),
+        ("fresh", "running", "2999-01-01T00:00:00"),
+    ):
+        jobs_dal.insert_job(
+            {
+                "_id": job_id,
+                "status": status,
+                "upload_id": f"upload-{job_id}",
+                "updated_at": updated_at,
+            }
+        )
+    removed = []
+
+    assert recover_stale_jobs(removed.append, stale_seconds=60) == 2
+    assert sorted(removed) == ["upload-stale-queued", "upload-stale-running"]
+    assert jobs_dal.find_job("stale-running")["status"] == "failed"
+    assert jobs_dal.find_job("fresh")["status"] == "running"
+    assert jobs_dal.find_job("old-done")["status"] == "done"
+    assert recover_stale_jobs(removed.append, stale_seconds=60) == 0
+
+
+def test_recovery_leaves_jobs_with_a_heartbeat():
+    """
+    a job queued long ago in a live worker keeps its heartbeat fresh and is
+    not failed; one whose owner stopped beating is
+    """
+    for job_id, owner in (("alive", job_owner()), ("orphan", "gone:1:dead")):
+        jobs_dal.insert_job(
+            {
+                "_id": job_id,
+                "status": "queued",
+                "upload_id": f"upload-{job_id}",
+                "owner": owner,
+                "updated_at": "2000-01-01T00:00:00",
+                "heartbeat_at": "2000-01-01T00:00:00",
+            }
+        )
+    removed = []
+
+    assert send_heartbeat() == 1
+    assert recover_stale_jobs(removed.append, stale_seconds=60) == 1
+    assert removed == ["upload-orphan"]
+    assert jobs_dal.find_job("alive")["status"] == "queued"
+
+
+def test_unknown_job_has_no_updates():
+    """
+    polling a job that does not exist ends at once
+    """
+    assert not list(job_updates("missing", poll=0.01, timeout=1))
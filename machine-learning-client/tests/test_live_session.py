@@ -0,0 +1,141 @@
+"""
+Unit tests for live voice sessions
+"""
+
+# pylint: disable=import-error
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.audio import decode_wav
+from backend.live_session import LiveSessionStore
+
+
+def pcm(seconds_pattern, rate=16000):
+    """
+    raw 16 bit PCM alternating silence and a tone, like tests.test_audio
+    """
+    pieces = []
+    for i, seconds in enumerate(seconds_pattern):
+        t = np.arange(int(rate * seconds)) / rate
+        pieces.append(0.5 * np.sin(2 * np.pi * 440 * t) if i % 2 else np.zeros_like(t))
+    return (np.concatenate(pieces) * 32767).astype("<i2").tobytes()
+
+
+def seconds_transcriber(calls):
+    """
+    fake transcriber that answers with the utterance length in seconds
+    """
+
+    def transcribe(wav):
+        samples, rate = decode_wav(wav)
+        calls.append(len(samples) / rate)
+        return f"utterance{len(calls)}"
+
+    return transcribe
+
+
+def test_utterances_sent_after_pause(tmp_path):
+    """
+    an utterance is transcribed as soon as a pause follows it, not at the end
+    """
+    calls = []
+    session = LiveSessionStore(str(tmp_path)).create(seconds_transcriber(calls), 16000)
+
+    assert session.add_frames(pcm([0.2, 1.0])) == 0
+    assert session.add_frames(pcm([1.0])) == 1
+    assert session.add_frames(pcm([0, 0.8, 0.3])) == 0
+
+    assert session.finish() == "utterance1 utterance2"
+    assert len(calls) == 2
+    # the first utterance was roughly one second of speech
+    assert 0.9 < calls[0] < 1.5
+
+
+def test_finish_async(tmp_path):
+    """
+    the async finish waits for the same transcript without a thread
+    """
+    session = LiveSessionStore(str(tmp_path)).create(lambda wav: "hello", 16000)
+    session.add_frames(pcm([0.2, 1.0, 1.0, 0.5]))
+    assert asyncio.run(session.finish_async()) == "hello hello"
+
+
+def test_silence_only_is_not_transcribed(tmp_path):
+    """
+    a session with no speech never calls the transcriber
+    """
+    calls = []
+    session = LiveSessionStore(str(tmp_path)).create(seconds_transcriber(calls), 16000)
+    session.add_frames(pcm([2]))
+    assert session.finish() == ""
+    assert not calls
+
+
+def test_events_end_with_final(tmp_path):
+    """
+    the event stream carries partials and ends with the final transcript
+    """
+    session = LiveSessionStore(str(tmp_path)).create(lambda wav: "hello", 16000)
+    session.add_frames(pcm([0.2, 1.0, 1.0]))
+    session.finish()
+    events = list(session.stream_events(timeout=1, poll=0.01))
+    assert events[-1] == {"event": "final", "transcript": "hello"}
+
+
+def test_sessions_are_shared_between_workers(tmp_path):
+    """
+    frames, finish and events can each go to a different worker's store
+    """
+    first, second = LiveSessionStore(str(tmp_path)), LiveSessionStore(str(tmp_path))
+    session = first.create(lambda wav: "one", 16000)
+    assert session.add_frames(pcm([0.2, 1.0, 1.0])) == 1
+
+    other = second.get(session.id, lambda wav: "two")
+    assert other.add_frames(pcm([0, 1.0, 0.2])) == 0
+    finishing = second.pop(session.id, lambda wav: "two")
+    assert first.pop(session.id, lambda wav: "one") is None
+    assert first.get(session.id, lambda wav: "one") is None
+    assert finishing.finish() == "one two"
+
+    watcher = first.get(session.id, lambda wav: "", closed=True)
+    events = list(watcher.stream_events(timeout=1, poll=0.01))
+    assert events == [{"event": "final", "transcript": "one two"}]
+
+
+def test_frames_after_close_are_refused(tmp_path):
+    """
+    once a worker started finishing, more frames are not taken
+    """
+    store = LiveSessionStore(str(tmp_path))
+    session = store.create(lambda wav: "", 16000)
+    assert store.pop(session.id, lambda wav: "") is not None
+    with pytest.raises(KeyError):
+        session.add_frames(pcm([0.2]))
+
+
+def test_failed_utterance_fails_finish(tmp_path):
+    """
+    a transcription error surfaces when the session is finished
+    """
+
+    def broken(wav):
+        raise ValueError("whisper is down")
+
+    session = LiveSessionStore(str(tmp_path)).create(broken, 16000)
+    session.add_frames(pcm([0.2, 1.0, 1.0]))
+    with pytest.raises(RuntimeError, match="whisper is down"):
+        session.finish()
+
+
+def test_store_expires_idle_sessions(tmp_path):
+    """
+    creating a session drops the ones idle past the ttl
+    """
+    store = LiveSessionStore(str(tmp_path), ttl=-1)
+    old = store.create(lambda wav: "", 16000)
+    store.create(lambda wav: "", 16000)
+    assert store.get(old.id, lambda wav: "") is None
+    assert store.get("../etc/passwd", lambda wav: "") is None
@@ -0,0 +1,287 @@
+"""
+Unit tests for the index and migration runner
+"""
+
+# pylint: disable=import-error
+
+import os
+from unittest.mock import MagicMock
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import (
+    AutoReconnect,
+    OperationFailure,
+    PyMongoError,
+    ServerSelectionTimeoutError,
+)
+
+from backend import migrations
+from backend.chat_window import chat_window_projection
+from backend.migrations import (
+    INDEXES,
+    apply_migrations,
+    assert_no_collscan,
+    backfill_chat_summaries,
+    ensure_indexes,
+    plan_stages,
+)
+from backend.queries import (
+    SUMMARY_PROJECTION,
+    SUMMARY_SORT,
+    backfill_update,
+    chat_window_pipeline,
+    messages_since_pipeline,
+    summaries_filter,
+)
+from tests.fake_backend import FakeDB
+
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI")
+
+
+def test_ensure_indexes_creates_every_declared_index():
+    """
+    each collection gets its declared indexes in one call
+    """
+    database = MagicMock()
+    database.__getitem__.return_value.create_indexes.return_value = ["name_1"]
+    names = ensure_indexes(database)
+    assert names == ["name_1"] * len(INDEXES)
+    calls = database.__getitem__.call_args_list
+    assert [c.args[0] for c in calls] == list(INDEXES)
+
+
+def test_cache_indexes_expire_entries():
+    """
+    the shared cache and job collections have a ttl index on expires_at
+    """
+    for collection in ("response_cache", "transcript_cache", "jobs"):
+        (index,) = INDEXES[collection]
+        assert index.document["key"] == {"expires_at": 1}
+        assert index.document["expireAfterSeconds"] == 0
+
+
+def test_apply_migrations_runs_each_step_once():
+    """
+    applied steps are recorded and skipped on the next run
+    """
+    database = FakeDB()
+    database.migrations = database.jobs
+    ran = []
+    steps = [
+        ("0001_a", lambda database: ran.append("a")),
+        ("0002_b", lambda database: ran.append("b")),
+    ]
+
+    assert apply_migrations(database, steps) == ["0001_a", "0002_b"]
+    assert not apply_migrations(database, steps)
+    assert ran == ["a", "b"]
+    assert database.migrations.find_one({"_id": "0001_a"})["applied_at"]
+
+
+def test_failed_migration_is_retried():
+    """
+    a step that raises releases its claim so the next run tries again
+    """
+    database = FakeDB()
+    database.migrations = database.jobs
+
+    def broken(database):  # pylint: disable=unused-argument
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        apply_migrations(database, [("0001_broken", broken)])
+    assert database.migrations.find_one({"_id": "0001_broken"}) is None
+    assert apply_migrations(database, [("0001_broken", lambda database: None)]) == [
+        "0001_broken"
+    ]
+
+
+class Crash(BaseException):
+    """
+    stands in for the process dying: no except Exception block sees it
+    """
+
+
+def test_step_left_unfinished_by_a_crash_is_run_again():
+    """
+    a claim whose process died mid-step is taken over once its lease is
+    over, and not before
+    """
+    database = FakeDB()
+    database.migrations = database.jobs
+
+    def crash(database):  # pylint: disable=unused-argument
+        raise Crash()
+
+    with pytest.raises(Crash):
+        apply_migrations(database, [("0001_step", crash)])
+    claim = database.migrations.find_one({"_id": "0001_step"})
+    assert claim is not None and "applied_at" not in claim
+
+    ran = []
+    steps = [("0001_step", lambda database: ran.append(1))]
+    # another process right away: the claim may still be running
+    assert not apply_migrations(database, steps, lease_seconds=60)
+    claim["claimed_at"] = "2000-01-01T00:00:00"
+    assert apply_migrations(database, steps, lease_seconds=60) == ["0001_step"]
+    assert ran == [1]
+    assert database.migrations.find_one({"_id": "0001_step"})["applied_at"]
+    assert not apply_migrations(database, steps, lease_seconds=60)
+
+
+def test_claim_without_claimed_at_expires_by_started_at():
+    """
+    claims recorded before claims were renewed only have started_at
+    """
+    database = FakeDB()
+    database.migrations = database.jobs
+    database.migrations.insert_one(
+        {"_id": "0001_step", "started_at": "2000-01-01T00:00:00"}
+    )
+    assert apply_migrations(database, [("0001_step", lambda database: None)]) == [
+        "0001_step"
+    ]
+
+
+def test_migrate_when_reachable_retries_only_connection_errors(monkeypatch):
+    """
+    connection errors are retried, other mongo errors are raised
+    """
+    monkeypatch.setattr(migrations, "MIGRATE_RETRY_SECONDS", 0)
+    calls = []
+
+    def run():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ServerSelectionTimeoutError("no servers")
+        if len(calls) == 2:
+            raise AutoReconnect("lost")
+        raise OperationFailure("index options conflict")
+
+    monkeypatch.setattr(migrations, "run_migrations", run)
+    with pytest.raises(OperationFailure):
+        migrations.migrate_when_reachable()
+    assert len(calls) == 3
+
+
+def test_backfill_step_raises_and_is_not_recorded():
+    """
+    a database error in the backfill is raised, so it is not marked applied
+    """
+    database = FakeDB()
+    database.migrations = database.jobs
+    database.chats = MagicMock()
+    database.chats.update_many.side_effect = PyMongoError("down")
+    steps = [("0001_backfill_chat_summaries", backfill_chat_summaries)]
+
+    with pytest.raises(PyMongoError):
+        apply_migrations(database, steps)
+    assert database.migrations.find_one({"_id": "0001_backfill_chat_summaries"}) is None
+
+
+def test_backfill_step_counts_updated_chats():
+    """
+    the backfill sends the summary update and returns how many chats changed
+    """
+    database = MagicMock()
+    database.chats.update_many.return_value.modified_count = 3
+    assert backfill_chat_summaries(database) == 3
+    database.chats.update_many.assert_called_once_with(*backfill_update())
+
+
+def test_start_migrations_skips_the_fake_database(monkeypatch):
+    """
+    nothing runs against the in-memory test database
+    """
+    migrate = MagicMock()
+    monkeypatch.setattr(migrations, "migrate_when_reachable", migrate)
+    migrations.start_migrations()
+    migrate.assert_not_called()
+
+
+def test_plan_stages_ignores_rejected_plans():
+    """
+    only winning plans count, nested and in aggregations
+    """
+    explain = {
+        "stages": [
+            {
+                "$cursor": {
+                    "queryPlanner": {
+                        "winningPlan": {
+                            "stage": "FETCH",
+                            "inputStage": {"stage": "IXSCAN"},
+                        },
+                        "rejectedPlans": [{"stage": "COLLSCAN"}],
+                    }
+                }
+            }
+        ]
+    }
+    assert plan_stages(explain) == ["FETCH", "IXSCAN"]
+    assert_no_collscan(explain)
+
+
+def test_assert_no_collscan_fails_on_collection_scan():
+    """
+    a winning plan with a COLLSCAN fails loudly
+    """
+    explain = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "COLLSCAN"}}}}
+    with pytest.raises(AssertionError, match="COLLSCAN"):
+        assert_no_collscan(explain)
+
+
+@pytest.mark.skipif(not MONGO_TEST_URI, reason="needs MONGO_TEST_URI")
+def test_indexed_queries_do_not_scan_collections():
+    """
+    against a real mongo, the queries the dal sends use the indexes
+    """
+    client = MongoClient(MONGO_TEST_URI)
+    database = client.get_database("migrations_test")
+    try:
+        database.chats.insert_many(
+            [
+                {"_id": "c1", "updated_at": "2024-01-01", "messages": []},
+                {"_id": "c2", "messages": []},
+            ]
+        )
+        database.messages.insert_one({"chat_id": "c1", "timestamp": "2024-01-01"})
+        ensure_indexes(database)
+
+        for after, since in (
+            (None, None),
+            (("2024-01-01", "c1"), None),
+            ((None, "c2"), None),
+            (("2024-01-01", "c1"), "2023-01-01"),
+        ):
+            assert_no_collscan(
+                database.chats.find(summaries_filter(after, since), SUMMARY_PROJECTION)
+                .sort(SUMMARY_SORT)
+                .limit(20)
+                .explain()
+            )
+        assert_no_collscan(
+            database.chats.find({"_id": "c1"}, chat_window_projection(20))
+            .limit(1)
+            .explain()
+        )
+        for pipeline in (
+            chat_window_pipeline("c1", 20, "m1"),
+            messages_since_pipeline("c1", "m1", None),
+            messages_since_pipeline("c1", None, "2023-01-01"),
+        ):
+            assert_no_collscan(
+                database.command("aggregate", "chats", pipeline=pipeline, explain=True)
+            )
+        assert_no_collscan(
+            database.messages.find({"chat_id": "c1"}).sort("timestamp", 1).explain()
+        )
+        assert_no_collscan(
+            database.messages.find(
+                {"chat_id": "c1", "timestamp": {"$gte": "2023"}}
+            ).explain()
+        )
+    finally:
+        client.drop_database("migrations_test")
+        client.close()
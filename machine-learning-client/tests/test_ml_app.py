@@ -3,6 +3,7 @@ Tests for the main app.py
 """
 
 import pytest
+import app as app_module  # pylint: disable=import-error
 from app import app  # pylint: disable=import-error
 
 
@@ -26,3 +27,34 @@ def test_health(client):  # pylint: disable=redefined-outer-name
     response = client.get("/health")
     assert response.status_code == 200
     assert response.get_json() == {"status": "healthy"}
+
+
+def test_ready(client):  # pylint: disable=redefined-outer-name
+    """Test readiness route"""
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "ready"}
+
+
+def test_not_ready(client, monkeypatch):  # pylint: disable=redefined-outer-name
+    """Readiness fails while the database cannot be reached"""
+    monkeypatch.setattr(app_module, "database_status", lambda: (False, "down"))
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.get_json() == {"status": "unavailable", "error": "down"}
+
+
+def test_start_background_tasks(monkeypatch):
+    """the readiness check, migrations and job recovery start together"""
+    started = []
+    monkeypatch.setattr(
+        app_module, "start_database_check", lambda: started.append("db")
+    )
+    monkeypatch.setattr(
+        app_module, "start_migrations", lambda: started.append("migrate")
+    )
+    monkeypatch.setattr(
+        app_module, "start_job_recovery", lambda cleanup: started.append("jobs")
+    )
+    app_module.start_background_tasks()
+    assert started == ["db", "migrate", "jobs"]
@@ -0,0 +1,115 @@
+"""
+Unit tests for the lazy mongo connection
+"""
+
+# pylint: disable=import-error
+
+import os
+
+from pymongo.errors import PyMongoError
+
+from backend.mongo import MongoConnection, client_options, lazy_databases
+
+
+class FakeClient:  # pylint: disable=too-few-public-methods
+    """
+    records how it was created and answers ping unless told to fail
+    """
+
+    created = []
+    fail = False
+
+    def __init__(self, uri, **options):
+        self.uri = uri
+        self.options = options
+        self.admin = self
+        FakeClient.created.append(self)
+
+    def get_database(self, name):
+        """
+        a dict of dicts stands in for the database
+        """
+        return {"chats": {"name": f"{name}.chats"}}
+
+    def command(self, name):
+        """
+        admin command, only ping is used
+        """
+        if FakeClient.fail:
+            raise PyMongoError("unreachable")
+        return {"ok": 1, "command": name}
+
+
+def make_connection():
+    """
+    a connection built on FakeClient
+    """
+    FakeClient.created = []
+    FakeClient.fail = False
+    return MongoConnection(
+        "mongodb://db", "app", {"maxPoolSize": 5}, FakeClient, FakeClient
+    )
+
+
+def test_client_options_from_env(monkeypatch):
+    """
+    pool, timeout, retry and compression settings come from env variables
+    """
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("MONGO_SOCKET_TIMEOUT_MS", "3000")
+    monkeypatch.setenv("MONGO_RETRY_WRITES", "0")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zstd,zlib")
+    options = client_options()
+    assert options["maxPoolSize"] == 20
+    assert options["socketTimeoutMS"] == 3000
+    assert options["maxIdleTimeMS"] is None
+    assert options["retryReads"] is True
+    assert options["retryWrites"] is False
+    assert options["compressors"] == "zstd,zlib"
+
+
+def test_client_created_on_first_use():
+    """
+    no client exists until a collection is used, then one is reused
+    """
+    connection = make_connection()
+    db, _ = lazy_databases(connection)
+    chats = db.chats
+    assert not FakeClient.created
+
+    assert chats.get("name") == "app.chats"
+    assert db["chats"].get("name") == "app.chats"
+    assert len(FakeClient.created) == 1
+    assert FakeClient.created[0].options == {"connect": False, "maxPoolSize": 5}
+
+
+def test_forked_child_builds_its_own_client():
+    """
+    a child process drops the client it inherited
+    """
+    connection = make_connection()
+    parent_client = connection.client()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os.write(write_fd, b"1" if connection.client() is not parent_client else b"0")
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 1) == b"1"
+    assert connection.client() is parent_client
+
+
+def test_ping_records_readiness():
+    """
+    ping sets ready, or records why the database could not be reached
+    """
+    connection = make_connection()
+    assert connection.ready is False
+
+    FakeClient.fail = True
+    assert connection.ping() is False
+    assert connection.error == "unreachable"
+
+    FakeClient.fail = False
+    assert connection.ping() is True
+    assert (connection.ready, connection.error) == (True, None)
@@ -0,0 +1,237 @@
+"""
+Unit tests for the mongo filters, updates and pipelines the DAL sends
+"""
+
+from backend.chat_window import trim_window
+from backend.queries import (
+    append_update,
+    backfill_update,
+    chat_update,
+    chat_window_pipeline,
+    messages_since_pipeline,
+    summaries_filter,
+)
+from tests.fake_backend import matches, run_pipeline
+
+CHATS = [
+    {"_id": "a", "updated_at": "2024-01-03"},
+    {"_id": "b", "updated_at": "2024-01-02"},
+    {"_id": "c", "updated_at": "2024-01-02"},
+    {"_id": "d"},
+    {"_id": "e", "updated_at": None},
+]
+
+CHAT = {
+    "_id": "1",
+    "title": "help",
+    "version": 3,
+    "messages": [
+        {"_id": f"m{i}", "content": str(i), "timestamp": f"2024-01-0{i + 1}"}
+        for i in range(6)
+    ],
+}
+
+
+def window(limit, before):
+    """
+    the message ids a window query returns for CHAT, and has_more
+    """
+    (chat,) = run_pipeline([CHAT], chat_window_pipeline("1", limit, before))
+    chat = trim_window(chat, limit)
+    return [m["_id"] for m in chat["messages"]], chat["has_more"]
+
+
+def newest_first(chats):
+    """
+    mongo's order for sort updated_at -1, _id -1: missing and null last
+    """
+    return sorted(
+        chats,
+        key=lambda c: (
+            c.get("updated_at") is not None,
+            c.get("updated_at") or "",
+            c["_id"],
+        ),
+        reverse=True,
+    )
+
+
+def pages(limit, since=None):
+    """
+    page through CHATS the way the chat list does
+    """
+    after = None
+    while True:
+        found = [c for c in CHATS if matches(c, summaries_filter(after, since))]
+        page = newest_first(found)[:limit]
+        if not page:
+            return
+        yield [c["_id"] for c in page]
+        after = (page[-1].get("updated_at"), page[-1]["_id"])
+
+
+def test_summaries_filter_first_page():
+    """
+    no cursor and no since matches every chat
+    """
+    assert not summaries_filter(None, None)
+
+
+def test_summaries_pages_break_ties_on_id():
+    """
+    chats with the same updated_at are split across pages by _id
+    """
+    assert list(pages(2)) == [["a", "c"], ["b", "e"], ["d"]]
+
+
+def test_summaries_pages_reach_chats_without_updated_at():
+    """
+    chats missing updated_at come after every timestamp and are each listed once
+    """
+    listed = [chat_id for page in pages(1) for chat_id in page]
+    assert listed == ["a", "c", "b", "e", "d"]
+
+
+def test_summaries_filter_since():
+    """
+    since keeps only chats updated later, and combines with the cursor
+    """
+    assert list(pages(10, since="2024-01-02")) == [["a"]]
+    query_filter = summaries_filter(("2024-01-03", "a"), "2024-01-01")
+    assert [c["_id"] for c in CHATS if matches(c, query_filter)] == ["b", "c"]
+
+
+def test_chat_update_without_messages():
+    """
+    plain field updates are set as given, without touching the version
+    """
+    assert chat_update({"title": "t", "version": 3}) == {"$set": {"title": "t"}}
+
+
+def test_chat_update_with_messages():
+    """
+    replacing messages refreshes the summary fields and bumps the version
+    """
+    update = chat_update({"messages": [{"role": "user", "content": "hi"}]})
+    assert update["$inc"] == {"version": 1}
+    assert update["$set"]["message_count"] == 1
+    assert update["$set"]["last_message_preview"] == "hi"
+    assert "updated_at" in update["$set"]
+
+
+def test_append_update_version_filter():
+    """
+    version 0 matches chats never written to, other versions match exactly
+    """
+    messages = [{"role": "assistant", "content": "ok"}]
+    assert append_update("1", messages, None)[0] == {"_id": "1"}
+    assert append_update("1", messages, 0)[0] == {
+        "_id": "1",
+        "version": {"$in": [None, 0]},
+    }
+    assert append_update("1", messages, 2)[0] == {"_id": "1", "version": 2}
+    assert matches({"_id": "1"}, append_update("1", messages, 0)[0])
+    assert not matches({"_id": "1", "version": 1}, append_update("1", messages, 0)[0])
+
+
+def test_append_update_pushes_and_counts():
+    """
+    messages are pushed in one update that also maintains the summary
+    """
+    messages = [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}]
+    update = append_update("1", messages, None)[1]
+    assert update["$push"] == {"messages": {"$each": messages}}
+    assert update["$inc"] == {"version": 1, "message_count": 2}
+    assert update["$set"]["last_role"] == "assistant"
+    assert update["$set"]["last_message_preview"] == "b"
+
+
+def test_backfill_update_only_touches_stale_chats():
+    """
+    the backfill filter picks chats without updated_at or with a wrong count
+    """
+    query_filter, pipeline = backfill_update()
+    assert {"updated_at": None} in query_filter["$or"]
+    assert list(pipeline[0]["$set"]) == [
+        "message_count",
+        "last_message_preview",
+        "last_role",
+        "updated_at",
+    ]
+
+
+def test_chat_window_before():
+    """
+    the window ends right before the given message
+    """
+    assert window(2, "m4") == (["m2", "m3"], True)
+    assert window(3, "m3") == (["m0", "m1", "m2"], False)
+    assert window(10, "m3") == (["m0", "m1", "m2"], False)
+
+
+def test_chat_window_before_first_or_unknown_message():
+    """
+    nothing is older than the first message, and unknown ids are not found
+    """
+    assert window(2, "m0") == ([], False)
+    (chat,) = run_pipeline([CHAT], chat_window_pipeline("1", 2, "missing"))
+    assert chat["messages"] is None
+    assert trim_window(chat, 2) is None
+
+
+def test_chat_window_keeps_other_fields():
+    """
+    only the messages are cut, the helper field is removed
+    """
+    (chat,) = run_pipeline([CHAT], chat_window_pipeline("1", 2, "m4"))
+    assert chat["title"] == "help"
+    assert "_end" not in chat
+    assert not run_pipeline([CHAT], chat_window_pipeline("2", 2, "m4"))
+
+
+def since_ids(since_id=None, since_timestamp=None, chat=None):
+    """
+    the message ids a since query returns, or None when the DAL says
+    the chat or message was not found
+    """
+    pipeline = messages_since_pipeline("1", since_id, since_timestamp)
+    found = run_pipeline([chat or CHAT], pipeline)
+    if not found or found[0].get("messages") is None:
+        return None
+    return [m["_id"] for m in found[0]["messages"]]
+
+
+def test_messages_since_id():
+    """
+    an id returns only the messages after it
+    """
+    assert since_ids(since_id="m3") == ["m4", "m5"]
+    assert since_ids(since_id="m5") == []
+    assert since_ids(since_id="missing") is None
+
+
+def test_messages_since_timestamp():
+    """
+    a timestamp returns the messages strictly newer than it
+    """
+    assert since_ids(since_timestamp="2024-01-04") == ["m4", "m5"]
+    assert since_ids(since_timestamp="2024-01-03T12:00:00") == ["m3", "m4", "m5"]
+    assert since_ids(since_timestamp="2025-01-01") == []
+
+
+def test_messages_since_chat_without_messages():
+    """
+    a chat without a messages array has nothing newer
+    """
+    empty = {"_id": "1", "version": 1}
+    assert since_ids(since_timestamp="2024-01-01", chat=empty) == []
+    assert since_ids(since_id="m1", chat=empty) is None
+
+
+def test_messages_since_projection():
+    """
+    only the fields a client needs to stay in sync come back
+    """
+    pipeline = messages_since_pipeline("1", "m4", None)
+    (chat,) = run_pipeline([CHAT], pipeline)
+    assert set(chat) == {"_id", "messages", "version"}
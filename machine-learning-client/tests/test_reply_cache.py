@@ -0,0 +1,34 @@
+"""
+Tests for reply_cache.py
+"""
+
+from backend.reply_cache import RESPONSE_CACHE_TAIL, reply_cache_key
+
+QUESTION = {"role": "user", "content": "what should I do next?"}
+
+
+def summary(text):
+    """the system message with_summary puts in front of the recent turns"""
+    return {"role": "system", "content": f"Summary of the earlier conversation: {text}"}
+
+
+def test_key_ignores_whitespace_and_case():
+    """trivial differences in the tail still hit"""
+    assert reply_cache_key([QUESTION]) == reply_cache_key(
+        [{"role": "user", "content": "What should  I do NEXT?"}]
+    )
+
+
+def test_key_includes_system_and_summary_messages():
+    """the same recent turns after a different summary or prompt miss"""
+    turns = [{"role": "user", "content": str(i)} for i in range(RESPONSE_CACHE_TAIL)]
+    turns.append(QUESTION)
+    assert reply_cache_key([summary("booked a flight")] + turns) != reply_cache_key(
+        [summary("cancelled a flight")] + turns
+    )
+    assert reply_cache_key(
+        [{"role": "system", "content": "answer in french"}] + turns
+    ) != reply_cache_key(turns)
+    assert reply_cache_key([summary("a")] + turns) == reply_cache_key(
+        [summary("a")] + turns
+    )
@@ -0,0 +1,70 @@
+"""
+Unit tests for the gunicorn entry point
+"""
+
+# pylint: disable=import-error
+
+import app as app_module
+from serve import Server, default_threads, default_workers, post_fork, server_options
+
+
+def test_default_workers_scale_with_cpus():
+    """
+    one worker per cpu, never a single one
+    """
+    assert default_workers(1) == 2
+    assert default_workers(4) == 4
+
+
+def test_default_threads_scale_with_cpus():
+    """
+    threads grow with the cpu count, with a floor for small machines
+    """
+    assert default_threads(1) == 8
+    assert default_threads(4) == 16
+
+
+def test_server_options_from_env(monkeypatch):
+    """
+    environment variables override the defaults
+    """
+    monkeypatch.setenv("PORT", "6000")
+    monkeypatch.setenv("SERVE_WORKERS", "3")
+    monkeypatch.setenv("SERVE_THREADS", "2")
+    options = server_options()
+    assert options["bind"] == "0.0.0.0:6000"
+    assert options["workers"] == 3
+    assert options["threads"] == 2
+    assert options["preload_app"] is True
+
+
+def test_server_loads_config():
+    """
+    options end up in the gunicorn config and the app is served as is
+    """
+
+    def wsgi_app(environ, start_response):  # pylint: disable=unused-argument
+        return []
+
+    server = Server(wsgi_app, {"workers": 2, "threads": 5, "not_a_setting": 1})
+    assert server.cfg.workers == 2
+    assert server.cfg.threads == 5
+    assert server.load() is wsgi_app
+
+
+def test_background_tasks_start_after_fork(monkeypatch):
+    """
+    workers start the app's background threads, the preloading master does not
+    """
+    started = []
+    monkeypatch.setattr(app_module, "start_background_tasks", lambda: started.append(1))
+
+    def wsgi_app(environ, start_response):  # pylint: disable=unused-argument
+        return []
+
+    server = Server(wsgi_app, server_options())
+    assert server.cfg.preload_app is True
+    assert not started
+    server.cfg.post_fork(None, None)
+    assert post_fork is server.cfg.post_fork
+    assert started == [1]
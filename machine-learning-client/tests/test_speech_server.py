@@ -54,6 +54,129 @@ def test_transcribe_fake(client):  # pylint: disable=redefined-outer-name
     assert data["text"] == "FAKE_TRANSCRIPTION"
 
 
+def test_live_session(client):  # pylint: disable=redefined-outer-name
+    """
+    frames sent to a live session come back as a transcript
+    """
+    from tests.test_live_session import pcm
+
+    response = client.post("/speech/api/live")
+    assert response.status_code == 201
+    session_id = response.get_json()["session_id"]
+
+    response = client.post(
+        f"/speech/api/live/{session_id}/frames", data=pcm([0.2, 1.0, 1.0])
+    )
+    assert response.get_json()["utterances_sent"] == 1
+
+    response = client.post(f"/speech/api/live/{session_id}/finish")
+    assert response.get_json() == {"transcript": "FAKE_TRANSCRIPTION"}
+
+    response = client.post(f"/speech/api/live/{session_id}/finish")
+    assert response.status_code == 404
+
+
+def test_live_session_bad_rate(client):  # pylint: disable=redefined-outer-name
+    """
+    sample rates outside what microphones record are rejected
+    """
+    assert client.post("/speech/api/live?rate=100").status_code == 400
+
+
+def test_resumable_upload(client, monkeypatch, tmp_path):
+    """
+    an upload sent in two chunks with a resume in between is transcribed
+    on finalize
+    """
+    from backend.routers import speech_server
+    from backend.uploads import UploadStore
+
+    monkeypatch.setattr(speech_server, "upload_store", UploadStore(str(tmp_path)))
+
+    response = client.post(
+        "/speech/api/uploads", json={"filename": "recording.webm", "size": 8}
+    )
+    assert response.status_code == 201
+    location = response.headers["Location"]
+
+    response = client.put(location, data=b"FAKE", headers={"Upload-Offset": "0"})
+    assert response.get_json() == {"offset": 4}
+    assert client.post(f"{location}/finalize").status_code == 409
+
+    # the connection dropped: ask where to resume
+    assert client.head(location).headers["Upload-Offset"] == "4"
+    response = client.put(location, data=b"AUDI", headers={"Upload-Offset": "9"})
+    assert response.status_code == 409
+    assert response.get_json()["offset"] == 4
+    client.put(location, data=b"AUDI", headers={"Upload-Offset": "4"})
+
+    response = client.post(f"{location}/finalize")
+    assert response.get_json() == {"transcript": "FAKE_TRANSCRIPTION"}
+    assert client.get(location).status_code == 404
+
+
+def test_upload_chunk_after_upload_removed(client, monkeypatch, tmp_path):
+    """
+    a rejected chunk for an upload that is gone by then is 404, not 500
+    """
+    from backend.routers import speech_server
+    from backend.uploads import UploadStore
+
+    store = UploadStore(str(tmp_path))
+    monkeypatch.setattr(speech_server, "upload_store", store)
+    upload_id = client.post(
+        "/speech/api/uploads", json={"filename": "recording.webm", "size": 8}
+    ).get_json()["upload_id"]
+
+    def write_then_remove(upload_id, offset, stream):  # pylint: disable=unused-argument
+        store.delete(upload_id)
+        raise ValueError("offset must be between 0 and 0")
+
+    monkeypatch.setattr(store, "write", write_then_remove)
+    response = client.put(
+        f"/speech/api/uploads/{upload_id}", data=b"AUDI", headers={"Upload-Offset": "4"}
+    )
+    assert response.status_code == 404
+
+
+def test_transcription_job(client, monkeypatch, tmp_path):
+    """
+    a job returns at once and its events end with the transcript
+    """
+    from backend import jobs
+    from backend.routers import speech_server
+    from backend.uploads import UploadStore
+
+    monkeypatch.setattr(speech_server, "upload_store", UploadStore(str(tmp_path)))
+    monkeypatch.setattr(jobs, "JOB_POLL_SECONDS", 0.01)
+
+    response = client.post(
+        "/speech/api/jobs",
+        content_type="multipart/form-data",
+        data={"audio": (io.BytesIO(b"FAKEAUDIO"), "recording.webm")},
+    )
+    assert response.status_code == 202
+    location = response.headers["Location"]
+    assert response.get_json()["status"] == "queued"
+
+    body = client.get(f"{location}/events").get_data(as_text=True)
+    assert "event: done" in body
+    assert "FAKE_TRANSCRIPTION" in body
+
+    job = client.get(location).get_json()
+    assert job["status"] == "done"
+    assert job["transcript"] == "FAKE_TRANSCRIPTION"
+
+
+def test_transcription_job_errors(client):
+    """
+    jobs need audio, and unknown jobs are 404
+    """
+    assert client.post("/speech/api/jobs", json={}).status_code == 400
+    assert client.get("/speech/api/jobs/missing").status_code == 404
+    assert client.get("/speech/api/jobs/missing/events").status_code == 404
+
+
 def test_transcribe_missing_file(client):  # pylint: disable=redefined-outer-name
     """
     Should return 400 error when no file is sent
@@ -105,3 +228,197 @@ def test_transcribe_production_mode_error():
             assert response.status_code == 500
             data = response.get_json()
             assert "failed to transcribe audio" in data["error"]
+
+
+@pytest.fixture
+def production_speech():
+    """
+    reload speech_server in production mode with a mocked openai client,
+    then reload it back into testing mode
+    """
+    with patch.dict(
+        os.environ, {"TESTING": "0", "OPENAI_API_KEY": "SK_fake-key"}
+    ), patch(
+        "openai.OpenAI"
+    ) as MockOpenAI:  # pylint: disable=invalid-name
+        mock_client_instance = MagicMock()
+        MockOpenAI.return_value = mock_client_instance
+        mock_client_instance.audio.transcriptions.create.return_value = "hello there"
+
+        from backend.routers import speech_server
+
+        module = importlib.reload(speech_server)
+        module.transcript_cache.clear()
+
+        app = Flask(__name__)
+        app.request_class = module.SpooledRequest
+        app.register_blueprint(module.speech_router)
+        with app.test_client() as client:  # pylint: disable=redefined-outer-name
+            yield client, mock_client_instance
+
+    importlib.reload(module)
+
+
+def test_transcribe_cache_hit(production_speech):
+    """
+    the same recording uploaded twice is only transcribed once
+    """
+    client, mock_client = production_speech
+
+    for expected in ("MISS", "HIT"):
+        response = client.post(
+            "/speech/api/transcribe",
+            content_type="multipart/form-data",
+            data={"audio": (io.BytesIO(b"SAME AUDIO"), "recording.webm")},
+        )
+        assert response.status_code == 200
+        assert response.get_json() == {"transcript": "hello there"}
+        assert response.headers["X-Cache"] == expected
+
+    assert mock_client.audio.transcriptions.create.call_count == 1
+
+    stats = client.get("/speech/api/cache").get_json()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_transcribe_from_memory(production_speech):
+    """
+    the upload is handed to openai from memory under its own filename
+    """
+    client, mock_client = production_speech
+    uploaded = []
+
+    def fake_create(model, file, response_format):  # pylint: disable=unused-argument
+        uploaded.append((file[0], file[1].read()))
+        return "hello there"
+
+    mock_client.audio.transcriptions.create.side_effect = fake_create
+
+    response = client.post(
+        "/speech/api/transcribe",
+        content_type="multipart/form-data",
+        data={"audio": (io.BytesIO(b"IN MEMORY"), "../recording.webm")},
+    )
+    assert response.status_code == 200
+    assert uploaded == [("recording.webm", b"IN MEMORY")]
+
+
+def test_upload_hashed_while_spooled():
+    """
+    uploads spooled by the request are hashed on the way in, without
+    another read; other streams are read and rewound
+    """
+    import hashlib
+    from backend.routers.speech_server import HashingSpooledFile, hash_upload
+
+    expected = (hashlib.sha256(b"AUDIO").hexdigest(), 5)
+    spooled = HashingSpooledFile(max_size=1024)
+    spooled.write(b"AU")
+    spooled.write(b"DIO")
+    spooled.seek(0)
+    assert hash_upload(spooled) == expected
+    assert spooled.tell() == 0
+
+    stream = io.BytesIO(b"AUDIO")
+    assert hash_upload(stream) == expected
+    assert stream.read() == b"AUDIO"
+
+
+def test_transcribe_empty_file(production_speech):
+    """
+    an empty upload is rejected before calling openai
+    """
+    client, mock_client = production_speech
+    response = client.post(
+        "/speech/api/transcribe",
+        content_type="multipart/form-data",
+        data={"audio": (io.BytesIO(b""), "recording.webm")},
+    )
+    assert response.status_code == 400
+    mock_client.audio.transcriptions.create.assert_not_called()
+
+
+def test_transcribe_trims_wav(production_speech):
+    """
+    wav uploads are trimmed before upload and the savings are reported
+    """
+    from tests.test_audio import make_wav
+
+    client, mock_client = production_speech
+    uploaded = []
+
+    def fake_create(model, file, response_format):  # pylint: disable=unused-argument
+        uploaded.append(file[1])
+        return "hello there"
+
+    mock_client.audio.transcriptions.create.side_effect = fake_create
+    original = make_wav([1, 0.5, 2])
+
+    response = client.post(
+        "/speech/api/transcribe",
+        content_type="multipart/form-data",
+        data={"audio": (io.BytesIO(original), "recording.wav")},
+    )
+    assert response.status_code == 200
+    assert len(uploaded[0]) < len(original)
+    saved = int(response.headers["X-Audio-Bytes-Saved"])
+    assert saved == len(original) - len(uploaded[0])
+    assert float(response.headers["X-Audio-Seconds-Saved"]) > 2
+
+
+def test_transcribe_long_wav_in_segments(production_speech, monkeypatch):
+    """
+    long wav uploads are split and each segment transcribed separately
+    """
+    from backend import audio
+    from tests.test_audio import make_wav
+
+    client, mock_client = production_speech
+    monkeypatch.setattr(audio, "SEGMENT_SECONDS", 2)
+    wav = make_wav([0, 1.5, 0.4, 1.5, 0.4, 1.5])
+    # segments run concurrently, so answer by content rather than call order
+    segments, _ = audio.preprocess_segments(wav)
+    replies = dict(zip(segments, ["one two", "two three", "three four"]))
+    mock_client.audio.transcriptions.create.side_effect = lambda **kw: replies[
+        kw["file"][1]
+    ]
+
+    response = client.post(
+        "/speech/api/transcribe",
+        content_type="multipart/form-data",
+        data={"audio": (io.BytesIO(wav), "a.wav")},
+    )
+    assert response.status_code == 200
+    assert mock_client.audio.transcriptions.create.call_count == 3
+    assert response.get_json() == {"transcript": "one two three four"}
+
+
+def test_transcribe_long_webm_in_segments(production_speech, monkeypatch):
+    """
+    long webm recordings from the browser are decoded and split too, and
+    the segments are sent to whisper as wav
+    """
+    from backend import audio
+    from tests.test_audio import make_webm
+
+    client, mock_client = production_speech
+    monkeypatch.setattr(audio, "SEGMENT_SECONDS", 2)
+    webm = make_webm([0, 1.5, 0.4, 1.5, 0.4, 1.5])
+    names = []
+
+    def transcribe(**kw):
+        names.append(kw["file"][0])
+        return "words"
+
+    mock_client.audio.transcriptions.create.side_effect = transcribe
+
+    response = client.post(
+        "/speech/api/transcribe",
+        content_type="multipart/form-data",
+        data={"audio": (io.BytesIO(webm), "recording.webm")},
+    )
+    assert response.status_code == 200
+    assert len(names) > 1
+    assert set(names) == {"recording.wav"}
+    assert "X-Audio-Seconds-Saved" in response.headers
@@ -0,0 +1,87 @@
+"""
+Tests for summarizer.py
+"""
+
+from backend import summarizer
+from backend.DAL import chat_dal
+
+
+def make_chat(count):
+    """insert a chat with count alternating messages"""
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"}
+        for i in range(count)
+    ]
+    return chat_dal.insert_one_chat({"messages": messages})
+
+
+def test_with_summary_without_summary():
+    """chats without a summary send their history as is"""
+    messages = [{"role": "user", "content": "hi"}]
+    assert summarizer.with_summary({}, messages) == messages
+
+
+def test_with_summary_replaces_covered_messages():
+    """summarized messages are replaced by one system message"""
+    messages = [{"content": "a"}, {"content": "b"}, {"content": "c"}]
+    chat = {"summary": "they use an ipad", "summarized_count": 2}
+    result = summarizer.with_summary(chat, messages)
+    assert result[0]["role"] == "system"
+    assert "they use an ipad" in result[0]["content"]
+    assert result[1:] == [{"content": "c"}]
+
+
+def test_needs_summary(monkeypatch):
+    """summaries are opt in and wait for the threshold"""
+    monkeypatch.setattr(summarizer, "SUMMARY_THRESHOLD", 4)
+    assert not summarizer.needs_summary({}, 10)
+
+    monkeypatch.setattr(summarizer, "SUMMARY_ENABLED", True)
+    assert summarizer.needs_summary({}, 5)
+    assert not summarizer.needs_summary({"summarized_count": 2}, 5)
+
+
+def test_summarize_chat(monkeypatch):
+    """older turns are folded into the summary, recent ones are kept"""
+    prompts = []
+
+    def fake_ask_model(messages):
+        prompts.append(messages)
+        return "they use an ipad"
+
+    monkeypatch.setattr(summarizer, "ask_model", fake_ask_model)
+    monkeypatch.setattr(summarizer, "SUMMARY_KEEP_RECENT", 2)
+    chat_id = make_chat(6)
+
+    assert summarizer.summarize_chat(chat_id) is True
+    chat = chat_dal.find_one_chat({"_id": chat_id})
+    assert chat["summary"] == "they use an ipad"
+    assert chat["summarized_count"] == 4
+    assert "m3" in prompts[0][1]["content"]
+    assert "m4" not in prompts[0][1]["content"]
+
+    # nothing new to fold in
+    assert summarizer.summarize_chat(chat_id) is False
+
+
+def test_summarize_chat_keeps_old_summary_on_model_error(monkeypatch):
+    """a failed model call does not overwrite the summary"""
+    monkeypatch.setattr(
+        summarizer, "ask_model", lambda messages: summarizer.MODEL_ERROR_REPLY
+    )
+    monkeypatch.setattr(summarizer, "SUMMARY_KEEP_RECENT", 2)
+    chat_id = make_chat(6)
+
+    assert summarizer.summarize_chat(chat_id) is False
+    assert "summary" not in chat_dal.find_one_chat({"_id": chat_id})
+
+
+def test_schedule_summary(monkeypatch):
+    """summaries run in the background"""
+    monkeypatch.setattr(summarizer, "ask_model", lambda messages: "summary")
+    monkeypatch.setattr(summarizer, "SUMMARY_KEEP_RECENT", 2)
+    chat_id = make_chat(6)
+
+    future = summarizer.schedule_summary(chat_id)
+    assert future.result(timeout=5) is True
+    assert chat_dal.find_one_chat({"_id": chat_id})["summary"] == "summary"
@@ -0,0 +1,69 @@
+"""
+Unit tests for parallel transcription
+"""
+
+# pylint: disable=import-error
+
+import asyncio
+import time
+
+from backend.transcription import (
+    stitch_transcripts,
+    transcribe_segments,
+    transcribe_segments_async,
+)
+
+
+def test_stitch_drops_overlapping_words():
+    """
+    words repeated across a cut appear once
+    """
+    texts = ["I would like to call", "to call my daughter.", "Daughter, today please"]
+    assert stitch_transcripts(texts) == "I would like to call my daughter. today please"
+
+
+def test_stitch_without_overlap():
+    """
+    segments that do not overlap are just joined
+    """
+    assert stitch_transcripts(["good morning", "how are you"]) == (
+        "good morning how are you"
+    )
+
+
+def test_stitch_single_segment_unchanged():
+    """
+    a single transcript is returned exactly as whisper sent it
+    """
+    assert stitch_transcripts(["hello there\n"]) == "hello there\n"
+
+
+def test_transcribe_segments_keeps_order():
+    """
+    segments finishing out of order are still stitched in order
+    """
+
+    def slow_first(segment):
+        time.sleep(0.05 if segment == 0 else 0)
+        return f"part{segment}"
+
+    assert transcribe_segments([0, 1, 2], slow_first) == "part0 part1 part2"
+
+
+def test_transcribe_segments_async_bounded():
+    """
+    async segments come back in order with at most limit in flight
+    """
+    in_flight = []
+    most = []
+
+    async def transcribe(segment):
+        in_flight.append(segment)
+        most.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(segment)
+        return f"word{segment}"
+
+    text = asyncio.run(transcribe_segments_async(range(6), transcribe, limit=2))
+    assert text == " ".join(f"word{i}" for i in range(6))
+    assert max(most) == 2
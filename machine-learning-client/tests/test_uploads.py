@@ -0,0 +1,70 @@
+"""
+Unit tests for resumable uploads
+"""
+
+# pylint: disable=import-error
+
+import io
+
+import pytest
+
+from backend.uploads import UploadStore
+
+
+def test_resume_after_partial_upload(tmp_path):
+    """
+    a client can ask for the offset and only send the missing bytes
+    """
+    store = UploadStore(str(tmp_path))
+    upload_id = store.create("recording.webm", size=10)["upload_id"]
+
+    assert store.write(upload_id, 0, io.BytesIO(b"01234")) == 5
+    assert store.status(upload_id)["offset"] == 5
+    assert not store.status(upload_id)["complete"]
+
+    assert store.write(upload_id, 5, io.BytesIO(b"56789")) == 10
+    assert store.status(upload_id)["complete"]
+    with store.open(upload_id) as f:
+        assert f.read() == b"0123456789"
+
+
+def test_retried_chunk_overwrites(tmp_path):
+    """
+    resending a chunk that already arrived replaces it instead of appending
+    """
+    store = UploadStore(str(tmp_path))
+    upload_id = store.create("recording.webm")["upload_id"]
+    store.write(upload_id, 0, io.BytesIO(b"abcdef"))
+    assert store.write(upload_id, 3, io.BytesIO(b"DEF")) == 6
+    with store.open(upload_id) as f:
+        assert f.read() == b"abcDEF"
+
+
+def test_bad_offsets_and_sizes(tmp_path):
+    """
+    gaps, oversized uploads and unknown ids are rejected
+    """
+    store = UploadStore(str(tmp_path), max_bytes=8)
+    upload_id = store.create("recording.webm")["upload_id"]
+
+    with pytest.raises(ValueError):
+        store.write(upload_id, 3, io.BytesIO(b"gap"))
+    with pytest.raises(ValueError):
+        store.write(upload_id, 0, io.BytesIO(b"too many bytes"))
+    assert store.status(upload_id)["offset"] == 0
+    with pytest.raises(ValueError):
+        store.create("recording.webm", size=100)
+    with pytest.raises(KeyError):
+        store.write("f" * 32, 0, io.BytesIO(b"x"))
+    assert store.status("../../etc/passwd") is None
+
+
+def test_delete(tmp_path):
+    """
+    deleted uploads are gone
+    """
+    store = UploadStore(str(tmp_path))
+    upload_id = store.create("recording.webm")["upload_id"]
+    store.delete(upload_id)
+    assert store.status(upload_id) is None
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,246 @@
+"""
+Chat reads the web-app answers straight from mongo: the chat list, its
+summary pages, one window of a chat's history and the messages since a
+given one.
+
+The ml client serves the same routes from its own DAL and is where every
+write goes. Page sizes, the summary cursor and the response shapes must
+stay the same on both sides, because the web-app falls back to proxying
+a read when mongo fails and a cursor from one side is used on the other.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 200
+SUMMARY_PAGE_SIZE = 20
+SUMMARY_PAGE_MAX = 100
+
+# fields the chat list needs, kept up to date by the ml client on writes
+SUMMARY_PROJECTION = {
+    "title": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "message_count": 1,
+    "last_message_preview": 1,
+    "last_role": 1,
+}
+# newest first, with the id breaking ties so pages never overlap
+SUMMARY_SORT = [("updated_at", -1), ("_id", -1)]
+
+
+def history_limit(value):
+    """
+    the number of messages asked for, HISTORY_PAGE_SIZE if not given and
+    at most HISTORY_PAGE_MAX, or None if it is not a positive integer
+    """
+    try:
+        limit = min(
+            int(HISTORY_PAGE_SIZE if value is None else value), HISTORY_PAGE_MAX
+        )
+    except ValueError:
+        return None
+    return limit if limit >= 1 else None
+
+
+def summary_limit(value):
+    """
+    the page size asked for, or None if it is not a positive integer
+    """
+    try:
+        limit = min(
+            int(SUMMARY_PAGE_SIZE if value is None else value), SUMMARY_PAGE_MAX
+        )
+    except ValueError:
+        return None
+    return limit if limit >= 1 else None
+
+
+def encode_cursor(chat):
+    """
+    turn the last chat of a page into an opaque cursor
+    """
+    raw = json.dumps([chat.get("updated_at"), chat["_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """
+    turn a cursor back into (updated_at, _id), raises ValueError if it is bad
+    """
+    try:
+        updated_at, chat_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, TypeError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+    return updated_at, chat_id
+
+
+def is_timestamp(value):
+    """
+    check if a since value is an iso timestamp rather than a message id
+    """
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def summaries_filter(after, since):
+    """
+    filter for the chats after one page of summaries
+    """
+    query_filter = {}
+    if after is not None:
+        updated_at, chat_id = after
+        if updated_at is None:
+            query_filter = {"updated_at": None, "_id": {"$lt": chat_id}}
+        else:
+            # chats without updated_at sort last, after every timestamp
+            query_filter = {
+                "$or": [
+                    {"updated_at": {"$lt": updated_at}},
+                    {"updated_at": updated_at, "_id": {"$lt": chat_id}},
+                    {"updated_at": None},
+                ]
+            }
+    if since is not None:
+        query_filter = {"$and": [query_filter, {"updated_at": {"$gt": since}}]}
+    return query_filter
+
+
+def chat_window_pipeline(chat_id, limit, before):
+    """
+    aggregation keeping the `limit` messages, plus one, right before the
+    message with id `before`; messages is null if before is not in the chat
+    """
+    window = limit + 1
+    end = {"$indexOfArray": ["$messages._id", before]}
+    return [
+        {"$match": {"_id": chat_id}},
+        {"$set": {"_end": end}},
+        {
+            "$set": {
+                "messages": {
+                    "$cond": [
+                        {"$gt": ["$_end", 0]},
+                        {
+                            "$slice": [
+                                "$messages",
+                                {"$max": [0, {"$subtract": ["$_end", window]}]},
+                                {"$min": ["$_end", window]},
+                            ]
+                        },
+                        {"$cond": [{"$eq": ["$_end", 0]}, [], None]},
+                    ]
+                }
+            }
+        },
+        {"$unset": "_end"},
+    ]
+
+
+def messages_since_pipeline(chat_id, since):
+    """
+    aggregation keeping only the messages after the message with id since,
+    or after the timestamp since; messages is null if the id is not in the
+    chat
+    """
+    messages = {"$ifNull": ["$messages", []]}
+    if is_timestamp(since):
+        start = None
+        newer = {
+            "$filter": {
+                "input": messages,
+                "as": "m",
+                "cond": {"$gt": ["$$m.timestamp", since]},
+            }
+        }
+    else:
+        start = {"$indexOfArray": ["$messages._id", since]}
+        newer = {
+            "$cond": [
+                {"$gte": ["$_start", 0]},
+                {
+                    "$slice": [
+                        messages,
+                        {"$add": ["$_start", 1]},
+                        {"$max": [1, {"$size": messages}]},
+                    ]
+                },
+                None,
+            ]
+        }
+    return [
+        {"$match": {"_id": chat_id}},
+        {"$set": {"_start": start}},
+        {
+            "$project": {
+                "messages": newer,
+                "message_count": 1,
+                "version": 1,
+                "updated_at": 1,
+            }
+        },
+    ]
+
+
+def find_chat_list(db):
+    """every chat, without its message history"""
+    return list(db.chats.find({}, {"messages": 0}))
+
+
+def find_chat_summaries(db, limit, after=None, since=None):
+    """
+    one page of chats, newest first, and the cursor of the next page
+    """
+    # fetch one extra chat to know if there is another page
+    chats = list(
+        db.chats.find(summaries_filter(after, since), SUMMARY_PROJECTION)
+        .sort(SUMMARY_SORT)
+        .limit(limit + 1)
+    )
+    next_cursor = encode_cursor(chats[limit - 1]) if len(chats) > limit else None
+    return {"chats": chats[:limit], "next_cursor": next_cursor}
+
+
+def find_chat(db, chat_id):
+    """one chat with its whole history"""
+    return db.chats.find_one({"_id": chat_id})
+
+
+def find_chat_window(db, chat_id, limit, before=None):
+    """
+    a chat with only its last `limit` messages, or the `limit` messages
+    right before the message with id `before`, and has_more set when there
+    are older ones. None if the chat or the before message does not exist.
+    """
+    if before is None:
+        # fetch one extra message to know if there are older ones
+        chat = db.chats.find_one(
+            {"_id": chat_id}, {"messages": {"$slice": -(limit + 1)}}
+        )
+    else:
+        chat = next(
+            iter(db.chats.aggregate(chat_window_pipeline(chat_id, limit, before))), None
+        )
+    if chat is None or ("messages" in chat and chat["messages"] is None):
+        return None
+    messages = chat.get("messages", [])
+    chat["has_more"] = len(messages) > limit
+    chat["messages"] = messages[-limit:]
+    return chat
+
+
+def find_messages_since(db, chat_id, since):
+    """
+    a chat with only the messages after since, a message id or timestamp.
+    None if the chat or the since message does not exist.
+    """
+    chat = next(iter(db.chats.aggregate(messages_since_pipeline(chat_id, since))), None)
+    if chat is None or chat.get("messages") is None:
+        return None
+    return chat
@@ -0,0 +1,70 @@
+"""
+Production entry point for the web app: runs app.py under gunicorn instead
+of the single process werkzeug dev server.
+
+    python serve.py
+
+The app is imported once in the master (preload) so the mongo client, the
+pooled proxy session and the templates are set up once and shared
+copy-on-write with the workers. The mongo client is created with
+connect=False, so it only connects once a worker first queries it. Send
+the master SIGHUP to restart workers gracefully; in-flight requests get
+SERVE_GRACEFUL_TIMEOUT seconds to finish.
+"""
+
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+def default_workers(cpus=None):
+    """
+    worker processes sized from the cpu count, gunicorn's usual 2n + 1
+    """
+    return (cpus or multiprocessing.cpu_count()) * 2 + 1
+
+
+def server_options():
+    """
+    gunicorn settings, overridable from the environment
+    """
+    return {
+        "bind": f"0.0.0.0:{os.getenv('PORT', '5050')}",
+        "workers": int(os.getenv("SERVE_WORKERS", str(default_workers()))),
+        # threads keep a worker free while it waits on a proxied stream
+        "threads": int(os.getenv("SERVE_THREADS", "4")),
+        "worker_class": "gthread",
+        "preload_app": True,
+        "timeout": int(os.getenv("SERVE_TIMEOUT", "30")),
+        "graceful_timeout": int(os.getenv("SERVE_GRACEFUL_TIMEOUT", "60")),
+        "keepalive": int(os.getenv("SERVE_KEEPALIVE", "5")),
+        "max_requests": int(os.getenv("SERVE_MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.getenv("SERVE_MAX_REQUESTS_JITTER", "0")),
+        "accesslog": os.getenv("SERVE_ACCESS_LOG", "-") or None,
+    }
+
+
+class Server(BaseApplication):  # pylint: disable=abstract-method
+    """
+    gunicorn application serving a wsgi app with the given settings
+    """
+
+    def __init__(self, application, options=None):
+        self.application = application
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None and key in self.cfg.settings:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+if __name__ == "__main__":
+    from app import app  # pylint: disable=import-outside-toplevel
+
+    Server(app, server_options()).run()
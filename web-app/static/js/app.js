@@ -1,12 +1,29 @@
 // API Base URL
 const API_BASE = "/chats/api";
 const MESSAGES_API = "/messages/api";
+const CHAT_PAGE_SIZE = 30;
+const HISTORY_PAGE_SIZE = 50;
+const SPEECH_API = "/speech/api";
+// recordings above this size are sent as a resumable upload in chunks
+const RESUMABLE_UPLOAD_MIN_BYTES = 512 * 1024;
+const UPLOAD_CHUNK_BYTES = 256 * 1024;
+const UPLOAD_RETRIES = 5;
+// live recordings post PCM frames this often, so each utterance is
+// transcribed while the user is still talking
+const LIVE_SAMPLE_RATE = 16000;
+const LIVE_FRAME_MS = 250;
 
 // State Management
 let currentChatId = null;
 let isRecording = false;
 let mediaRecorder = null;
 let audioChunks = [];
+let liveRecording = null;
+let hasOlderMessages = false;
+let loadingOlder = false;
+let chatSummaries = [];
+let chatListCursor = null;
+let chatListSyncedAt = null;
 
 // DOM Elements
 const welcomeScreen = document.getElementById("welcome-screen");
@@ -52,6 +69,11 @@ function setupEventListeners() {
 
   // New chat button
   newChatBtn.addEventListener("click", createNewChat);
+
+  // Load older messages when scrolled to the top
+  messagesContainer.addEventListener("scroll", () => {
+    if (messagesContainer.scrollTop < 50) loadOlderMessages();
+  });
 }
 
 // Chat Management
@@ -72,9 +94,10 @@ async function createNewChat() {
     if (response.ok) {
       const data = await response.json();
       currentChatId = data.inserted_id;
+      hasOlderMessages = false;
       messagesContainer.innerHTML = ""; // clear messages for new chat
       showChatArea();
-      loadChatHistory();
+      refreshChatList();
     } else {
       showNotification(
         `Failed to create new chat: ${response.status}`,
@@ -104,28 +127,77 @@ marked.setOptions({
   },
 });
 
-async function loadChatHistory() {
+// Load the chat list one page at a time; pass a cursor to append the next page
+async function loadChatHistory(cursor = null) {
   try {
-    const response = await fetch(API_BASE + "/");
+    const params = new URLSearchParams({ limit: CHAT_PAGE_SIZE });
+    if (cursor) params.set("cursor", cursor);
+
+    const response = await fetch(`${API_BASE}/summaries?${params}`);
     if (response.ok) {
-      const chats = await response.json();
-      displayChatList(chats);
+      const page = await response.json();
+      chatSummaries = cursor ? chatSummaries.concat(page.chats) : page.chats;
+      chatListCursor = page.next_cursor;
+      updateChatListSyncedAt(page.chats);
+      displayChatList();
     }
   } catch (error) {
     console.error("Error loading chats:", error);
   }
 }
 
-function displayChatList(chats) {
+// Fetch only the chats that changed since the last load and merge them in,
+// following the cursor so no change is dropped when many chats changed
+async function refreshChatList() {
+  if (!chatListSyncedAt) return loadChatHistory();
+
+  try {
+    const changedChats = [];
+    let cursor = null;
+    do {
+      const params = new URLSearchParams({
+        limit: CHAT_PAGE_SIZE,
+        since: chatListSyncedAt,
+      });
+      if (cursor) params.set("cursor", cursor);
+      const response = await fetch(`${API_BASE}/summaries?${params}`);
+      if (!response.ok) return;
+      const page = await response.json();
+      changedChats.push(...page.chats);
+      cursor = page.next_cursor;
+    } while (cursor);
+    if (changedChats.length === 0) return;
+
+    const changed = new Set(changedChats.map((chat) => chat._id));
+    chatSummaries = changedChats.concat(
+      chatSummaries.filter((chat) => !changed.has(chat._id))
+    );
+    updateChatListSyncedAt(changedChats);
+    displayChatList();
+  } catch (error) {
+    console.error("Error refreshing chats:", error);
+  }
+}
+
+function updateChatListSyncedAt(chats) {
+  chats.forEach((chat) => {
+    const updatedAt = chat.updated_at;
+    if (updatedAt && (!chatListSyncedAt || updatedAt > chatListSyncedAt)) {
+      chatListSyncedAt = updatedAt;
+    }
+  });
+}
+
+function displayChatList() {
   chatList.innerHTML = "";
 
-  if (!chats || chats.length === 0) {
+  if (chatSummaries.length === 0) {
     chatList.innerHTML =
       '<p style="color: var(--text-secondary); text-align: center;">No conversations yet</p>';
     return;
   }
 
-  chats.forEach((chat) => {
+  chatSummaries.forEach((chat) => {
     const chatItem = document.createElement("div");
     chatItem.className = "chat-item";
     if (chat._id === currentChatId) {
@@ -133,11 +205,9 @@ function displayChatList(chats) {
     }
 
     const title = chat.title || "Conversation";
-    const preview =
-      chat.messages && chat.messages.length > 0
-        ? chat.messages[chat.messages.length - 1].content.substring(0, 50) +
-          "..."
-        : "Start chatting...";
+    const preview = chat.last_message_preview
+      ? chat.last_message_preview.substring(0, 50) + "..."
+      : "Start chatting...";
 
     chatItem.innerHTML = `
             <div class="chat-item-title">${title}</div>
@@ -147,17 +217,32 @@ function displayChatList(chats) {
     chatItem.addEventListener("click", () => loadChat(chat._id));
     chatList.appendChild(chatItem);
   });
+
+  if (chatListCursor) {
+    const button = document.createElement("button");
+    button.className = "btn";
+    button.textContent = "Show older conversations";
+    button.addEventListener("click", () => loadChatHistory(chatListCursor));
+    chatList.appendChild(button);
+  }
 }
 
 async function loadChat(chatId) {
+  // reopening the open chat only needs the messages we have not seen yet
+  if (chatId === currentChatId && (await syncMessages())) return;
+
   try {
-    const response = await fetch(`${API_BASE}/${chatId}`);
+    // only the newest page; older messages load when scrolling up
+    const response = await fetch(
+      `${API_BASE}/${chatId}?limit=${HISTORY_PAGE_SIZE}`
+    );
     if (response.ok) {
       const chat = await response.json();
       currentChatId = chatId;
+      hasOlderMessages = Boolean(chat.has_more);
       displayMessages(chat.messages || []);
       showChatArea();
-      loadChatHistory(); // Refresh to update active state
+      displayChatList(); // Redraw to update active state
     }
   } catch (error) {
     console.error("Error loading chat:", error);
@@ -165,14 +250,74 @@ async function loadChat(chatId) {
   }
 }
 
+// Append messages newer than the last one shown; false if a full load is needed
+async function syncMessages() {
+  const shown = messagesContainer.querySelectorAll(".message[data-id]");
+  if (shown.length === 0) return false;
+
+  try {
+    const since = shown[shown.length - 1].dataset.id;
+    const response = await fetch(
+      `${API_BASE}/${currentChatId}/messages?since=${encodeURIComponent(since)}`
+    );
+    if (!response.ok) return false;
+
+    const chat = await response.json();
+    chat.messages.forEach((msg) => addMessageToUI(msg));
+    return true;
+  } catch (error) {
+    console.error("Error syncing chat:", error);
+    return false;
+  }
+}
+
+async function loadOlderMessages() {
+  const oldest = messagesContainer.querySelector(".message[data-id]");
+  if (!currentChatId || !hasOlderMessages || loadingOlder || !oldest) return;
+
+  loadingOlder = true;
+  try {
+    const params = new URLSearchParams({
+      limit: HISTORY_PAGE_SIZE,
+      before: oldest.dataset.id,
+    });
+    const response = await fetch(`${API_BASE}/${currentChatId}?${params}`);
+    if (response.ok) {
+      const chat = await response.json();
+      hasOlderMessages = Boolean(chat.has_more);
+
+      // keep the view still while older messages are added above it
+      const previousHeight = messagesContainer.scrollHeight;
+      const fragment = document.createDocumentFragment();
+      (chat.messages || []).forEach((msg) =>
+        fragment.appendChild(createMessageElement(msg))
+      );
+      messagesContainer.insertBefore(fragment, messagesContainer.firstChild);
+      messagesContainer.scrollTop +=
+        messagesContainer.scrollHeight - previousHeight;
+    }
+  } catch (error) {
+    console.error("Error loading older messages:", error);
+  } finally {
+    loadingOlder = false;
+  }
+}
+
 // Message Display
 function displayMessages(messages) {
   messagesContainer.innerHTML = "";
-  messages.forEach((msg) => addMessageToUI(msg));
+  messages.forEach((msg) =>
+    messagesContainer.appendChild(createMessageElement(msg))
+  );
   scrollToBottom();
 }
 
 function addMessageToUI(message) {
+  messagesContainer.appendChild(createMessageElement(message));
+  scrollToBottom();
+}
+
+function createMessageElement(message) {
   const messageDiv = document.createElement("div");
   messageDiv.className = `message ${message.role}`;
 
@@ -185,6 +330,8 @@ function addMessageToUI(message) {
     }
   );
 
+  if (message._id) messageDiv.dataset.id = message._id;
+
   messageDiv.innerHTML = `
         <div class="message-avatar">${avatar}</div>
         <div>
@@ -193,8 +340,7 @@ function addMessageToUI(message) {
         </div>
     `;
 
-  messagesContainer.appendChild(messageDiv);
-  scrollToBottom();
+  return messageDiv;
 }
 
 // Recording Functions
@@ -205,16 +351,20 @@ async function startRecording() {
     const stream = await navigator.mediaDevices.getUserMedia({
       audio: true,
     });
-    mediaRecorder = new MediaRecorder(stream);
-    audioChunks = [];
+    liveRecording = await startLiveRecording(stream);
+    if (!liveRecording) {
+      // no live session: record webm and upload it when the user stops
+      mediaRecorder = new MediaRecorder(stream);
+      audioChunks = [];
 
-    mediaRecorder.addEventListener("dataavailable", (event) => {
-      audioChunks.push(event.data);
-    });
+      mediaRecorder.addEventListener("dataavailable", (event) => {
+        audioChunks.push(event.data);
+      });
 
-    mediaRecorder.addEventListener("stop", processRecording);
+      mediaRecorder.addEventListener("stop", processRecording);
 
-    mediaRecorder.start();
+      mediaRecorder.start();
+    }
     isRecording = true;
     recordBtn.classList.add("recording");
     recordingIndicator.classList.remove("hidden");
@@ -228,52 +378,250 @@ async function startRecording() {
 }
 
 function stopRecording() {
-  if (!isRecording || !mediaRecorder) return;
+  if (!isRecording) return;
 
-  mediaRecorder.stop();
-  mediaRecorder.stream.getTracks().forEach((track) => track.stop());
   isRecording = false;
   recordBtn.classList.remove("recording");
   recordingIndicator.classList.add("hidden");
+  showLivePartial("");
+
+  if (liveRecording) {
+    const recording = liveRecording;
+    liveRecording = null;
+    finishLiveRecording(recording);
+    return;
+  }
+  if (!mediaRecorder) return;
+  mediaRecorder.stop();
+  mediaRecorder.stream.getTracks().forEach((track) => track.stop());
 }
 
 async function processRecording() {
   const audioBlob = new Blob(audioChunks, { type: "audio/webm" });
+  await sendVoiceMessage(audioBlob);
+}
 
-  // For now, we'll convert to text using a placeholder
-  // In production, you'd use a speech-to-text API
-  const transcript = await transcribeAudio(audioBlob);
+// Open a live session and post the microphone's PCM to it while recording.
+// Returns null if no session could be opened.
+async function startLiveRecording(stream) {
+  let audioContext;
+  try {
+    audioContext = new AudioContext({ sampleRate: LIVE_SAMPLE_RATE });
+  } catch {
+    audioContext = new AudioContext();
+  }
+  const rate = audioContext.sampleRate;
+  const res = await fetch(`${SPEECH_API}/live?rate=${rate}`, {
+    method: "POST",
+  }).catch(() => null);
+  if (!res || !res.ok) {
+    audioContext.close();
+    return null;
+  }
+  const { session_id: sessionId } = await res.json();
+
+  const source = audioContext.createMediaStreamSource(stream);
+  // ScriptProcessor needs no separate worklet file; it only copies samples
+  const processor = audioContext.createScriptProcessor(4096, 1, 1);
+  const recording = {
+    sessionId,
+    rate,
+    stream,
+    audioContext,
+    source,
+    processor,
+    unsent: [],
+    recorded: [],
+    sending: Promise.resolve(),
+    failed: false,
+  };
+  processor.onaudioprocess = (event) => {
+    const pcm = toPcm16(event.inputBuffer.getChannelData(0));
+    recording.unsent.push(pcm);
+    recording.recorded.push(pcm);
+  };
+  source.connect(processor);
+  processor.connect(audioContext.destination);
+  recording.timer = setInterval(
+    () => sendLiveFrames(recording),
+    LIVE_FRAME_MS
+  );
+  return recording;
+}
+
+function toPcm16(samples) {
+  const pcm = new Int16Array(samples.length);
+  for (let i = 0; i < samples.length; i++) {
+    const s = Math.max(-1, Math.min(1, samples[i]));
+    pcm[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
+  }
+  return pcm;
+}
+
+// Post the frames recorded since the last call. Requests are chained so
+// frames arrive in order; the partial transcript comes back with each one.
+function sendLiveFrames(recording) {
+  if (recording.unsent.length === 0) return recording.sending;
+  const frames = new Blob(recording.unsent);
+  recording.unsent = [];
+  recording.sending = recording.sending
+    .then(async () => {
+      if (recording.failed) return;
+      const res = await fetch(
+        `${SPEECH_API}/live/${recording.sessionId}/frames`,
+        {
+          method: "POST",
+          headers: { "Content-Type": "application/octet-stream" },
+          body: frames,
+        }
+      );
+      if (!res.ok) throw new Error("Failed to send live audio");
+      const { partial } = await res.json();
+      if (isRecording) showLivePartial(partial);
+    })
+    .catch((error) => {
+      console.error("Live session failed, uploading instead:", error);
+      recording.failed = true;
+    });
+  return recording.sending;
+}
 
-  if (transcript) {
-    await sendMessage(transcript);
+async function finishLiveRecording(recording) {
+  clearInterval(recording.timer);
+  recording.processor.disconnect();
+  recording.source.disconnect();
+  recording.stream.getTracks().forEach((track) => track.stop());
+  recording.audioContext.close();
+
+  await sendLiveFrames(recording);
+  if (recording.failed) {
+    // frames went missing, send the whole recording instead
+    const wav = encodeWav(recording.recorded, recording.rate);
+    await sendVoiceMessage(wav, { filename: "recording.wav" });
+  } else {
+    await sendVoiceMessage(null, { sessionId: recording.sessionId });
   }
 }
 
-async function transcribeAudio(audioBlob) {
-  const formData = new FormData();
-  formData.append("audio", audioBlob, "recording.webm");
+function showLivePartial(text) {
+  const label = recordingIndicator.querySelector("span:last-child");
+  label.textContent = text ? `Recording... ${text}` : "Recording...";
+}
+
+// 16 bit mono PCM chunks as a wav file
+function encodeWav(chunks, rate) {
+  const length = chunks.reduce((sum, chunk) => sum + chunk.byteLength, 0);
+  const header = new DataView(new ArrayBuffer(44));
+  const text = (offset, value) =>
+    [...value].forEach((c, i) => header.setUint8(offset + i, c.charCodeAt(0)));
+  text(0, "RIFF");
+  header.setUint32(4, 36 + length, true);
+  text(8, "WAVE");
+  text(12, "fmt ");
+  header.setUint32(16, 16, true);
+  header.setUint16(20, 1, true);
+  header.setUint16(22, 1, true);
+  header.setUint32(24, rate, true);
+  header.setUint32(28, rate * 2, true);
+  header.setUint16(32, 2, true);
+  header.setUint16(34, 16, true);
+  text(36, "data");
+  header.setUint32(40, length, true);
+  return new Blob([header, ...chunks], { type: "audio/wav" });
+}
+
+// Transcribe and answer a recording, or a finished live session, in one
+// request; the transcript comes back as the first streamed event and is
+// shown as the user's message
+async function sendVoiceMessage(
+  audioBlob,
+  { sessionId = null, filename = "recording.webm" } = {}
+) {
+  if (!currentChatId) {
+    await createNewChat();
+    if (!currentChatId) return;
+  }
 
-  showNotification("Transcribing audio...", "info");
+  showChatArea();
+  showTypingIndicator();
 
   try {
-    const res = await fetch("/speech/api/transcribe", {
+    let voiceUrl = `${API_BASE}/${currentChatId}/voice`;
+    let body = null;
+    if (sessionId) {
+      voiceUrl += `?session=${sessionId}`;
+    } else if (audioBlob.size > RESUMABLE_UPLOAD_MIN_BYTES) {
+      const uploadId = await uploadResumable(audioBlob, filename);
+      voiceUrl += `?upload=${uploadId}`;
+    } else {
+      body = new FormData();
+      body.append("audio", audioBlob, filename);
+    }
+
+    const response = await fetch(voiceUrl, {
       method: "POST",
-      body: formData,
+      headers: { Accept: "text/event-stream" },
+      body,
     });
 
-    if (res.ok) {
-      const data = await res.json();
-      return data.transcript;
+    if (!response.ok) {
+      console.log("Voice message failed", await response.text());
+      throw new Error("Failed to send voice message");
+    }
+
+    const contentType = response.headers.get("Content-Type") || "";
+    if (contentType.startsWith("text/event-stream") && response.body) {
+      await readReplyStream(response);
     } else {
-      console.log("Transcription failed", await res.text());
-      showNotification("Failed to transcribe audio", "error");
-      return null;
+      removeTypingIndicator();
+      const data = await response.json();
+      addMessageToUI(data.user_message);
+      addMessageToUI(data.assistant_message);
     }
+
+    refreshChatList();
   } catch (error) {
-    console.log("error cant transcribe : ", error);
-    showNotification("Error sending audio for transcription", "error");
-    return null;
+    console.error("Error sending voice message:", error);
+    removeTypingIndicator();
+    showNotification("Failed to send voice message. Please try again.", "error");
+  }
+}
+
+// Send a blob in chunks; after a dropped connection ask the server how much
+// arrived and only send the rest
+async function uploadResumable(blob, filename) {
+  const res = await fetch(`${SPEECH_API}/uploads`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ filename, size: blob.size }),
+  });
+  if (!res.ok) throw new Error("Failed to start upload");
+  const { upload_id: uploadId } = await res.json();
+  const url = `${SPEECH_API}/uploads/${uploadId}`;
+
+  let offset = 0;
+  let failures = 0;
+  while (offset < blob.size) {
+    try {
+      const chunk = blob.slice(offset, offset + UPLOAD_CHUNK_BYTES);
+      const put = await fetch(url, {
+        method: "PUT",
+        headers: { "Upload-Offset": String(offset) },
+        body: chunk,
+      });
+      if (!put.ok && put.status !== 409) throw new Error("chunk failed");
+      offset = (await put.json()).offset;
+      failures = 0;
+    } catch (error) {
+      if (++failures > UPLOAD_RETRIES) throw error;
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+      const head = await fetch(url, { method: "HEAD" }).catch(() => null);
+      if (head && head.ok) {
+        offset = Number(head.headers.get("Upload-Offset"));
+      }
+    }
   }
+  return uploadId;
 }
 
 // Text Message Functions
@@ -306,22 +654,32 @@ async function sendMessage(content) {
   showTypingIndicator();
 
   try {
-    // Send message to backend
+    // Send message to backend and ask for a streamed reply
     const response = await fetch(`${API_BASE}/${currentChatId}/message`, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: {
+        "Content-Type": "application/json",
+        Accept: "text/event-stream",
+      },
       body: JSON.stringify(userMessage),
     });
 
-    removeTypingIndicator();
+    if (!response.ok) {
+      throw new Error("Failed to send message");
+    }
 
-    if (response.ok) {
-      // the backend now reutrns ai message directly
+    const contentType = response.headers.get("Content-Type") || "";
+    if (contentType.startsWith("text/event-stream") && response.body) {
+      await readReplyStream(response);
+    } else {
+      // older backends return the ai message directly
+      removeTypingIndicator();
       const assistantMessage = await response.json();
       addMessageToUI(assistantMessage);
-    } else {
-      throw new Error("Failed to send message");
     }
+
+    // only the chats that changed since the last sync are downloaded
+    refreshChatList();
   } catch (error) {
     console.error("Error sending message:", error);
     removeTypingIndicator();
@@ -329,6 +687,62 @@ async function sendMessage(content) {
   }
 }
 
+// Read server-sent events from a streamed reply and grow the bubble as
+// deltas arrive
+async function readReplyStream(response) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let text = "";
+  let bubble = null;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = "delta";
+      let data = "";
+      rawEvent.split("\n").forEach((line) => {
+        if (line.startsWith("event: ")) eventName = line.slice(7);
+        if (line.startsWith("data: ")) data += line.slice(6);
+      });
+      if (!data) continue;
+      const payload = JSON.parse(data);
+
+      if (eventName === "error") {
+        throw new Error(payload.error || "Failed to send message");
+      }
+
+      // voice turns send the transcribed user message before the reply
+      if (eventName === "transcript") {
+        removeTypingIndicator();
+        addMessageToUI(payload);
+        showTypingIndicator();
+        continue;
+      }
+
+      if (!bubble) {
+        removeTypingIndicator();
+        addMessageToUI({ role: "assistant", content: "" });
+        bubble = messagesContainer.lastElementChild;
+      }
+
+      if (eventName === "message" && payload._id) {
+        bubble.dataset.id = payload._id;
+      }
+      text = eventName === "message" ? payload.content : text + payload.delta;
+      bubble.querySelector(".message-content").innerHTML = renderMarkdown(text);
+      scrollToBottom();
+    }
+  }
+}
+
 // UI Helper Functions
 function showChatArea() {
   welcomeScreen.classList.add("hidden");
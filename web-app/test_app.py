@@ -4,10 +4,10 @@ Unit tests for the web application
 
 import sys  # pylint: disable=unused-import
 from unittest.mock import MagicMock, Mock, patch  # pylint: disable=unused-import
-import requests
 import pytest
 from app import app as flask_app
 from app import db  # pylint: disable=unused-import
+from app import chat_read_cache, proxy_session
 
 # pylint: disable= redefined-outer-name
 
@@ -21,6 +21,7 @@ def app():
             "TESTING": True,
         }
     )
+    chat_read_cache.clear()
     yield flask_app
 
 
@@ -46,15 +47,17 @@ def test_static_files(client):
 def test_create_chat_endpoint(client, monkeypatch):
     """Test creating a new chat"""
 
-    # mock requests.request
+    # mock the pooled proxy session
     mock_response = Mock()
     mock_response.status_code = 201
-    mock_response.content = b'{"inserted_id": "test_chat_id_123"}'
+    mock_response.iter_content.return_value = iter(
+        [b'{"inserted_id": "test_chat_id_123"}']
+    )
     mock_response.raw.headers = {"Content-Type": "application/json"}
 
     mock_request = Mock(return_value=mock_response)
 
-    monkeypatch.setattr(requests, "request", mock_request)
+    monkeypatch.setattr(proxy_session, "request", mock_request)
 
     response = client.post(
         "/chats/api",
@@ -66,74 +69,203 @@ def test_create_chat_endpoint(client, monkeypatch):
     assert "inserted_id" in data
 
 
-def test_get_all_chats(client, monkeypatch):
-    """Test getting all chats"""
+def test_get_all_chats(client):
+    """Test getting all chats straight from mongodb"""
 
-    # mock requests.request
-    mock_response = Mock()
-    mock_response.status_code = 200
-    mock_response.content = b'[{"_id": "1", "title": "Chat 1", "messages": []}, {"_id": "2", "title": "Chat 2", "messages": []}]'  # pylint: disable=line-too-long
-    mock_response.raw.headers = {"Content-Type": "application/json"}
+    mock_db = Mock()
+    mock_db.chats.find.return_value = [
+        {"_id": "1", "title": "Chat 1", "messages": []},
+        {"_id": "2", "title": "Chat 2", "messages": []},
+    ]
 
-    mock_request = Mock(return_value=mock_response)
+    with patch("app.db", mock_db):
+        response = client.get("/chats/api/")
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data) == 2
+        # the list never carries message histories
+        mock_db.chats.find.assert_called_once_with({}, {"messages": 0})
 
-    monkeypatch.setattr(requests, "request", mock_request)
 
-    response = client.get("/chats/api/")
-    assert response.status_code == 200
-    data = response.get_json()
-    assert len(data) == 2
+def test_get_single_chat(client):
+    """Test getting a specific chat straight from mongodb"""
+
+    mock_db = Mock()
+    mock_db.chats.find_one.return_value = {
+        "_id": "test_id",
+        "title": "Test Chat",
+        "messages": [{"role": "user", "content": "Hello"}],
+    }
+
+    with patch("app.db", mock_db):
+        response = client.get("/chats/api/test_id")
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["_id"] == "test_id"
+        assert len(data["messages"]) == 1
+        mock_db.chats.find_one.assert_called_once_with({"_id": "test_id"})
+
+
+def test_chat_not_found(client):
+    """Test getting a non-existent chat"""
+
+    mock_db = Mock()
+    mock_db.chats.find_one.return_value = None
+
+    with patch("app.db", mock_db):
+        response = client.get("/chats/api/nonexistent_id")
+        assert response.status_code == 404
 
 
-def test_get_single_chat(client, monkeypatch):
-    """Test getting a specific chat"""
+def test_get_chat_window(client):
+    """Test that ?limit= only reads the last messages and reports older ones"""
+
+    mock_db = Mock()
+    mock_db.chats.find_one.return_value = {
+        "_id": "test_id",
+        "messages": [{"_id": str(i)} for i in range(3)],
+    }
+
+    with patch("app.db", mock_db):
+        response = client.get("/chats/api/test_id?limit=2")
+        data = response.get_json()
+        assert [m["_id"] for m in data["messages"]] == ["1", "2"]
+        assert data["has_more"] is True
+        mock_db.chats.find_one.assert_called_once_with(
+            {"_id": "test_id"}, {"messages": {"$slice": -3}}
+        )
+        assert client.get("/chats/api/test_id?limit=x").status_code == 400
+
+
+def test_chat_list_cached_until_write(client, monkeypatch):
+    """Test that repeated list reads hit the cache and a proxied write clears it"""
+
+    mock_db = Mock()
+    mock_db.chats.find.return_value = [{"_id": "test_id", "messages": []}]
 
-    # Mock requests.request
     mock_response = Mock()
     mock_response.status_code = 200
-    mock_response.content = b'{"_id": "test_id", "title": "Test Chat", "messages": [{"role": "user", "content": "Hello"}]}'  # pylint: disable=line-too-long
+    mock_response.iter_content.return_value = iter([b'{"status": "success"}'])
     mock_response.raw.headers = {"Content-Type": "application/json"}
+    monkeypatch.setattr(proxy_session, "request", Mock(return_value=mock_response))
 
-    mock_request = Mock(return_value=mock_response)
+    with patch("app.db", mock_db):
+        assert client.get("/chats/api/").headers["X-Cache"] == "MISS"
+        assert client.get("/chats/api/").headers["X-Cache"] == "HIT"
+        assert mock_db.chats.find.call_count == 1
 
-    monkeypatch.setattr(requests, "request", mock_request)
+        client.put("/chats/api/test_id", json={"title": "Updated"})
+        assert client.get("/chats/api/").headers["X-Cache"] == "MISS"
+        assert mock_db.chats.find.call_count == 2
 
-    response = client.get("/chats/api/test_id")
-    assert response.status_code == 200
-    data = response.get_json()
-    assert data["_id"] == "test_id"
-    assert len(data["messages"]) == 1
 
+def test_single_chat_never_cached(client):
+    """Test that a chat is read from mongo every time, as other workers write it"""
 
-def test_chat_not_found(client, monkeypatch):
-    """Test getting a non-existent chat"""
+    mock_db = Mock()
+    mock_db.chats.find_one.return_value = {"_id": "test_id", "messages": []}
+
+    with patch("app.db", mock_db):
+        for _ in range(2):
+            response = client.get("/chats/api/test_id?limit=2")
+            assert response.status_code == 200
+            assert "X-Cache" not in response.headers
+        assert mock_db.chats.find_one.call_count == 2
+
+
+def test_get_chat_summaries(client):
+    """Test that summary pages are read from mongo with a next page cursor"""
+
+    mock_db = Mock()
+    chats = [{"_id": str(i), "updated_at": f"2025-01-0{9 - i}"} for i in range(3)]
+    mock_db.chats.find.return_value.sort.return_value.limit.return_value = chats
+
+    with patch("app.db", mock_db):
+        data = client.get("/chats/api/summaries?limit=2").get_json()
+        assert [c["_id"] for c in data["chats"]] == ["0", "1"]
+        assert data["next_cursor"]
+        mock_db.chats.find.return_value.sort.return_value.limit.assert_called_with(3)
+
+        chats.pop(0)
+        page = client.get(f"/chats/api/summaries?limit=2&cursor={data['next_cursor']}")
+        assert page.get_json()["next_cursor"] is None
+        query_filter = mock_db.chats.find.call_args.args[0]
+        assert {"updated_at": {"$lt": "2025-01-08"}} in query_filter["$or"]
+
+        assert client.get("/chats/api/summaries?cursor=bad").status_code == 400
+
+
+def test_get_older_messages(client):
+    """Test that ?before= pages back through a chat from mongo"""
+
+    mock_db = Mock()
+    mock_db.chats.aggregate.return_value = iter(
+        [{"_id": "test_id", "messages": [{"_id": str(i)} for i in range(3)]}]
+    )
+
+    with patch("app.db", mock_db):
+        data = client.get("/chats/api/test_id?limit=2&before=9").get_json()
+        assert [m["_id"] for m in data["messages"]] == ["1", "2"]
+        assert data["has_more"] is True
+
+        # before is not a message of the chat
+        mock_db.chats.aggregate.return_value = iter(
+            [{"_id": "test_id", "messages": None}]
+        )
+        response = client.get("/chats/api/test_id?limit=2&before=missing")
+        assert response.status_code == 404
+
+
+def test_get_new_messages(client):
+    """Test that ?since= reads only the newer messages from mongo"""
+
+    mock_db = Mock()
+    mock_db.chats.aggregate.return_value = iter(
+        [{"_id": "test_id", "messages": [{"_id": "m2"}]}]
+    )
+
+    with patch("app.db", mock_db):
+        response = client.get("/chats/api/test_id/messages?since=m1")
+        assert response.get_json()["messages"] == [{"_id": "m2"}]
+        assert "X-Cache" not in response.headers
+        pipeline = mock_db.chats.aggregate.call_args.args[0]
+        assert pipeline[0] == {"$match": {"_id": "test_id"}}
+
+        assert client.get("/chats/api/test_id/messages").status_code == 400
+
+
+def test_other_chat_reads_are_proxied(client, monkeypatch):
+    """Test that reads the web-app does not serve itself go to the ml client"""
 
-    # Mock requests.request
     mock_response = Mock()
-    mock_response.status_code = 404
-    mock_response.content = b'{"error": "Chat not found"}'
+    mock_response.status_code = 200
+    mock_response.iter_content.return_value = iter([b'{"hits": 0}'])
     mock_response.raw.headers = {"Content-Type": "application/json"}
 
     mock_request = Mock(return_value=mock_response)
 
-    monkeypatch.setattr(requests, "request", mock_request)
+    monkeypatch.setattr(proxy_session, "request", mock_request)
 
-    response = client.get("/chats/api/nonexistent_id")
-    assert response.status_code == 404
+    mock_db = Mock()
+    with patch("app.db", mock_db):
+        client.get("/chats/api/cache")
+        client.get("/chats/api/test_id?other=1")
+    assert mock_request.call_count == 2
+    mock_db.chats.find_one.assert_not_called()
 
 
 def test_update_chat(client, monkeypatch):
     """Test updating a chat"""
 
-    # Mock requests.request
+    # Mock the pooled proxy session
     mock_response = Mock()
     mock_response.status_code = 200
-    mock_response.content = b'{"status": "success"}'
+    mock_response.iter_content.return_value = iter([b'{"status": "success"}'])
     mock_response.raw.headers = {"Content-Type": "application/json"}
 
     mock_request = Mock(return_value=mock_response)
 
-    monkeypatch.setattr(requests, "request", mock_request)
+    monkeypatch.setattr(proxy_session, "request", mock_request)
 
     response = client.put(
         "/chats/api/test_id",
@@ -146,15 +278,15 @@ def test_update_chat(client, monkeypatch):
 def test_delete_chat(client, monkeypatch):
     """Test deleting a chat"""
 
-    # Mock requests.request
+    # Mock the pooled proxy session
     mock_response = Mock()
     mock_response.status_code = 200
-    mock_response.content = b'{"status": "success"}'
+    mock_response.iter_content.return_value = iter([b'{"status": "success"}'])
     mock_response.raw.headers = {"Content-Type": "application/json"}
 
     mock_request = Mock(return_value=mock_response)
 
-    monkeypatch.setattr(requests, "request", mock_request)
+    monkeypatch.setattr(proxy_session, "request", mock_request)
 
     response = client.delete("/chats/api/test_id")
     assert response.status_code == 200
@@ -163,15 +295,17 @@ def test_delete_chat(client, monkeypatch):
 def test_create_message(client, monkeypatch):
     """Test creating a message"""
 
-    # Mock requests.request
+    # Mock the pooled proxy session
     mock_response = Mock()
     mock_response.status_code = 201
-    mock_response.content = b'{"inserted_id": "test_message_id_456"}'
+    mock_response.iter_content.return_value = iter(
+        [b'{"inserted_id": "test_message_id_456"}']
+    )
     mock_response.raw.headers = {"Content-Type": "application/json"}
 
     mock_request = Mock(return_value=mock_response)
 
-    monkeypatch.setattr(requests, "request", mock_request)
+    monkeypatch.setattr(proxy_session, "request", mock_request)
 
     response = client.post(
         "/messages/api",
@@ -198,16 +332,84 @@ def test_get_messages(client, monkeypatch):  # pylint: disable=unused-argument
 def test_proxy_speech(client, monkeypatch):
     """Test proxy speech endpoint"""
 
-    # Mock requests.request
+    # Mock the pooled proxy session
     mock_response = Mock()
     mock_response.status_code = 200
-    mock_response.content = b"audio_data"
+    mock_response.iter_content.return_value = iter([b"audio_data"])
     mock_response.raw.headers = {"Content-Type": "audio/mpeg"}
 
     mock_request = Mock(return_value=mock_response)
 
-    monkeypatch.setattr(requests, "request", mock_request)
+    monkeypatch.setattr(proxy_session, "request", mock_request)
 
     response = client.post("/speech/api/generate")
     assert response.status_code == 200
     assert response.data == b"audio_data"
+
+
+def test_proxy_speech_upload_chunk(client, monkeypatch):
+    """Test that resumable upload chunks are proxied with their offset"""
+
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.iter_content.return_value = iter([b'{"offset": 4}'])
+    mock_response.raw.headers = {"Content-Type": "application/json"}
+
+    mock_request = Mock(return_value=mock_response)
+
+    monkeypatch.setattr(proxy_session, "request", mock_request)
+
+    response = client.put(
+        "/speech/api/uploads/abc", data=b"FAKE", headers={"Upload-Offset": "0"}
+    )
+    assert response.status_code == 200
+    kwargs = mock_request.call_args.kwargs
+    assert kwargs["method"] == "PUT"
+    assert kwargs["data"].read() == b"FAKE"
+    assert kwargs["headers"]["Upload-Offset"] == "0"
+
+
+def test_proxy_streams_event_stream(client, monkeypatch):
+    """Test that server-sent events are passed through unbuffered"""
+
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.iter_content.return_value = iter(
+        [b'data: {"delta": "Hel"}\n\n', b'data: {"delta": "lo"}\n\n']
+    )
+    mock_response.raw.headers = {"Content-Type": "text/event-stream"}
+
+    mock_request = Mock(return_value=mock_response)
+
+    monkeypatch.setattr(proxy_session, "request", mock_request)
+
+    response = client.post(
+        "/chats/api/test_id/message?stream=1",
+        json={"role": "user", "content": "Hi"},
+    )
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.get_data() == (
+        b'data: {"delta": "Hel"}\n\ndata: {"delta": "lo"}\n\n'
+    )
+    assert mock_request.call_args.kwargs["stream"] is True
+    assert mock_request.call_args.kwargs["params"] == [("stream", "1")]
+
+
+def test_proxy_reuses_pooled_connection(client, monkeypatch):
+    """Test that the proxy uses the shared session, per-route timeouts and
+    gives the connection back once the body is sent"""
+
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.iter_content.return_value = iter([b'{"transcript": "hi"}'])
+    mock_response.raw.headers = {"Content-Type": "application/json"}
+
+    mock_request = Mock(return_value=mock_response)
+
+    monkeypatch.setattr(proxy_session, "request", mock_request)
+
+    response = client.post("/speech/api/transcribe", data=b"AUDIO")
+    assert response.get_json() == {"transcript": "hi"}
+    assert mock_request.call_args.kwargs["timeout"] == (3.0, 120.0)
+    mock_response.close.assert_called_once()
@@ -0,0 +1,37 @@
+"""
+Unit tests for the gunicorn entry point of the web app
+"""
+
+from serve import Server, default_workers, server_options
+
+
+def test_default_workers_scale_with_cpus():
+    """workers follow gunicorn's 2n + 1"""
+    assert default_workers(1) == 3
+    assert default_workers(4) == 9
+
+
+def test_server_options_from_env(monkeypatch):
+    """environment variables override the defaults"""
+    monkeypatch.setenv("PORT", "6000")
+    monkeypatch.setenv("SERVE_WORKERS", "3")
+    monkeypatch.setenv("SERVE_THREADS", "2")
+    monkeypatch.setenv("SERVE_ACCESS_LOG", "")
+    options = server_options()
+    assert options["bind"] == "0.0.0.0:6000"
+    assert options["workers"] == 3
+    assert options["threads"] == 2
+    assert options["preload_app"] is True
+    assert options["accesslog"] is None
+
+
+def test_server_loads_config():
+    """options end up in the gunicorn config and the app is served as is"""
+
+    def wsgi_app(environ, start_response):  # pylint: disable=unused-argument
+        return []
+
+    server = Server(wsgi_app, {**server_options(), "workers": 2, "not_a_setting": 1})
+    assert server.cfg.workers == 2
+    assert server.cfg.worker_class_str == "gthread"
+    assert server.load() is wsgi_app